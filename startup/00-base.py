@@ -48,10 +48,11 @@ import sys
 from bluesky.run_engine import RunEngine
 import nslsii
 import redis
-from redis_json_dict import RedisJSONDict
+from startup.utils.md_cache import CachedRedisDict
 
 uri = "info.lix.nsls2.bnl.gov"
-new_md = RedisJSONDict(redis.Redis(uri), prefix="")
+# same keys in Redis as RedisJSONDict, but read from a local copy, and the writes go out together
+new_md = CachedRedisDict(redis.Redis(uri), prefix="")
 
 class CustomRunEngine(RunEngine):
     def __call__(self, *args, **kwargs):
@@ -62,7 +63,15 @@ class CustomRunEngine(RunEngine):
         if username is None or proposal_id is None or run_id is None:
             login()
 
-        return super().__call__(*args, **kwargs)
+        # without keyspace notifications, changes made by other clients are only picked up here
+        if not self.md.notifications:
+            self.md.reload()
+        # metadata changes since the last plan are written to Redis once
+        self.md.flush()
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            self.md.flush()
 
 RE = CustomRunEngine()
 
@@ -22,6 +22,9 @@ data_destination = data_file_path.lustre_legacy.value  # this is where all IOC d
 #proc_destination = data_file_path.lustre_proposals.value
 proc_destination = data_file_path.lustre_legacy.value
 procdir_prefix = "pass-"  
+# the run catalog searched by list_scans(), shared by the bsui sessions on this machine
+# on the local disk, SQLite cannot lock reliably on a network file system
+run_catalog_path = "/var/tmp/lix/run_catalog.sqlite"
 
 bl_comm_proposal = "317919"
 
@@ -1,6 +1,7 @@
 print(f"Loading {__file__}...")
 
 import time
+import itertools
 import pylab as plt
 from pathlib import Path
 import redis
@@ -35,31 +36,73 @@ def save_det_config_to_redis():
         r.set("det_config", json.dumps(dets_attr))
         r.set("det_config_timestamp", time.time())
 
-def fetch_scan(**kwargs):
+from startup.utils.scan_table import ScanTable
+
+def fetch_scan(fields=None, stream_name="primary", **kwargs):
+    """ returns the header(s) and a ScanTable of the data, from the last run, or the runs that match kwargs
+        fields: read only these columns, e.g. fetch_scan(fields=["ss_x", "em1_sum_all_mean_value"])
+        detector images are read from the files only when their columns are accessed
+        use .to_dataframe() on the table for a pandas DataFrame, as returned before
+    """
     if len(kwargs) == 0:  # Retrieve last dataset
-        header = db[-1]
-        return header, header.table(fill=True)
+        header = header_cache[-1]
+        return header, ScanTable(header, fields, stream_name)
+    elif list(kwargs.keys())==['uid']:
+        header = header_cache[kwargs['uid']]
+        return [header], ScanTable(header, fields, stream_name)
+    else:
+        headers = [header_cache[h] for h in db(**kwargs)]
+        return headers, ScanTable(headers, fields, stream_name)
+
+from startup.utils.run_catalog import RunCatalog
+
+# index of the runs, fed by doc_dispatcher (see 90-settings), at run_catalog_path (see 02-vars)
+# older runs can be added using run_catalog.backfill(db(since=...))
+# without the catalog, list_scans() searches databroker
+try:
+    os.makedirs(os.path.dirname(run_catalog_path), mode=0o777, exist_ok=True)
+    run_catalog = RunCatalog(run_catalog_path)
+except Exception as e:
+    print(f"run catalog at {run_catalog_path} is not available, list_scans() will search databroker: {e}")
+    run_catalog = None
+
+def list_scans(since=None, until=None, limit=None, offset=0, use_db=None, **kwargs):
+    """ print and return the uids of the runs that match the metadata given in kwargs, most recent first
+        the search is done in run_catalog if it has all the runs since the given time (or at least
+        offset+limit matching runs, without since), and the values are plain (not e.g. {"$in": [...]}), 
+        otherwise in databroker
+        use_db=True/False forces databroker/run_catalog
+        since/until: timestamp or date string, e.g. "2025-03-01"
+        limit/offset: return only part of a long list, e.g. list_scans(plan_name="ct", limit=10)
+    """
+    if run_catalog is None:
+        use_db = True
+    elif use_db is None:
+        use_db = not run_catalog.covers(since=since, until=until, limit=limit, offset=offset,
+                                        latest=db[-1].start['time'], **kwargs)
+    if use_db:
+        if since is not None:
+            kwargs['since'] = since
+        if until is not None:
+            kwargs['until'] = until
+        # stop reading headers once there are enough
+        runs = [h.start for h in itertools.islice(db(**kwargs), offset, None if limit is None else offset+limit)]
     else:
-        headers = db(**kwargs)
-        return headers, db.get_table(headers, fill=True)
+        runs = run_catalog.query(since=since, until=until, limit=limit, offset=offset, **kwargs)
 
-def list_scans(**kwargs):
-    headers = list(db(**kwargs))
     uids = []
-    for h in headers:
-        s = "%8s%10s%10s" % (h.start['proposal_id'], h.start['run_id'], h.start['plan_name'])
+    for start in runs:
+        s = "%8s%10s%10s" % (start['proposal_id'], start['run_id'], start['plan_name'])
         try:
-            s = "%s%8d" % (s, h.start['num_points'])
+            s = "%s%8d" % (s, start['num_points'])
         except:
             s = "%s%8s" % (s,"")
-        t = time.asctime(time.localtime(h.start['time'])).split()
+        t = time.asctime(time.localtime(start['time'])).split()
         s = s + (" %s-%s-%s %s " % (t[4], t[1], t[2], t[3])) 
-        try:
-            s = "%s %s" % (s, h.start['sample_name'])
-        except:
-            pass
-        print(s, h.start['uid'])
-        uids.append(h.start['uid'])
+        if start.get('sample_name') is not None:
+            s = "%s %s" % (s, start['sample_name'])
+        print(s, start['uid'])
+        uids.append(start['uid'])
 
     return(uids)
 
@@ -14,7 +14,13 @@ import warnings
 import h5py
 import json
 import copy, shutil
+import errno, zlib, threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from databroker import Header
+from startup.utils.header_cache import HeaderCache, CachedHeader
+
+# shared by pack_h5/hdf5_export etc., so that a packing job reads each header from databroker once
+header_cache = HeaderCache(db, maxsize=64, ttl=1800)
 
 def conv_to_list(d): 
     if isinstance(d, float) or isinstance(d, int) or isinstance(d, str): 
@@ -40,6 +46,141 @@ def read_pilatus_hdf(fh5):
 def read_xspress3_hdf(fh5):
     pass
 
+def _file_crc32(fn, bufsize=1<<22):
+    crc = 0
+    with open(fn, "rb") as fh:
+        while True:
+            buf = fh.read(bufsize)
+            if not buf:
+                break
+            crc = zlib.crc32(buf, crc)
+    return crc
+
+def _copy_kernel(fs, fd, size):
+    """ copy within the kernel, copy_file_range if possible, otherwise sendfile
+    """
+    use_cfr = hasattr(os, "copy_file_range")
+    copied = 0
+    while copied<size:
+        if use_cfr:
+            try:
+                n = os.copy_file_range(fs.fileno(), fd.fileno(), size-copied)
+            except OSError as e:
+                if copied>0 or e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL]:
+                    raise
+                use_cfr = False
+                continue
+        else:
+            n = os.sendfile(fd.fileno(), fs.fileno(), copied, size-copied)
+        if n==0:
+            break
+        copied += n
+    return copied
+
+def _copy_crc32(fs, fd, bufsize=1<<22):
+    """ copy through a buffer, computing the crc32 of the source on the way
+    """
+    crc = 0
+    copied = 0
+    while True:
+        buf = fs.read(bufsize)
+        if not buf:
+            break
+        fd.write(buf)
+        crc = zlib.crc32(buf, crc)
+        copied += len(buf)
+    return copied,crc
+
+def relocate_file(src, dest, checksum=True, debug=False):
+    """ move src to dest
+        if both are on the same file system, this is just os.rename
+        otherwise the data are copied to dest_partial, verified, then renamed to dest before src is removed
+        with checksum, the crc32 of src is computed during the copy and only dest_partial is read back,
+        without it, the copy is done within the kernel and only the size is verified
+    """
+    fdir = os.path.dirname(dest)
+    if not os.path.exists(fdir):
+        makedirs(fdir, mode=0o2775)
+    try:
+        os.rename(src, dest)
+        if debug:
+            print(f"renamed {src} to {dest}")
+        return
+    except OSError as e:
+        if e.errno!=errno.EXDEV:
+            raise
+
+    if debug:
+        print(f"copying {src} to {fdir}")
+    tfn = dest+"_partial"
+    try:
+        with open(src, "rb") as fs, open(tfn, "wb") as fd:
+            size = os.fstat(fs.fileno()).st_size
+            if checksum:
+                copied,crc = _copy_crc32(fs, fd)
+                fd.flush()
+            else:
+                copied = _copy_kernel(fs, fd, size)
+            os.fsync(fd.fileno())
+
+        if copied!=size or (checksum and crc!=_file_crc32(tfn)):
+            raise IOError(f"failed to copy {src} to {dest}, {copied} of {size} bytes copied.")
+        os.rename(tfn, dest)
+    finally:
+        if os.path.exists(tfn):
+            os.remove(tfn)
+    os.remove(src)
+
+class ResourceRelocator:
+    """ relocate files in the background, e.g. from the PPU RAMDISK to GPFS as soon as a scan stops
+        locate_h5_resource() waits for any relocation of the same file still in progress
+    """
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, src, dest, checksum=True):
+        with self.lock:
+            if dest in self.pending:
+                return self.pending[dest]
+            fut = self.executor.submit(relocate_file, src, dest, checksum)
+            self.pending[dest] = fut
+        fut.add_done_callback(lambda f: self._done(src, dest, f))
+        return fut
+
+    def _done(self, src, dest, fut):
+        with self.lock:
+            self.pending.pop(dest, None)
+        if fut.exception() is not None:
+            print(f"failed to relocate {src}: {fut.exception()}")
+
+    def wait(self, dest, timeout=None):
+        """ a failed relocation is only reported, the caller then finds the file where it was, 
+            and relocates or copies it again as usual
+        """
+        with self.lock:
+            fut = self.pending.get(dest)
+        if fut is None:
+            return
+        try:
+            fut.result(timeout)
+        except FutureTimeoutError:
+            raise
+        except Exception as e:
+            print(f"background relocation to {dest} failed: {e}")
+
+    def relocate_resource(self, res, replace_res_path):
+        """ only resources that exist at the original location and need to be moved are submitted
+        """
+        fn_orig = str(Path(res["root"]) / Path(res["resource_path"]))
+        fn = update_res_path(fn_orig, replace_res_path)
+        if PurePath(fn_orig)==PurePath(fn) or not os.path.exists(fn_orig) or os.path.exists(fn):
+            return None
+        return self.submit(fn_orig, fn)
+
+resource_relocator = ResourceRelocator()
+
 def locate_h5_resource(res, replace_res_path, debug=False):
     """ this is intended to move h5 file created by Pilatus
         these files are originally saved on PPU RAMDISK, but should be moved to the IOC data directory
@@ -50,6 +191,8 @@ def locate_h5_resource(res, replace_res_path, debug=False):
     fn = update_res_path(fn_orig, replace_res_path)
     if debug:
         print(f"resource locations: {fn_orig} -> {fn}")
+    # the file may already be on its way, see prerelocate_resources()
+    resource_relocator.wait(fn)
     
     if not(os.path.exists(fn_orig) or os.path.exists(fn)):
         print(f"could not locate the resource at either {fn} or {fn_orig} ...")
@@ -59,15 +202,7 @@ def locate_h5_resource(res, replace_res_path, debug=False):
             print(f"both {fn} and {fn_orig} exist, resolve the conflict manually first ..." )
             raise Exception
         if not os.path.exists(fn):
-            fdir = os.path.dirname(fn)
-            if not os.path.exists(fdir):
-                makedirs(fdir, mode=0o2775)
-            if debug:
-                print(f"copying {fn_orig} to {fdir}")
-            tfn = fn+"_partial"
-            shutil.copy(fn_orig, tfn)
-            os.rename(tfn, fn)
-            os.remove(fn_orig)
+            relocate_file(fn_orig, fn, debug=debug)
     
     hf5 = h5py.File(fn, "r")
     ## different format for pilatus and xspress3
@@ -88,15 +223,127 @@ def locate_h5_resource(res, replace_res_path, debug=False):
         else:
             raise
     except:
-        hf5.close() 
+        hf5.close()
         raise Exception("don't know how to read the hdf file: ", fn)
-        
+
     return hf5,data,timestamps
 
+def create_dataset_like(grp, key, src, shape=None, chunks=None):
+    """ create an empty dataset that uses the same data type and filter pipeline as src
+        shape/chunks default to those of src; when the dataset is meant to hold several
+        copies of src, e.g. shape=(N, *src.shape), use chunks=(1, *src.chunks) so that
+        the raw chunks from src can be written directly
+    """
+    if shape is None:
+        shape = src.shape
+    if chunks is None:
+        chunks = src.chunks if src.chunks is not None else (1, *src.shape[1:])
+    dcpl = src.id.get_create_plist().copy()
+    dcpl.set_chunk(tuple(chunks))
+    space = h5py.h5s.create_simple(tuple(shape))
+    dsid = h5py.h5d.create(grp.id, key.encode(), src.id.get_type(), space, dcpl=dcpl)
+    return h5py.Dataset(dsid)
+
+def copy_h5_data_chunked(src, dest, offset=(), debug=False):
+    """ copy the h5 dataset src into dest[offset], one source chunk at a time
+        offset gives the leading indices in dest, e.g. (i,) to copy src into dest[i]
+        if dest has the same filters and chunk shape as src (see create_dataset_like),
+        the compressed chunks are transferred directly without decompression
+        otherwise the data are read/written one chunk (or one frame) at a time
+        in either case only a single chunk is held in memory
+    """
+    offset = tuple(offset)
+    if src.chunks is not None and dest.chunks==(1,)*len(offset)+src.chunks and \
+       h5py.filters.get_filters(src.id.get_create_plist())==h5py.filters.get_filters(dest.id.get_create_plist()):
+        if debug:
+            print(f"direct chunk copy of {src.name}, {src.id.get_num_chunks()} chunks ...")
+        for i in range(src.id.get_num_chunks()):
+            info = src.id.get_chunk_info(i)
+            mask,buf = src.id.read_direct_chunk(info.chunk_offset)
+            dest.id.write_direct_chunk(offset+tuple(info.chunk_offset), buf, filter_mask=mask)
+        return
+
+    if debug:
+        print(f"chunk-wise copy of {src.name} ...")
+    if len(src.shape)==0:
+        dest[offset] = src[()]
+        return
+    step = src.chunks[0] if src.chunks is not None else 1
+    for i in range(0, src.shape[0], step):
+        dest[offset+(slice(i, i+step),)] = src[i:i+step]
+
+def write_frames_streaming(grp, key, frames, n_events, debug=False):
+    """ frames is an iterator that returns the detector data one event at a time
+        a 1D or 2D event is a single frame, a 3D event (several frames per point) is appended along the first axis
+        the dataset is chunked one frame at a time, (1, H, W) as in the source datasets and copy_h5_data_chunked
+        the dataset is created when the first frame arrives, n_events is used to pre-size it
+    """
+    dataset = None
+    i0 = 0
+    for frame in frames:
+        if frame.ndim<3:
+            frame = frame[np.newaxis]
+        if dataset is None:
+            shape = (n_events*frame.shape[0], *frame.shape[1:])
+            chunks = (1, *frame.shape[1:])
+            if debug:
+                print("data shape: ", shape, "     chunks: ", chunks)
+            dataset = grp.create_dataset(key, shape=shape, dtype=frame.dtype, maxshape=(None, *shape[1:]),
+                                         compression='gzip', fletcher32=True, chunks=chunks)
+        if i0+frame.shape[0]>dataset.shape[0]:
+            dataset.resize(i0+frame.shape[0], axis=0)
+        dataset[i0:i0+frame.shape[0]] = frame
+        i0 += frame.shape[0]
+
+    if dataset is not None and i0<dataset.shape[0]:
+        dataset.resize(i0, axis=0)
+    return dataset
+
+
+def _append_columns(cols, ev, keys):
+    if isinstance(ev['time'], list): # event page
+        cols['time'].extend(ev['time'])
+        for k in keys:
+            cols['data'][k].extend(ev['data'][k])
+            cols['timestamps'][k].extend(ev['timestamps'][k])
+    else:
+        cols['time'].append(ev['time'])
+        for k in keys:
+            cols['data'][k].append(ev['data'][k])
+            cols['timestamps'][k].append(ev['timestamps'][k])
+
+def event_columns(events, keys):
+    """ consume the events (or event pages) one at a time, and keep only time, data and timestamps 
+        of the specified keys, as lists, i.e. the columns of the event table
+    """
+    cols = {'time': [], 'data': {k:[] for k in keys}, 'timestamps': {k:[] for k in keys}}
+    for ev in events:
+        _append_columns(cols, ev, keys)
+    return cols
+
+def stream_columns(events, keys):
+    """ same as event_columns(), for the events of several streams in a single pass
+        keys: {descriptor uid: keys}, returns {descriptor uid: columns}, other descriptors are skipped
+    """
+    cols = {uid: {'time': [], 'data': {k:[] for k in ks}, 'timestamps': {k:[] for k in ks}} 
+            for uid,ks in keys.items()}
+    for ev in events:
+        if ev['descriptor'] in cols:
+            _append_columns(cols[ev['descriptor']], ev, keys[ev['descriptor']])
+    return cols
+
+def resolve_resource_uids(datum_ids):
+    """ datum ids are formatted as {resource uid}/{index}
+        return the unique resource uids, in the order they first appear
+    """
+    res_uids = np.char.partition(np.asarray(datum_ids, dtype=str), '/')[:,0]
+    uids,idx = np.unique(res_uids, return_index=True)
+    return list(uids[np.argsort(idx)])
+
 
 def hdf5_export(headers, filename, debug=False,
            stream_name=None, fields=None, bulk_h5_res=True,
-           save_timestamps=True, use_uid=True, db=None, replace_res_path={}):
+           save_timestamps=True, use_uid=True, db=None, replace_res_path={}, streaming=True):
     """
     Create hdf5 file to preserve the structure of databroker.
 
@@ -123,13 +370,18 @@ def hdf5_export(headers, filename, debug=False,
         db should be included in hdr.
     replace_res_path: in case the resource has been moved, specify how the path should be updated
         e.g. replace_res_path = {"exp_path/hdf": "nsls2/xf16id1/data/2022-1"}
+    streaming: Bool, optional
+        copy detector data one chunk/event at a time, instead of reading all frames into memory first
         
     Revision 2021 May
         Now that the resource is a h5 file, copy data directly from the file 
+    Revision 2026 Oct
+        streaming export, peak memory no longer scales with the number of frames
         
     """
-    if isinstance(headers, Header):
+    if isinstance(headers, (Header, CachedHeader)):
         headers = [headers]
+    headers = [h if isinstance(h, CachedHeader) else CachedHeader(h) for h in headers]
 
     with h5py.File(filename, "w") as f:
         #f.swmr_mode = True # Unable to start swmr writing (file superblock version - should be at least 3)
@@ -141,19 +393,22 @@ def hdf5_export(headers, filename, debug=False,
             if db is None:
                 raise RuntimeError('db is not defined in header, so we need to input db explicitly.')
                 
-            res_docs = {}
-            for n,d in header.documents():
-                if n=="resource":
-                    res_docs[d['uid']] = d
-            if debug:
-                print("res_docs:\n", res_docs)
-                    
             try:
                 descriptors = header.descriptors
             except KeyError:
                 warnings.warn("Header with uid {header.uid} contains no "
                               "data.".format(header), UserWarning)
                 continue
+
+            # only keep the columns that will be saved, instead of the full list of events
+            # all streams are read in a single pass, which also picks up the resource documents
+            keys = {desc['uid']: [k for k in desc['data_keys'].keys() if fields is None or k in fields] 
+                    for desc in descriptors if not stream_name or desc['name']==stream_name}
+            all_cols = stream_columns(header.event_pages(stream_name=stream_name or None), keys)
+            res_docs = header.resources()
+            if debug:
+                print("res_docs:\n", res_docs)
+                    
             if use_uid:
                 top_group_name = header.start['uid']
             else:
@@ -179,24 +434,23 @@ def hdf5_export(headers, filename, debug=False,
 
                 _safe_attrs_assignment(desc_group, descriptor)
 
-                # fill can be bool or list
-                events = list(header.events(stream_name=descriptor['name'], fill=False))
+                cols = all_cols[descriptor['uid']]
+                n_events = len(cols['time'])
+                if n_events==0:
+                    warnings.warn(f"stream {descriptor['name']} contains no events.", UserWarning)
+                    continue
 
                 res_dict = {}
-                for k, v in list(events[0]['data'].items()):
-                    if not isinstance(v, str):
+                for k, v in cols['data'].items():
+                    if not isinstance(v[0], str):
                         continue
-                    if v.split('/')[0] in res_docs.keys():
-                        res_dict[k] = []
-                        for ev in events:
-                            res_uid = ev['data'][k].split("/")[0]
-                            if not res_uid in res_dict[k]:
-                                res_dict[k].append(res_uid)
+                    if v[0].split('/')[0] in res_docs.keys():
+                        res_dict[k] = resolve_resource_uids(v)
 
                 if debug:
                     print("res_dict:\n", res_dict)
 
-                event_times = [e['time'] for e in events]
+                event_times = cols['time']
                 desc_group.create_dataset('time', data=event_times,
                                           compression='gzip', fletcher32=True)
                 data_group = desc_group.create_group('data')
@@ -211,7 +465,7 @@ def hdf5_export(headers, filename, debug=False,
                             continue
                     print(f"creating dataset for {key} ...")
                     if save_timestamps:
-                        timestamps = [e['timestamps'][key] for e in events]
+                        timestamps = cols['timestamps'][key]
 
                     if key in list(res_dict.keys()):
                         res = res_docs[res_dict[key][0]]
@@ -235,23 +489,36 @@ def hdf5_export(headers, filename, debug=False,
                                 dataset = data_group[key]
                             else: # ideally this should never happen, only 1 hdf5 file/resource per scan
                                 for i in range(N):
-                                    hf5,data,ts = locate_h5_resource(res_docs[res_dict[key][i]])
+                                    hf5,data,ts = locate_h5_resource(res_docs[res_dict[key][i]], replace_res_path=rp, debug=debug)
                                     if i==0:
-                                        dataset = data_group.create_dataset(
-                                                key, shape=(N, *data.shape), 
-                                                compression=data.compression,
-                                                chunks=(1, *data.chunks))
-                                        timestamps = np.zeros(shape=(N, ts.shape))
-                                    dataset[i,:] = data
+                                        if streaming:
+                                            dataset = create_dataset_like(data_group, key, data, shape=(N, *data.shape),
+                                                                          chunks=(1, *(data.chunks or (1, *data.shape[1:]))))
+                                        else:
+                                            dataset = data_group.create_dataset(
+                                                    key, shape=(N, *data.shape), 
+                                                    compression=data.compression,
+                                                    chunks=(1, *data.chunks))
+                                        timestamps = np.zeros(shape=(N, *ts.shape))
+                                    if streaming:
+                                        copy_h5_data_chunked(data, dataset, offset=(i,), debug=debug)
+                                    else:
+                                        dataset[i,:] = data
                                     timestamps[i,:] = ts
                                     hf5.close()
+                        elif streaming:
+                            print(f"getting resource data using handlers, one event at a time ...")
+                            evs = header.events(stream_name=descriptor['name'], fields=[key], fill=True)
+                            frames = (np.asarray(ev['data'][key]) for ev in evs)
+                            rawdata = None
+                            dataset = write_frames_streaming(data_group, key, frames, n_events, debug=debug)
                         else:
                             print(f"getting resource data using handlers ...")
                             rawdata = header.table(stream_name=descriptor['name'], 
                                                    fields=[key], fill=True)[key]   # this returns the time stamps as well
                     else:
                         print(f"compiling resource data from individual events ...")
-                        rawdata = [e['data'][key] for e in events]
+                        rawdata = cols['data'][key]
 
                     if save_timestamps:
                         ts_group.create_dataset(key, data=timestamps,
@@ -357,7 +624,7 @@ def filter_fields(headers, unwanted_fields):
     set:
         set of selected names
     """
-    if isinstance(headers, Header):
+    if isinstance(headers, (Header, CachedHeader)):
         headers = [headers]
     whitelist = set()
     for header in headers:
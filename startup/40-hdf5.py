@@ -1,10 +1,12 @@
 print(f"Loading {__file__}...")
 
 import h5py,json,os
-import threading
+import threading,queue
 import numpy as np
 import epics,socket
 from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor
 
 global proc_path
 
@@ -44,6 +46,47 @@ def pack_h5_with_lock(*args, **kwargs):
     pack_h5_lock.release()    
     return ret
 
+# number of worker processes used by pack_h5 to export a list of uids in parallel
+max_packing_workers = 6
+# the worker processes start from scratch: they load these startup files, and connect to this databroker catalog
+packing_worker_files = [os.path.join(os.path.dirname(__file__), fn) 
+                        for fn in ["02-vars.py", "02-utils.py", "39-original_suitcase.py"]]
+packing_worker_db = "lix"
+
+from startup.utils.pack_worker import init_export_worker, export_header
+
+def hdf5_export_parallel(headers, filename, max_workers=max_packing_workers, debug=False, **kwargs):
+    """ each header is exported into its own temporary file by a worker process
+        the top-level groups are then merged into filename using h5py copy, which copies 
+        the chunks without decompressing them
+        the total time should be close to that of the slowest header, plus a few seconds to start the workers
+        
+        the workers are spawned, a forked child could inherit a lock held by one of the threads in bsui 
+        (CA, logging, h5py) and hang; see startup/utils/pack_worker.py
+    """
+    uids = [h.start['uid'] for h in headers]
+    parts = [f"{filename}.part{i}" for i in range(len(uids))]
+    ctx = multiprocessing.get_context("spawn")
+    t0 = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(uids)), mp_context=ctx, 
+                                 initializer=init_export_worker, 
+                                 initargs=(packing_worker_db, packing_worker_files)) as pool:
+            futures = [pool.submit(export_header, u, fp, kwargs) for u,fp in zip(uids, parts)]
+            for fut in futures:
+                fut.result()
+        if debug:
+            print(f"exported {len(uids)} headers in {time.time()-t0:.1f} sec, merging ...")
+        with h5py.File(filename, "w") as f:
+            for fp in parts:
+                with h5py.File(fp, "r") as fs:
+                    for grp in fs.keys():
+                        fs.copy(fs[grp], f, name=grp)
+    finally:
+        for fp in parts:
+            if os.path.exists(fp):
+                os.remove(fp)
+
 
 def compile_replace_res_path(h):
     """ protocol prior to May 2022:
@@ -56,8 +99,11 @@ def compile_replace_res_path(h):
                 e.g. /nsls2/data/lix/legacy/%s/2022-1/310032/test
             md['pilatus']['ramdisk'] specifies where the Pilatus data are originally saved
                 e.g. /exp_path/hdf
+        h can be either a header, a uid, or the start document itself
     """
-    md = h.start
+    if isinstance(h, str):
+        h = header_cache[h]
+    md = h if isinstance(h, dict) else h.start
     ret = {}
     dpath = md['data_path']
     try:
@@ -68,27 +114,63 @@ def compile_replace_res_path(h):
     
     return ret
 
+class ResourcePrerelocator:
+    """ RE subscriber, start moving the resource files (e.g. from the PPU RAMDISK) as soon as the run stops
+        so that packing does not need to wait for the copy
+        the RunEngine runs one plan at a time, the state of a run that never stopped is dropped when 
+        the next one starts
+    """
+    def __init__(self, relocator):
+        self.relocator = relocator
+        self.run = None
+
+    def __call__(self, name, doc):
+        if name=='start':
+            self.run = {'start': doc, 'resources': []}
+        elif self.run is None:
+            return
+        elif name=='resource' and doc.get('run_start')==self.run['start']['uid']:
+            self.run['resources'].append(doc)
+        elif name=='stop' and doc['run_start']==self.run['start']['uid']:
+            run, self.run = self.run, None   # done with the run, whether it succeeded or not
+            try:
+                rp = compile_replace_res_path(run['start'])
+            except Exception as e:
+                print(f"cannot relocate resources for {doc['run_start']}: {e}")
+                return
+            for res in run['resources']:
+                if res['spec']=="AD_HDF5":
+                    self.relocator.relocate_resource(res, rp)
+
+prerelocate_resources = ResourcePrerelocator(resource_relocator)
+RE.subscribe(prerelocate_resources)
+
+# only these fields are considered relevant to be saved in the hdf5 file
+pack_h5_fields = ['em1_sum_all_mean_value', 'em2_sum_all_mean_value', 'em2_ts_SumAll', 'em1_ts_SumAll',
+                  'xsp3_spectrum_array_data', 'xsp3_image', "ktx22_image", "pilatus_trigger_time",
+                  'pil1M_image', 'pilW1_image', 'pilW2_image', 
+                  'pil1M_ext_image', 'pilW1_ext_image', 'pilW2_ext_image']
+
 def pack_h5(uids, dest_dir='', fn=None, fix_sample_name=True, stream_name=None, 
-            attach_uv_file=False, delete_old_file=True, include_motor_pos=True, debug=False,
-            fields=['em1_sum_all_mean_value', 'em2_sum_all_mean_value', 'em2_ts_SumAll', 'em1_ts_SumAll',
-                    'xsp3_spectrum_array_data', 'xsp3_image', "ktx22_image", "pilatus_trigger_time",
-                    'pil1M_image', 'pilW1_image', 'pilW2_image', 
-                    'pil1M_ext_image', 'pilW1_ext_image', 'pilW2_ext_image'], replace_res_path={}):
+            attach_uv_file=False, delete_old_file=True, include_motor_pos=True, debug=False, parallel=True,
+            fields=pack_h5_fields, replace_res_path={}):
     """ if only 1 uid is given, use the sample name as the file name
         any metadata associated with each uid will be retained (e.g. sample vs buffer)
         
         to avoid multiple processed requesting packaging, only 1 process is allowed at a given time
         this is i
+        
+        if parallel is True, a list of uids is exported by up to max_packing_workers processes 
     """
     if isinstance(uids, list):
         if fn is None:
             raise Exception("a file name must be given for a list of uids.")
-        headers = [db[u] for u in uids]
+        headers = [header_cache[u] for u in uids]
         pns = [h.start['plan_name'] for h in headers]
         #if not (pns[1:]==pns[:-1]):
         #    raise Exception("mixed plan names in uids: %s" % pns)
     else:
-        header = db[uids]
+        header = header_cache[uids]
         if fn is None:
             if "sample_name" in list(header.start.keys()):
                 fn = header.start['sample_name']
@@ -127,8 +209,12 @@ def pack_h5(uids, dest_dir='', fn=None, fix_sample_name=True, stream_name=None,
             pass
         
     print(fds)
-    hdf5_export(headers, fn, fields=fds, stream_name=stream_name, use_uid=False, 
-                replace_res_path=replace_res_path, debug=debug) #, mds= db.mds, use_uid=False) 
+    if parallel and len(headers)>1:
+        hdf5_export_parallel(headers, fn, fields=fds, stream_name=stream_name, use_uid=False, 
+                             replace_res_path=replace_res_path, debug=debug)
+    else:
+        hdf5_export(headers, fn, fields=fds, stream_name=stream_name, use_uid=False, 
+                    replace_res_path=replace_res_path, debug=debug) #, mds= db.mds, use_uid=False) 
     
     # by default the groups in the hdf5 file are named after the scan IDs
     if fix_sample_name:
@@ -148,6 +234,244 @@ def h5_attach_hplc(fn):
     pass
 
 
+class IncrementalPacker:
+    """ RE subscriber that packs a run into the hdf5 file while the run is still going, used for HPLC runs
+        the file layout is the same as produced by pack_h5(uid, dest_dir) 
+        
+        the file is created with libver='latest', and switched into SWMR mode after the first flush, so that 
+        the data can be read (h5py.File(fn, "r", swmr=True)) while frames and monitor values are being appended
+        streams that show up after that are kept in memory until the run stops 
+        the detector frames are copied from the resource file whenever the file can be read during the run, 
+        the rest are copied when the run stops
+        the documents are handled in a separate thread, so that the RunEngine is not held up
+        the results of the last max_kept runs are kept for wait()
+    """
+    def __init__(self, dest_dir=None, fields=pack_h5_fields, flush_interval=5., select=None, max_kept=20):
+        self.dest_dir = dest_dir
+        self.fields = fields
+        self.flush_interval = flush_interval
+        if select is None:
+            select = lambda start: start.get('experiment')=="HPLC"
+        self.select = select
+        self.max_kept = max_kept
+        self.finished = {}
+        self._done = {}
+        self._cancelled = {}
+        self._queue = None
+
+    def __call__(self, name, doc):
+        if name=='start':
+            if not self.select(doc):
+                return
+            self._prune()
+            uid = doc['uid']
+            self._queue = queue.Queue()
+            self._done[uid] = threading.Event()
+            self._cancelled[uid] = threading.Event()
+            threading.Thread(target=self._run, args=(self._queue, uid), daemon=True).start()
+        if self._queue is None:
+            return
+        self._queue.put((name, doc))
+        if name=='stop':
+            self._queue = None
+
+    def wait(self, uid, timeout=None):
+        """ return the file name once the run has been packed, None if the run is not handled by the packer
+        """
+        if uid not in self._done:
+            return None
+        self._done[uid].wait(timeout)
+        return self.finished.get(uid)
+
+    def cancel(self, uid):
+        """ give up on the run, and wait for the file to be closed, e.g. before packing the run with pack_h5()
+        """
+        if uid not in self._done:
+            return
+        self._cancelled[uid].set()
+        self._done[uid].wait()
+
+    def _prune(self):
+        done = [uid for uid,ev in self._done.items() if ev.is_set()]
+        for uid in done[:max(0, len(done)-self.max_kept)]:
+            for d in [self._done, self._cancelled, self.finished]:
+                d.pop(uid, None)
+
+    def _run(self, q, uid):
+        run = None
+        t_flush = time.time()
+        while True:
+            try:
+                name,doc = q.get(timeout=1.)
+            except queue.Empty:
+                name = None
+            try:
+                if self._cancelled[uid].is_set():
+                    raise RuntimeError("cancelled")
+                if name is None:
+                    continue
+                elif name=='start':
+                    run = self._open(doc)
+                elif name=='resource':
+                    run['res_docs'][doc['uid']] = doc
+                elif name=='descriptor':
+                    self._add_stream(run, doc)
+                elif name in ['event', 'event_page']:
+                    self._add_events(run, doc)
+                    if time.time()-t_flush>self.flush_interval:
+                        self._flush(run)
+                        t_flush = time.time()
+                elif name=='stop':
+                    self._finalize(run, doc)
+                    return
+            except Exception as e:
+                print(f"incremental packing failed, {name}: {e}")
+                if run is not None and run['f'] is not None:
+                    run['f'].close()
+                self._done[uid].set()
+                return
+
+    def _open(self, start):
+        dest_dir = self.dest_dir or proc_path
+        gname = start.get('sample_name', f"data_{start['scan_id']}")
+        fn = f"{dest_dir}/{gname}.h5"
+        f = h5py.File(fn, "w", libver='latest')
+        grp = f.create_group(gname)
+        _safe_attrs_assignment(grp, {'start': start})
+        print(f"incremental packing into {fn} ...")
+        return {'fn': fn, 'f': f, 'grp': grp, 'start': start, 'descriptors': [], 'res_docs': {}, 
+                'streams': {}, 'late_streams': [], 'cancelled': self._cancelled[start['uid']]}
+
+    def _add_stream(self, run, desc):
+        desc = dict(desc)
+        run['descriptors'].append(desc)
+        keys = [k for k in desc['data_keys'].keys() if k in self.fields]
+        if 'motors' in run['start'].keys():
+            keys += [k for k in run['start']['motors'] if k in desc['data_keys'].keys() and k not in keys]
+        st = {'name': desc['name'], 'desc': desc, 'keys': keys, 'n': 0, 'nf': {},
+              'cols': {'time': [], 'data': {k:[] for k in keys}, 'timestamps': {k:[] for k in keys}}}
+        run['streams'][desc['uid']] = st
+        if run['f'].swmr_mode:  # no new objects can be created in SWMR mode
+            run['late_streams'].append(desc['uid'])
+            return
+        self._create_stream(run, st)
+
+    def _create_stream(self, run, st):
+        desc = st['desc']
+        dgrp = run['grp'].create_group(desc['name'])
+        _safe_attrs_assignment(dgrp, {k:v for k,v in desc.items() if k!='_name'})
+        dgrp.create_dataset('time', shape=(0,), maxshape=(None,), dtype=float, chunks=(1024,))
+        data_grp = dgrp.create_group('data')
+        ts_grp = dgrp.create_group('timestamps')
+        for k in st['keys']:
+            dk = desc['data_keys'][k]
+            if 'external' in dk.keys():  # detector frames, [frames per point, ...]
+                shape = tuple(dk['shape'][1:])
+                dset = data_grp.create_dataset(k, shape=(0, *shape), maxshape=(None, *shape), 
+                                               dtype=np.dtype(dk.get('dtype_str', '<u4')), 
+                                               chunks=(1, *shape), compression='gzip')
+                st['nf'][k] = 0
+            else:
+                shape = tuple(dk['shape'])
+                dset = data_grp.create_dataset(k, shape=(0, *shape), maxshape=(None, *shape), dtype=float, 
+                                               chunks=(max(1, 1024//max(1, int(np.prod(shape)))), *shape))
+            _safe_attrs_assignment(dset, dict(dk))
+            ts_grp.create_dataset(k, shape=(0,), maxshape=(None,), dtype=float, chunks=(1024,))
+
+    def _add_events(self, run, ev):
+        st = run['streams'][ev['descriptor']]
+        cols = event_columns([ev], st['keys'])
+        st['cols']['time'].extend(cols['time'])
+        for k in st['keys']:
+            st['cols']['data'][k].extend(cols['data'][k])
+            st['cols']['timestamps'][k].extend(cols['timestamps'][k])
+
+    def _append(self, dset, values):
+        n = dset.shape[0]
+        dset.resize(n+len(values), axis=0)
+        dset[n:] = values
+
+    def _flush(self, run, final=False):
+        for uid,st in run['streams'].items():
+            if uid in run['late_streams'] and not final:
+                continue
+            cols = st['cols']
+            if len(cols['time'])>0:
+                dgrp = run['grp'][st['name']]
+                self._append(dgrp['time'], cols['time'])
+                for k in st['keys']:
+                    if k in st['nf'].keys():   # datum ids, frames are copied separately
+                        st.setdefault('datum', {}).setdefault(k, []).extend(cols['data'][k])
+                    else:
+                        self._append(dgrp['data'][k], np.asarray(cols['data'][k], dtype=float))
+                    self._append(dgrp['timestamps'][k], cols['timestamps'][k])
+                st['cols'] = {'time': [], 'data': {k:[] for k in st['keys']}, 'timestamps': {k:[] for k in st['keys']}}
+            # the frames may become readable later than the events, and the final copy is always needed
+            self._copy_frames(run, st, final=final)
+        run['f'].flush()
+        if not run['f'].swmr_mode and not final:
+            run['f'].swmr_mode = True
+
+    def _copy_frames(self, run, st, final=False):
+        """ copy the frames that are available from the resource file 
+            during the run the resource can only be read if the IOC writes it in SWMR mode 
+        """
+        dgrp = run['grp'][st['name']]
+        for k in st['nf'].keys():
+            datum = st.get('datum', {}).get(k, [])
+            if len(datum)==0:
+                continue
+            res = run['res_docs'][datum[0].split('/')[0]]
+            fpp = res['resource_kwargs'].get('frame_per_point', 1)
+            try:
+                if final:
+                    hf5,data,ts = locate_h5_resource(res, compile_replace_res_path(run['start']))
+                else:
+                    fn = str(Path(res["root"]) / Path(res["resource_path"]))
+                    hf5 = h5py.File(fn, "r", swmr=True)
+                    data = hf5["/entry/data/data"] if "data" in hf5["/entry"].keys() else hf5["/entry/instrument/detector/data"]
+                    data.refresh()
+            except Exception as e:
+                if final:
+                    raise
+                continue   # try again at the next flush
+            dset = dgrp['data'][k]
+            n0 = dset.shape[0]
+            n1 = min(data.shape[0], len(datum)*fpp)
+            if n1>n0:
+                dset.resize(n1, axis=0)
+                for i in range(n0, n1):
+                    if run['cancelled'].is_set():
+                        hf5.close()
+                        raise RuntimeError("cancelled")
+                    dset[i] = data[i]
+            if final:  # same as hdf5_export, the timestamps recorded by the detector replace the event timestamps
+                del dgrp['timestamps'][k]
+                dgrp['timestamps'].create_dataset(k, data=ts, compression='gzip', fletcher32=True)
+            hf5.close()
+
+    def _finalize(self, run, stop):
+        f = run['f']
+        self._flush(run)
+        gname = run['grp'].name   # not available once the file is closed
+        f.close()
+        # reopen without SWMR to create the remaining streams and attributes
+        run['f'] = f = h5py.File(run['fn'], "r+", libver='latest')
+        run['grp'] = f[gname]
+        for uid in run['late_streams']:
+            self._create_stream(run, run['streams'][uid])
+        self._flush(run, final=True)
+        _safe_attrs_assignment(run['grp'], {'start': run['start'], 'descriptors': run['descriptors'], 'stop': stop})
+        f.close()
+        uid = run['start']['uid']
+        self.finished[uid] = run['fn']
+        self._done[uid].set()
+        print(f"{time.asctime()}: finished incremental packing of {run['fn']} ...")
+
+incremental_packer = IncrementalPacker()
+RE.subscribe(incremental_packer)
+
+
 """
 Old shimadzu packing method
 def h5_attach_hplc(fn_h5, fn_hplc, chapter_num=-1, grp_name=None):
@@ -208,12 +532,17 @@ import socket
 packing_queue_sock_port = 9999
 
 # process locally
-def send_to_packing_queue(uid, data_type): #, froot=data_file_path.gpfs, move_first=False):
+def send_to_packing_queue(uid, data_type, *, wait=False, froot=None): #, move_first=False):
     """ data_type must be one of ["scan", "flyscan", "HPLC", "sol", "multi", "mscan"]
         single uid only for "scan", "flyscan", "HPLC"
         uids must be concatenated using '|' for "multi" and "sol"
         if move_first is True, move the files from RAMDISK to GPFS first, otherwise the RAMDISK
             may fill up since only one pack_h5 process is allow
+        the job goes through packing_pipeline and this returns the job right away, so that the next 
+            sample/holder can be measured, packed and processed in the meantime; 
+            see packing_pipeline.wait(job) and packing_pipeline.report()
+        wait=True returns the file name instead, once the data are packed and processed
+        froot is not used, the files are found through the resource documents
     """
     if data_type not in ["scan", "flyscan", "HPLC", "multi", "sol", "mscan", "mfscan"]:
         raise Exception("invalid data type: {datatype}, valid options are scan and HPLC.")
@@ -222,17 +551,21 @@ def send_to_packing_queue(uid, data_type): #, froot=data_file_path.gpfs, move_fi
     #data_type,uid,path,frn,t = msg.split("::") 
 
     if data_type not in ["multi", "sol", "mscan", "mfscan"]: # single UID
-        if 'exit_status' not in db[uid].stop.keys():
+        stop = header_cache[uid].stop
+        if stop is None or 'exit_status' not in stop.keys():
             print(f"in complete header for {uid}.")
             return
-        if db[uid].stop['exit_status'] != 'success': # the scan actually finished
+        if stop['exit_status'] != 'success': # the scan actually finished
             print(f"scan {uid} was not successful.")
             return 
 
-    pack_and_process(data_type,uid,proc_path)
+    job = packing_pipeline.submit(data_type,uid,proc_path)
     #threading.Thread(target=pack_and_process, args=(data_type,uid,proc_path,)).start()
     #threading.Thread(target=pack_and_process, args=(data_type,uid,proc_path,move_first,)).start() 
+    if wait:
+        return packing_pipeline.wait(job)
     print("processing thread started ...")                    
+    return job
         
 
 def send_to_packing_queue_remote(uid, datatype, froot=data_file_path.gpfs, move_first=False):
@@ -244,13 +577,19 @@ def send_to_packing_queue_remote(uid, datatype, froot=data_file_path.gpfs, move_
     """
     if datatype not in ["scan", "flyscan", "HPLC", "multi", "sol", "mscan", "mfscan"]:
         raise Exception("invalid data type: {datatype}, valid options are scan and HPLC.")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
-    s.connect(('xf16id-srv1', packing_queue_sock_port))
     msg = f"{datatype}::{uid}::{proc_path}::{froot.name}::{move_first}"
-    s.send(msg.encode('ascii'))
-    s.close()
+    ret = send_packing_msg('xf16id-srv1', packing_queue_sock_port, msg)
+    if ret.startswith("rejected::"):
+        print(f"packing request {msg} {ret}")
+        return None
+    print(f"packing job id: {ret}")
+    return ret
 
-def pack_and_process(data_type, uid, dest_dir):
+def pack_stage(data_type, uid, dest_dir):
+    """ the packing part of pack_and_process()
+        returns the packed file name and the arguments for process_stage(), None if no processing is needed
+        returns None if packing is unsuccessful
+    """
     # useful for moving files from RAM disk to GPFS during fly scans
     # 
     # assume other type of data are saved on RAM disk as well (GPFS not working for WAXS2)
@@ -258,48 +597,31 @@ def pack_and_process(data_type, uid, dest_dir):
     #global pilatus_trigger_mode  #,CBF_replace_data_path 
     
     print(f"packing: {data_type}, {uid}, {dest_dir}")
-    t0 = time.time()
-    # if the dest_dir contains exp.h5, read detectors/qgrid from it
-    try:
-        dt_exp = h5exp(dest_dir+'/exp.h5')
-    except:
-        dt_exp = None
-
     dir_name = None
+    proc_args = None
     
     if data_type in ["multi", "sol", "mscan", "mfscan"]:
         uids = uid.split('|')
+        sb_dict = None
         if data_type=="sol":
             sb_dict = json.loads(uids.pop())
         ## assume that the meta data contains the holderName
-        if 'holderName' not in list(db[uids[0]].start.keys()):
+        md = header_cache[uids[0]].start
+        if 'holderName' not in list(md.keys()):
             print("cannot find holderName from the header, using tmp.h5 as filename ...")
             fh5_name = "tmp.h5"
         else:
-            dir_name = db[uids[0]].start['holderName']
+            dir_name = md['holderName']
             fh5_name = dir_name+'.h5'
         fn = pack_h5_with_lock(uids, dest_dir, fn="tmp.h5")
         #fn = pack_h5(uids, fn=fh5_name)
+        if fn is None:
+            return
         if fh5_name != "tmp.h5":  # temporary fix, for some reason other processes cannot open the packed file
-            os.system(f"cd {dest_dir} ; cp tmp.h5 {fh5_name} ; rm tmp.h5")
+            os.replace(f"{dest_dir}/tmp.h5", f"{dest_dir}/{fh5_name}")
         fn = fh5_name
-        if fn is not None and dt_exp is not None and data_type!="mscan":
-            print('processing ...')
-            if data_type=="sol":    
-                dt = h5sol_HT(fn, [dt_exp.detectors, dt_exp.qgrid])
-                dt.assign_buffer(sb_dict)
-                #dt.process(filter_data=True, sc_factor="auto", debug='quiet')
-                #dt.export_d1s(path=dest_dir+"/processed/")
-            elif data_type=="multi":
-                dt = h5xs(fn, [dt_exp.detectors, dt_exp.qgrid], transField='em2_sum_all_mean_value')
-                dt.load_data(debug="quiet")
-            elif data_type=="mfscan":
-                dt = h5xs(fn, [dt_exp.detectors, dt_exp.qgrid])
-                dt.load_data(debug="quiet")
-            dt.fh5.close()
-            del dt,dt_exp            
-            #if fh5_name != "tmp.h5":  # temporary fix, for some reason other processes cannot open the packed file
-            #    os.system(f"cd {dest_dir} ; cp tmp.h5 {fh5_name} ; rm tmp.h5")
+        if data_type!="mscan":
+            proc_args = (data_type, os.path.join(dest_dir, fh5_name), dest_dir, sb_dict)
             #if data_type == "sol":
             #    try:
             #        gen_report(fh5_name)
@@ -307,7 +629,14 @@ def pack_and_process(data_type, uid, dest_dir):
             #        pass
     elif data_type=="HPLC":
         uids = [uid]
-        fn = pack_h5_with_lock(uid, dest_dir=dest_dir, attach_uv_file=True)
+        # the run may have been packed already as it was collected
+        fn = incremental_packer.wait(uid, timeout=600)
+        if fn is None:
+            # make sure the incremental packer is no longer writing into the same file
+            incremental_packer.cancel(uid)
+            fn = pack_h5_with_lock(uid, dest_dir=dest_dir, attach_uv_file=True)
+        else:
+            h5_attach_hplc(fn)
         #if fn is not None and dt_exp is not None:
          #   print('procesing ...')
           #  dt = h5sol_HPLC(fn, [dt_exp.detectors, dt_exp.qgrid])
@@ -323,43 +652,162 @@ def pack_and_process(data_type, uid, dest_dir):
 
     if fn is None:
         return # packing unsuccessful, 
+    return fn,proc_args
+
+# runs in the processing pool of packing_pipeline, which is spawned, so it is defined in an importable module
+from startup.utils.pack_worker import process_stage
+
+def pack_and_process(data_type, uid, dest_dir):
+    """ pack, then process the data in the same thread
+        see packing_pipeline for packing/processing multiple data sets concurrently
+    """
+    t0 = time.time()
+    ret = pack_stage(data_type, uid, dest_dir)
+    if ret is None:
+        return
+    fn,proc_args = ret
+    if proc_args is not None:
+        process_stage(*proc_args)
     print(f"{time.asctime()}: finished packing/processing, total time lapsed: {time.time()-t0:.1f} sec ...")
+    return fn
 
-            
-def process_packing_queue():
+
+class PackProcessPipeline:
+    """ packing (I/O bound) and processing (CPU bound) are handled by separate bounded pools
+        a packed data set is passed on to the processing pool, so that sample N+1 can be packed 
+        while sample N is being processed
+        at most max_queued packed data sets can be waiting for processing, beyond that packing is held up
+        the time spent in each stage is recorded in self.jobs
+    """
+    def __init__(self, n_pack=max_packing_processes, n_proc=2, max_queued=4):
+        self.n_pack = n_pack
+        self.n_proc = n_proc
+        self.jobs = []
+        self._pack_pool = None
+        self._proc_pool = None
+        self._proc_slots = threading.BoundedSemaphore(n_proc+max_queued)
+
+    def _start_pools(self):
+        if self._pack_pool is None:
+            self._pack_pool = ThreadPoolExecutor(max_workers=self.n_pack)
+            # spawned, a forked child could inherit a lock held by one of the threads in bsui and hang
+            self._proc_pool = ProcessPoolExecutor(max_workers=self.n_proc, 
+                                                  mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, data_type, uid, dest_dir):
+        self._start_pools()
+        job = {'data_type': data_type, 'uid': uid, 'dest_dir': dest_dir, 'fn': None, 
+               'status': 'queued', 'submitted': time.time(), 'pack_wait': None, 'pack_time': None, 
+               'proc_wait': None, 'proc_time': None, 'packed': threading.Event(), 'done': threading.Event()}
+        self.jobs.append(job)
+        self._pack_pool.submit(self._pack, job)
+        return job
+
+    def wait(self, job, timeout=None, processed=True):
+        """ wait for the job to be packed and processed, returns the file name, None if unsuccessful
+            processed=False returns once the data are packed, the processing goes on in the background
+        """
+        if processed:
+            job['done'].wait(timeout)
+            return job['fn'] if job['status']=='done' else None
+        job['packed'].wait(timeout)
+        return job['fn']
+
+    def _pack(self, job):
+        t0 = time.time()
+        job['pack_wait'] = t0-job['submitted']
+        job['status'] = 'packing'
+        try:
+            ret = pack_stage(job['data_type'], job['uid'], job['dest_dir'])
+        except Exception as e:
+            print(f"An error occured when packing {job['uid']}: {e}")
+            ret = None
+        job['pack_time'] = time.time()-t0
+        if ret is None:
+            job['status'] = 'failed'
+            job['packed'].set()
+            job['done'].set()
+            return
+        job['fn'],proc_args = ret
+        job['packed'].set()
+        if proc_args is None:
+            job['status'] = 'done'
+            job['done'].set()
+            return
+        job['status'] = 'waiting for processing'
+        self._proc_slots.acquire()
+        t1 = time.time()
+        try:
+            fut = self._proc_pool.submit(process_stage, *proc_args)
+        except Exception as e:
+            self._proc_slots.release()
+            print(f"An error occured when processing {job['fn']}: {e}")
+            job['status'] = 'failed'
+            job['done'].set()
+            return
+        fut.add_done_callback(lambda f: self._processed(job, f, t1))
+
+    def _processed(self, job, fut, t1):
+        self._proc_slots.release()
+        try:
+            job['proc_time'] = fut.result()
+            job['proc_wait'] = time.time()-t1-job['proc_time']
+            job['status'] = 'done'
+        except Exception as e:
+            print(f"An error occured when processing {job['fn']}: {e}")
+            job['status'] = 'failed'
+        job['done'].set()
+        print(f"{time.asctime()}: finished packing/processing {job['fn']}, "
+              f"total time lapsed: {time.time()-job['submitted']:.1f} sec ...")
+
+    def report(self):
+        print(f"{'status':>24} {'pack wait':>10} {'pack':>8} {'proc wait':>10} {'proc':>8}  file")
+        fmt = lambda t: "" if t is None else f"{t:.1f}"
+        for job in self.jobs:
+            print(f"{job['status']:>24} {fmt(job['pack_wait']):>10} {fmt(job['pack_time']):>8} "
+                  f"{fmt(job['proc_wait']):>10} {fmt(job['proc_time']):>8}  {job['fn'] or job['uid']}")
+
+packing_pipeline = PackProcessPipeline()
+
+from startup.utils.packing_queue import PackingQueueServer, send_packing_msg, query_packing_job
+
+packing_queue_journal = os.path.expanduser("~/.lix_packing_queue.jsonl")
+packing_queue_workers = max_packing_processes
+
+def check_packing_msg(msg):
+    """ called by the packing queue server before a job is accepted
+        raise an exception to reject the job
+    """
+    data_type,uid,path,frn,t = msg.split("::")
+    if data_type not in ["scan", "flyscan", "HPLC", "multi", "sol", "mscan", "mfscan"]:
+        raise Exception(f"invalid data type: {data_type}")
+    if data_type not in ["multi", "sol", "mscan", "mfscan"]: # single UID
+        stop = header_cache[uid].stop
+        if stop is None or 'exit_status' not in stop.keys():
+            raise Exception(f"incomplete header for {uid}.")
+        if stop['exit_status'] != 'success': # the scan actually finished
+            raise Exception(f"scan {uid} was not successful.")
+
+def run_packing_msg(msg):
+    """ the server job is done once the data are packed, packing_pipeline processes them while the 
+        next job is being packed
+    """
+    data_type,uid,path,frn,t = msg.split("::")
+    job = packing_pipeline.submit(data_type,uid,path)
+    if packing_pipeline.wait(job, processed=False) is None:
+        raise Exception(f"failed to pack {uid}")
+
+def process_packing_queue(max_workers=packing_queue_workers, journal=packing_queue_journal):
     """ this should only run on xf16idc-gpu1, moved to srv1 Mar 2022
         needed for HPLC run and microbeam mapping
+        
+        jobs are recorded in the journal file and resumed if the server is restarted
+        query the status of a job using query_packing_job('xf16id-srv1', packing_queue_sock_port, job_id)
     """    
-    serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
     host = socket.gethostname()                           
     if host!='xf16id-srv1' and host!="xf16id-srv1.nsls2.bnl.local":
         raise Exception(f"this function can only run on xf16id-srv1, not {host}.")
-    serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    serversocket.bind(('xf16id-srv1', packing_queue_sock_port))  
-    serversocket.listen(5)
-    print('listening ...')
-    
-    while True:
-        clientsocket,addr = serversocket.accept()      
-        print(f"{time.asctime()}: got a connection from {addr} ...")
-        msg = clientsocket.recv(8192).decode()
-        print(msg)
-        clientsocket.close()
-        data_type,uid,path,frn,t = msg.split("::") 
-        if t is True:
-            move_first = True
-        else:
-            move_first = False
-        
-        if data_type not in ["multi", "sol", "mscan", "mfscan"]: # single UID
-            if 'exit_status' not in db[uid].stop.keys():
-                print(f"in complete header for {uid}.")
-                return
-            if db[uid].stop['exit_status'] != 'success': # the scan actually finished
-                print(f"scan {uid} was not successful.")
-                return 
-
-        threading.Thread(target=pack_and_process, args=(data_type,uid,path,)).start() 
-        print("processing thread started ...")            
-
+    server = PackingQueueServer(run_packing_msg, 'xf16id-srv1', packing_queue_sock_port, journal, 
+                                validator=check_packing_msg, max_workers=max_workers)
+    server.run()
 
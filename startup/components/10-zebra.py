@@ -72,6 +72,7 @@ class ZebraPositionCapture(Device):
     dir = Cpt(EpicsSignalWithRBV, "PC_DIR")
     tspre = Cpt(EpicsSignalWithRBV, "PC_TSPRE")
     trig_source = Cpt(EpicsSignalWithRBV, "PC_ARM_SEL")
+    arm_input = Cpt(EpicsSignalWithRBV, "PC_ARM_INP")
     arm = Cpt(EpicsSignal, "PC_ARM")
     disarm = Cpt(EpicsSignal, "PC_DISARM")
     armed = Cpt(EpicsSignalRO, "PC_ARM_OUT")
@@ -230,6 +231,118 @@ class Zebra(Zebra_base):
     def unstage(self):
         super().unstage()
 
+    def gate_trigger_pulses(self, start, width, step, ngates, src=ZA.IN3_OC):
+        """ pass on to the detectors only the pulses from src (the XPS) that fall within a series of time gates,
+            this removes the pulses produced while a snake trajectory turns around at the end of each line
+            the first pulse from src arms position compare and starts the clock, it should arrive before start
+            all times are in seconds
+            the PC settings are shared with the other trajectory scans, ungate_trigger_pulses() puts them back
+        """
+        self.pc.disarm.put(1)
+        self._save_settings("gate", self._gate_sigs())
+        self.pc.tspre.set('s').wait()
+        self.pc.trig_source.set('External').wait()
+        self.pc.arm_input.set(src).wait()
+        self.pc.gate_source.set('Time').wait()
+        self.pc.gate_start.set(start).wait()
+        self.pc.gate_width.set(width).wait()
+        self.pc.gate_step.set(step).wait()
+        self.pc.gate_num.set(ngates).wait()
+        # one capture per gate, PC_TIME then gives the start time of each line 
+        self.pc.pulse_source.set('Time').wait()
+        self.pc.pulse_start.set(0).wait()
+        self.pc.pulse_width.set(width/2).wait()
+        self.pc.pulse_step.set(step).wait()
+        self.pc.pulse_max.set(0).wait()
+        self.and1.input_source1.set(src).wait()
+        self.and1.input_source2.set(ZA.PC_GATE).wait()
+        for i,use in enumerate([1, 1, 0, 0]):
+            getattr(self.and1, f"use{i+1}").set(use).wait()
+        self.pulse1.input_addr.set(ZA.AND1).wait()
+
+    def ungate_trigger_pulses(self, src=ZA.IN3_OC):
+        self.pc.disarm.put(1)
+        if not self._restore_settings("gate"):
+            self.pc.trig_source.set('Soft').wait()
+            self.pulse1.input_addr.set(src).wait()
+
+    def _pc_sigs(self):
+        pc = self.pc
+        return [pc.tspre, pc.trig_source, pc.gate_source, pc.gate_start, pc.gate_width, pc.gate_step, pc.gate_num, 
+                pc.pulse_source, pc.pulse_start, pc.pulse_width, pc.pulse_step, pc.pulse_max]
+
+    def _gate_sigs(self):
+        return self._pc_sigs() + [self.pc.arm_input, self.and1.input_source1, self.and1.input_source2,
+                                  self.and1.use1, self.and1.use2, self.and1.use3, self.and1.use4,
+                                  self.pulse1.input_addr]
+
+    def _burst_sigs(self):
+        return self._pc_sigs() + [self.or1.input_source3, self.or1.use3]
+
+    def _save_settings(self, key, sigs):
+        """ keep the current values, unless they are already saved under the same key
+        """
+        if key not in self._saved_settings:
+            self._saved_settings[key] = [(sig, sig.get()) for sig in sigs]
+
+    def _restore_settings(self, key):
+        """ returns False if nothing was saved under key
+        """
+        saved = self._saved_settings.pop(key, None)
+        if saved is None:
+            return False
+        for sig,value in saved:
+            sig.set(value).wait()
+        return True
+
+    def setup_burst(self, npulses, period, width=None):
+        """ use position compare as a pulse generator for hardware-timed detector triggers:
+            every time PC is armed, npulses, period seconds apart, are sent to the detectors through OR1
+            PC disarms itself after the last pulse; PC_TIME records the time of each pulse
+            the PC settings are shared with the trajectory scans, clear_burst() puts them back
+        """
+        if width is None:
+            width = period/2
+        self.pc.disarm.put(1)
+        self._save_settings("burst", self._burst_sigs())
+        self.pc.tspre.set('ms').wait()
+        self.pc.trig_source.set('Soft').wait()
+        self.pc.gate_source.set('Time').wait()
+        self.pc.gate_start.set(0).wait()
+        self.pc.gate_width.set(npulses*period*1000).wait()
+        self.pc.gate_step.set(npulses*period*1000+1).wait()
+        self.pc.gate_num.set(1).wait()
+        self.pc.pulse_source.set('Time').wait()
+        self.pc.pulse_start.set(0).wait()
+        self.pc.pulse_width.set(width*1000).wait()
+        self.pc.pulse_step.set(period*1000).wait()
+        self.pc.pulse_max.set(npulses).wait()
+        self.or1.input_source3.set(ZA.PC_PULSE).wait()
+        self.or1.use3.set(1).wait()
+
+    def fire_burst(self, timeout=None):
+        """ arm PC to start the burst defined by setup_burst(), and wait until PC disarms after the last pulse
+        """
+        ev = threading.Event()
+        armed = []
+        def cb(value, **kwargs):
+            if value==1:
+                armed.append(value)
+            elif len(armed)>0:
+                ev.set()
+        cid = self.pc.armed.subscribe(cb, run=False)
+        try:
+            self.pc.arm.put(1)
+            if not ev.wait(timeout):
+                raise TimeoutError(f"the pulse burst did not complete within {timeout} sec.")
+        finally:
+            self.pc.armed.unsubscribe(cid)
+
+    def clear_burst(self):
+        self.pc.disarm.put(1)
+        if not self._restore_settings("burst"):
+            self.or1.use3.set(0).wait()
+
     def __init__(
         self, prefix, *,
         read_attrs=None, configuration_attrs=None, **kwargs
@@ -245,6 +358,8 @@ class Zebra(Zebra_base):
             configuration_attrs=configuration_attrs,
             **kwargs,
         )
+        # settings changed by setup_burst()/gate_trigger_pulses(), to be restored afterwards
+        self._saved_settings = {}
 
 zebra = Zebra("XF:16IDC-ES{Zeb:1}:", name="Zebra", read_attrs=["pc.data.enc1", "pc.data.enc2", "pc.data.time"])
 
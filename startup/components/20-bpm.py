@@ -5,6 +5,7 @@ from ophyd.areadetector import (ADComponent as ADCpt, StatsPlugin)
 from ophyd.quadem import NSLS_EM,TetrAMM,QuadEM,QuadEMPort
 from ophyd import DeviceStatus
 import numpy as np
+import threading
 from ophyd.sim import NullStatus
 from ophyd import DynamicDeviceComponent as DDCpt
 from collections import OrderedDict
@@ -97,6 +98,12 @@ class LiXTetrAMMext(QuadEM):
         super().__init__(*args, **kwargs)
         self._fstatus = None
         self.rep = 1
+        self._armed = False
+        self.ts_fields = ['SumAll', 'current1', 'current2', 'current3', 'current4']
+        # latest (value, timestamp) of each time series array, from monitors kept while staged
+        self._ts_latest = {}
+        self._ts_cids = {}
+        self._ts_updated = threading.Condition()
         self.configuration_attrs = [
             "integration_time",
             "averaging_time",
@@ -142,7 +149,29 @@ class LiXTetrAMMext(QuadEM):
         time.sleep(0.1)
         self.acquire.set(1).wait()
         time.sleep(0.1)
-        self.read_back = {'data': [], 'ts': []}
+        self.clear_readback()
+        self._ts_latest = {}
+        self._ts_cids = {k: getattr(self.ts, k).subscribe(self._ts_cb, run=False) for k in self.ts_fields}
+
+    def unstage(self):
+        for k,cid in self._ts_cids.items():
+            getattr(self.ts, k).unsubscribe(cid)
+        self._ts_cids = {}
+        return super().unstage()
+
+    def _ts_cb(self, value, obj, timestamp, **kwargs):
+        with self._ts_updated:
+            self._ts_latest[obj.attr_name] = (value, timestamp)
+            self._ts_updated.notify_all()
+
+    def clear_readback(self):
+        """ one row per line, self.rep lines of self.npoints points
+        """
+        shape = (self.rep, self.npoints.get())
+        self.read_back = {'data': {k: np.full(shape, np.nan) for k in self.ts_fields}, 
+                          'ts': np.full(self.rep, np.nan), 
+                          'n': 0, 'shape': shape}
+        self._armed = False
 
     def trigger(self):
         if self._staged != Staged.yes:
@@ -158,51 +187,106 @@ class LiXTetrAMMext(QuadEM):
         self._status._finished()
         return self._status
     
+    def arm(self):
+        self.ts.acquire.set(1).wait()
+        self.acquire.set(1).wait()
+        self._armed = True
+    
     def kickoff(self):
         print("kicking off emext ...")
         self._fstatus = DeviceStatus(self)
-
-        self.ts.acquire.set(1).wait()
-        time.sleep(0.1)
-        self.acquire.set(1).wait()
+        # already armed at the end of the previous line
+        if not self._armed:
+            self.arm()
        
         print("emext kicked off ...")
         return self._fstatus
         #return NullStatus()
         
     def complete(self):
+        """ the read happens in the background, so that em1ext and em2ext are read at the same time
+            the status is finished once the data for this line have been recorded
+        """
         print("compelting emext ...")
         if self._fstatus is None:
             raise RuntimeError("must call kickoff() before complete()")
-
-        self.ts.acquire.set(0).wait()
-        caput(self.ts.prefix+"TSRead", 1)
-        time.sleep(0.2)
-        em2d = self.ts.SumAll.read()[f'{self.name}_ts_SumAll']
-        #self.read_back['data'].extend(em2d['value'][:self.npoints.get()])  
-        self.read_back['data'].append(np.asarray(em2d['value'][:self.npoints.get()]))  
-        self.read_back['ts'].append(em2d['timestamp'])        
-
-        if not self._fstatus.done:
-            self._fstatus.set_finished()
-        print("emext compelte done")
+        if self._fstatus.done or self.read_back['n']>=self.rep: 
+            # e.g. complete() called again at the end of the scan
+            if not self._fstatus.done:
+                self._fstatus.set_finished()
+            return self._fstatus
+        
+        threading.Thread(target=self.read_line, args=(self._fstatus,)).start()
         return self._fstatus
         #return NullStatus()
     
+    def read_line(self, status, timeout=5):
+        """ stop the time series and ask the IOC to update the arrays; instead of sleeping, wait for 
+            the monitor updates of all arrays, then arm for the next line 
+            only updates newer than what was received before TSRead count, anything earlier, e.g. the
+            first event of the monitor, holds the data of the previous line
+        """
+        try:
+            self._armed = False
+            self.ts.acquire.set(0).wait()
+            with self._ts_updated:
+                t0 = {k: self._ts_latest[k][1] if k in self._ts_latest else (getattr(self.ts, k).timestamp or 0)
+                      for k in self.ts_fields}
+            caput(self.ts.prefix+"TSRead", 1)
+            with self._ts_updated:
+                updated = lambda: all(k in self._ts_latest and self._ts_latest[k][1]>t0[k] for k in self.ts_fields)
+                if not self._ts_updated.wait_for(updated, timeout):
+                    raise TimeoutError(f"{self.name}: time series not updated within {timeout} sec.")
+                updates = {k: self._ts_latest[k] for k in self.ts_fields}
+            
+            i = self.read_back['n']
+            npts = self.npoints.get()
+            for k,(value,ts) in updates.items():
+                value = np.asarray(value)[:npts]
+                self.read_back['data'][k][i, :len(value)] = value
+            self.read_back['ts'][i] = updates['SumAll'][1]
+            self.read_back['n'] = i+1
+            if i+1<self.rep:
+                self.arm()
+        except Exception as e:
+            print(f"{self.name}: error reading the time series: {e}")
+            status.set_exception(e)
+            return
+        status.set_finished()
+        print("emext compelte done")
+    
+    def split_lines(self, nlines):
+        """ the last read from the circular buffer covers nlines lines of a raster scan, 
+            split it so that collect() returns one row per line, as if each line was read separately
+            npoints/rep still describe the acquisition, the shape of the lines is kept in read_back
+        """
+        npts = self.npoints.get()//nlines
+        for k,d in self.read_back['data'].items():
+            self.read_back['data'][k] = np.reshape(d[0, :npts*nlines], (nlines, npts))
+        self.read_back['ts'] = np.repeat(self.read_back['ts'][:1], nlines)
+        self.read_back['n'] = nlines
+        self.read_back['shape'] = (nlines, npts)
+        
     def collect(self):
         print("in em collect ...")
-        k = self.ts.SumAll.name
-        l = self.npoints.get()*self.rep         # sometimes the last read from the circular buffer is repeated
+        data = {}
+        ts = {}
+        for k in self.ts_fields:
+            key = getattr(self.ts, k).name
+            data[key] = self.read_back['data'][k]
+            ts[key] = self.read_back['ts']
         yield  {'time': time.time(),
-                'data': {k: np.array(self.read_back['data'][:l])},
-                'timestamps': {k: self.read_back['ts'][:l]},
+                'data': data,
+                'timestamps': ts,
                 }   
         
     def describe_collect(self):
         print("in em describe_collect ...")
-        ret = self.ts.SumAll.describe()
+        ret = {}
+        for k in self.ts_fields:
+            ret.update(getattr(self.ts, k).describe())
         for k in ret.keys():
-            ret[k]['shape'] = [self.rep, ret[k]['shape'][0]]
+            ret[k]['shape'] = list(self.read_back['shape'])
 
         #return {'primary': ret}
         return {self.name: ret}
@@ -20,10 +20,45 @@ thread
 from ophyd.device import Device
 import threading,time
 
+def counter_status(device, counters, targets, timeout):
+    """ returns a DeviceStatus that finishes once every counter signal (e.g. hdf.num_captured)
+        has reached its target value, following the monitor updates instead of waiting a fixed time
+        the status fails if any counter falls short within timeout, i.e. a frame is missing
+    """
+    status = DeviceStatus(device, timeout=timeout)
+    lock = threading.Lock()
+    counts = [None]*len(counters)
+
+    def make_cb(i):
+        def cb(value, **kwargs):
+            with lock:
+                counts[i] = value
+                if status.done or any(c is None or c<t for c,t in zip(counts, targets)):
+                    return
+                status._finished()
+        return cb
+
+    cids = [sig.subscribe(make_cb(i), run=True) for i,sig in enumerate(counters)]
+
+    def cleanup(st):
+        for sig,cid in zip(counters, cids):
+            sig.unsubscribe(cid)
+        if not st.success:
+            print(f"{device.name}: frames missing after {timeout:.2f} sec,",
+                  ", ".join([f"{sig.name} {c}/{t}" for sig,c,t in zip(counters, counts, targets)]))
+
+    status.add_callback(cleanup)
+    return status
+
 class ExtTrigger(Device):
+    trig_timeout = 2.   # how much longer than expected to wait for the frames before giving up
+
     def __init__(self, name, *args, **kwargs):
         super().__init__(name=name, **kwargs)
         self.delay = 0.01
+        self.watched = []
+        self.n_pulses = 1
+        self.period = None
         self.trigger_lock = threading.Lock()
         self._status = None
         self._trigger_signal = EpicsSignal('XF:16IDC-ES{Zeb:1}:SOFT_IN:B0')   
@@ -32,15 +67,48 @@ class ExtTrigger(Device):
 
     def set_delay(self, delay):
         self.delay = delay
-    
+
+    def watch(self, dets):
+        """ complete trigger() once the frame counters of these detectors have advanced,
+            instead of after self.delay; each detector provides frame_counters(),
+            which returns [(signal, frames_per_trigger), ...]
+        """
+        self.watched = list(dets)
+
+    def set_burst(self, n_pulses, period=None):
+        """ send n_pulses per trigger(), timed by the Zebra instead of toggling SOFT_IN:B0 from here
+            period defaults to self.delay, set_burst(1) goes back to single pulses
+            the Zebra is programmed during stage()
+        """
+        self.n_pulses = n_pulses
+        self.period = period
+
+    def spacing(self):
+        """ period (or self.delay), but no shorter than the watched detectors can take the pulses
+        """
+        sp = self.delay if self.period is None else self.period
+        return max([sp]+[det.pulse_period() for det in self.watched if hasattr(det, "pulse_period")])
+
+    def stage(self):
+        if self.n_pulses>1:
+            zebra.setup_burst(self.n_pulses, self.spacing())
+        return super().stage()
+
+    def unstage(self):
+        if self.n_pulses>1:
+            zebra.clear_burst()
+        return super().unstage()
+
     def repeat_ext_trigger(self, rep):
         """ this is used to produce external triggers to complete data collection by camserver
+            the pulses come from the Zebra, spacing() apart
         """
-        for i in reversed(range(rep)):
-            self._trigger_signal.put(1, wait=True)
-            self._trigger_signal.put(0, wait=True)
-            time.sleep(self.delay)
-            print(f"# of triggers to go: {i} \r", end="")
+        period = self.spacing()
+        zebra.setup_burst(rep, period)
+        try:
+            zebra.fire_burst(timeout=rep*period+self.trig_timeout)
+        finally:
+            zebra.clear_burst()
 
     def describe(self):
         return {self.name: {"source": "None",
@@ -53,13 +121,23 @@ class ExtTrigger(Device):
     
     def trigger(self):
         print("ext trigger ...")
-        self._status = DeviceStatus(device=self)
         while self.trigger_lock.locked():
             time.sleep(self.delay)
+        counters = [c for det in self.watched for c in det.frame_counters()]
+        # read the counters before the pulse, so that the frames produced by this trigger are counted
+        targets = [sig.get()+n for sig,n in counters]
         self.timestamp = time.time()
-        self._trigger_signal.put(1, wait=True)
-        self._trigger_signal.put(0, wait=True)
-        threading.Timer(self.delay, self._status._finished, ()).start()
+        if self.n_pulses>1:
+            zebra.pc.arm.put(1)   # the burst is already set up by stage()
+        else:
+            self._trigger_signal.put(1, wait=True)
+            self._trigger_signal.put(0, wait=True)
+        if len(counters)>0:
+            timeout = self.spacing()*max([n for sig,n in counters])+self.trig_timeout
+            self._status = counter_status(self, [sig for sig,n in counters], targets, timeout)
+        else:
+            self._status = DeviceStatus(self, settle_time=self.spacing()*self.n_pulses)
+            self._status._finished()
 
         return self._status
 
@@ -11,6 +11,8 @@ from pathlib import Path
 
 import os,time,threading
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from ophyd.status import wait as status_wait
 
 from enum import Enum
 class PilatusTriggerMode(Enum):
@@ -100,30 +102,42 @@ class LIXPilatus(PilatusDetector):
             print(f"Threshold is not set for {self.name} due to active data collection.")
             print(f"x-ray enegy = 2x {ene/2:.2f} keV, threshold is at {eth:.2f} keV")
 
-    def stage(self, trigger_mode):
+    def wait_armed(self, value, timeout=None):
+        """ wait for the Armed PV to reach value, from its monitor updates instead of polling
+        """
+        ev = threading.Event()
+        def cb(value, **kwargs):
+            if value==target:
+                ev.set()
+        target = value
+        cid = self.armed.subscribe(cb, run=True)
+        try:
+            if not ev.wait(timeout):
+                raise TimeoutError(f"{self.name} Armed did not become {value} within {timeout} sec.")
+        finally:
+            self.armed.unsubscribe(cid)
+
+    def stage(self, trigger_mode, timeout=10):
         if self._staged == Staged.yes:
             return
 
         self.trigger_mode = trigger_mode
         if trigger_mode is PilatusTriggerMode.ext:
-            self.cam.num_images.put(self._num_images*self._num_repeats,
-                                    wait=True)
+            n = self._num_images*self._num_repeats
         else:
-            self.cam.num_images.put(self._num_repeats, wait=True)
+            n = self._num_repeats
         print(self.name, f" staging for {trigger_mode}")
-        self.cam.trigger_mode.put(trigger_mode.value, wait=True)
+        # issue the puts together and wait for both put callbacks
+        status_wait(self.cam.num_images.set(n) & self.cam.trigger_mode.set(trigger_mode.value), timeout)
         super().stage()
-        print(self.name, "super staged")
 
         if trigger_mode is PilatusTriggerMode.soft:
             self._acquisition_signal.subscribe(self.parent._acquire_changed)
         else: # external triggering
-            self._counter_signal.put(0)
-            time.sleep(.1)
-            print(self.name, "checking armed status")
+            # the counter must be reset before arming, the put callback replaces the fixed sleep
+            status_wait(self._counter_signal.set(0), timeout)
             self._acquisition_signal.put(1) #, wait=True)
-            while self.armed.get() != 1:
-                time.sleep(0.1)
+            self.wait_armed(1, timeout)
 
         self.ts = []
         print(self.name, "staged")
@@ -133,24 +147,24 @@ class LIXPilatus(PilatusDetector):
             return
 
         print(self.name, "unstaging ...")
-        print(self.name, "checking detector Armed status:", end="")
-        ts0 = time.time()
-        st = None
-        while self.armed.get():
-            time.sleep(0.2)
-            if time.time()-ts0>timeout and st is None:
-                st = self.cam.acquire.set(0)
+        try:
+            try:
+                self.wait_armed(0, timeout)
+            except TimeoutError:
                 print(f"force stop {self.name}")
-        print(" unarmed.")
-
-        if self.parent.trigger_mode is PilatusTriggerMode.soft:
-            self._acquisition_signal.clear_sub(self.parent._acquire_changed)
-        else:
-            self._acquisition_signal.put(0, wait=True)
-            self.cam.trigger_mode.put(0, wait=True)   # always set back to software trigger
-            self.cam.num_images.put(1, wait=True)
-
-        super().unstage()
+                self.cam.acquire.set(0)
+                self.wait_armed(0, timeout)
+        finally:
+            # reset and unstage even if the detector did not stop, the error is raised after that
+            try:
+                if self.parent.trigger_mode is PilatusTriggerMode.soft:
+                    self._acquisition_signal.clear_sub(self.parent._acquire_changed)
+                else:
+                    # always set back to software trigger
+                    status_wait(self._acquisition_signal.set(0) & self.cam.trigger_mode.set(0)
+                                & self.cam.num_images.set(1), timeout)
+            finally:
+                super().unstage()
         print(self.name, "unstaging completed.")
 
 
@@ -178,6 +192,8 @@ class LiXDetectors(Device):
     acq_time = 1.
     trigger_mode = PilatusTriggerMode.soft
     _trigger_width = 0.002
+    readout_time = 0.003    # Pilatus readout, the next hardware trigger should not come sooner
+    trig_timeout = 2.   # how much longer than trig_wait to wait for the frames before giving up
 
     def __init__(self, prefix):
         super().__init__(prefix=prefix, name="pil")
@@ -189,11 +205,15 @@ class LiXDetectors(Device):
             det.name = dname
             det.read_attrs = ['hdf'] #['file']
         self.active_detectors = list(self.dets.values())
+        # stage/unstage all active detectors at the same time
+        self._stage_executor = ThreadPoolExecutor(max_workers=len(self.dets))
+        self.timings = {}
         self.trigger_time = Signal(name="pilatus_trigger_time")
 
         self._trigger_signal = EpicsSignal('XF:16IDC-ES{Zeb:1}:SOFT_IN:B0')
         self._exp_completed = 0
         self._flying = False
+        self._counting = False
 
         RE.md['pilatus'] = {}
         RE.md['pilatus']['ramdisk'] = pilatus_data_dir
@@ -284,25 +304,70 @@ class LiXDetectors(Device):
             det._num_images = self._num_images
             det._num_repeats = self._num_repeats
             det._num_captures = self._num_captures
-            det.stage(self.trigger_mode)
+        try:
+            self.run_parallel("stage", self.trigger_mode)
+        except:
+            # do not leave the detectors that did stage armed
+            self.run_parallel("unstage")
+            raise
 
         if self.trigger_mode == PilatusTriggerMode.ext_multi:
-            # the name is misleading, multi_triger means one image per trigger
-            self.trig_wait = self.acq_time   #+0.02
+            self.trig_wait = self.pulse_period()*self.frames_per_trigger()
         else:
-            self.trig_wait = self.acq_time*self._num_captures   #+0.02
+            self.trig_wait = self.acq_time*self.frames_per_trigger()   #+0.02
         
         self.datum={}
+        self._n_expected = 0
+        self._counting = (self.trigger_mode is not PilatusTriggerMode.soft)
 
     def unstage(self):
         self._flying = False
-        for det in self.active_detectors:
-            det.unstage()
+        self._counting = False
+        self.run_parallel("unstage")
+
+    def run_parallel(self, action, *args):
+        """ call det.stage() or det.unstage() for all active detectors at once
+            the time taken by each detector is kept in self.timings, e.g. pil.timings['pil1M']['stage']
+            if any of the detectors fails, the first exception is raised after all calls have returned
+        """
+        def run(det):
+            t0 = time.time()
+            getattr(det, action)(*args)
+            return time.time()-t0
+
+        t0 = time.time()
+        futures = [(det, self._stage_executor.submit(run, det)) for det in self.active_detectors]
+        err = None
+        for det, fut in futures:
+            try:
+                self.timings.setdefault(det.name, {})[action] = fut.result()
+            except Exception as e:
+                print(f"{det.name} {action} failed: {e}")
+                if err is None:
+                    err = e
+        if err is not None:
+            raise err
+        dts = ", ".join([f"{det.name} {self.timings[det.name][action]:.2f}" for det in self.active_detectors])
+        print(f"{self.name} {action} took {time.time()-t0:.2f} sec ({dts})")
+
+    def frames_per_trigger(self):
+        # the name is misleading, multi_triger means one image per trigger pulse
+        # ext_trig may send a burst of pulses per trigger()
+        if self.trigger_mode == PilatusTriggerMode.ext_multi:
+            return ext_trig.n_pulses
+        return self._num_captures
+
+    def frame_counters(self):
+        """ for ExtTrigger.watch(): the hdf plugin capture counters, and how much they advance per trigger
+            nothing to count unless staged for external triggering
+        """
+        if not self._counting:
+            return []
+        return [(det.hdf.num_captured, self.frames_per_trigger()) for det in self.active_detectors]
 
     def trigger(self):
         #if len(self.active_detectors)==0:
         #    return
-        self._status = DeviceStatus(self)
         # this is now provided by ext_trig
         #if self.trigger_mode is not PilatusTriggerMode.soft and not self._flying:
         #    while self.trigger_lock.locked():
@@ -311,24 +376,36 @@ class LiXDetectors(Device):
         #    print("generating triggering pulse ...")
         #    self._trigger_signal.put(1, wait=True)
         #    self._trigger_signal.put(0, wait=True)
+        if self.trigger_mode is PilatusTriggerMode.soft:
+            # status to be cleared by _acquire_changed()
+            self._status = DeviceStatus(self)
+        else:
+            # ext: finish once every detector has captured all frames expected since stage()
+            # the counts are cumulative, the trigger pulse from ext_trig may come before or after this
+            self._n_expected += self.frames_per_trigger()
+            counters = [det.hdf.num_captured for det in self.active_detectors]
+            self._status = counter_status(self, counters, [self._n_expected]*len(counters),
+                                          self.trig_wait+self.trig_timeout)
         for det in self.active_detectors:
             det.trigger()
-        if self.trigger_mode is not PilatusTriggerMode.soft:
-            # soft: status to be cleared by _acquire_changed()
-            # ext: set up callback to clear status after the end-of-exposure
-            threading.Timer(self.trig_wait, self._status._finished, ()).start()
         # should advance the file number in external trigger mode???
 
         return self._status
 
+    def pulse_period(self):
+        """ the shortest spacing between hardware trigger pulses: the acquire period, plus the readout time
+        """
+        return self.acq_time+self.readout_time
+
     def repeat_ext_trigger(self, rep):
         """ this is used to produce external triggers to complete data collection by camserver
         """
-        for i in reversed(range(rep)):
-            self._trigger_signal.put(1, wait=True)
-            self._trigger_signal.put(0, wait=True)
-            time.sleep(self.acq_time)
-            print(f"# of triggers to go: {i} \r", end="")
+        period = self.pulse_period()
+        zebra.setup_burst(rep, period)
+        try:
+            zebra.fire_burst(timeout=rep*period+self.trig_timeout)
+        finally:
+            zebra.clear_burst()
 
     def _acquire_changed(self, value=None, old_value=None, **kwargs):
         if old_value==1 and value==0:
@@ -397,6 +474,7 @@ class LiXDetectors(Device):
 try:
     pil = LiXDetectors("XF:16IDC-DT")   
     pil.activate(["pil1M", "pilW2"])
+    ext_trig.watch([pil])
     if pil.active_detectors[0].armed.get()==0:
         pil.set_trigger_mode(PilatusTriggerMode.ext_multi)
         #pil.set_thresh()
@@ -1,48 +1,134 @@
 print(f"Loading {__file__}...")
 
-def update_metadata():
+import copy
+import epics
+
+class BeamlineSnapshot:
+    """ reads all PVs behind a nested layout of motors/signals at once, instead of one after another
+        layout: {key: {name: lambda: device, ...}, ...}, nested to any depth
+        the lambda may also return a list of devices, e.g. the lens groups of the CRL
+        devices that are not defined are left out, as are dictionaries that end up empty
+        pseudo axes, which have no PV of their own, are read through .position after the bulk read
+        by default every read() goes to the PVs, a previous result can be reused for max_age seconds,
+        e.g. in loops that call update_metadata() repeatedly while the beamline state does not change
+    """
+    def __init__(self, layout, max_age=0, timeout=2.):
+        self.layout = layout
+        self.max_age = max_age
+        self.timeout = timeout
+        self._snapshot = None
+        self._ts = 0
+
+    @staticmethod
+    def pvname(dev):
+        """ the PV to read for dev, or dev itself if it does not have one
+        """
+        if isinstance(dev, EpicsMotor):
+            return dev.user_readback.pvname
+        return getattr(dev, "pvname", dev)
+
+    def resolve(self, layout, path=""):
+        """ returns the same layout, with PV names in place of the devices
+        """
+        ret = {}
+        for k,v in layout.items():
+            if isinstance(v, dict):
+                d = self.resolve(v, f"{path}{k}.")
+                if len(d)>0:
+                    ret[k] = d
+                continue
+            try:
+                dev = v()
+            except (NameError, AttributeError) as e:
+                print(f"{path}{k} is not defined: {e}")
+                continue
+            if isinstance(dev, (list, tuple)):
+                ret[k] = [self.pvname(d) for d in dev]
+            else:
+                ret[k] = self.pvname(dev)
+        return ret
+
+    def read(self, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        if self._snapshot is not None and time.time()-self._ts<max_age:
+            return copy.deepcopy(self._snapshot)
+
+        pvs = self.resolve(self.layout)
+        pvlist = []
+        def flatten(d):
+            for v in d.values():
+                if isinstance(v, dict):
+                    flatten(v)
+                else:
+                    pvlist.extend([pv for pv in (v if isinstance(v, list) else [v]) if isinstance(pv, str)])
+        flatten(pvs)
+        # one parallel round trip for all PVs, None for those that did not respond
+        values = dict(zip(pvlist, epics.caget_many(pvlist, timeout=self.timeout)))
+        missing = [pv for pv,v in values.items() if v is None]
+        if len(missing)>0:
+            print(f"\nno response from {len(missing)} PV(s), recorded as None: {', '.join(missing)}")
+
+        def value(pv):
+            if isinstance(pv, str):
+                return values[pv]
+            return pv.position if hasattr(pv, "position") else pv.get()
+
+        def fill(d):
+            ret = {}
+            for k,v in d.items():
+                if isinstance(v, dict):
+                    ret[k] = fill(v)
+                elif isinstance(v, list):
+                    ret[k] = [value(pv) for pv in v]
+                else:
+                    ret[k] = value(v)
+            return ret
+        self._snapshot = fill(pvs)
+        self._ts = time.time()
+        return copy.deepcopy(self._snapshot)
+
+beamline_snapshot = BeamlineSnapshot({
+    'det_pos': {'saxs': {'x': lambda: saxs.x, 'y': lambda: saxs.y, 'z': lambda: saxs.z},
+                'waxs1': {'x': lambda: waxs1.x, 'y': lambda: waxs1.y, 'z': lambda: waxs1.z},
+                'waxs2': {'x': lambda: waxs2.x, 'y': lambda: waxs2.y, 'z': lambda: waxs2.z},
+               },
+    'energy': {'mono_bragg': lambda: mono.bragg,
+               'energy': lambda: pseudoE.energy,
+               'gap': lambda: pseudoE.IVUgap,
+              },
+    'optics': {'wbm_y': lambda: wbm.y,
+               'wbm_pitch': lambda: wbm.pitch,
+               'dcm_y2': lambda: mono.y,
+               'mono_x': lambda: mono.x,
+               'hfm_x1': lambda: hfm.x1,
+               'hfm_x2': lambda: hfm.x2,
+               'vfm_y1': lambda: vfm.y1,
+               'vfm_y2': lambda: vfm.y2,
+              },
+    'CRL': {'state': lambda: crl.lens_group,
+            'x1': lambda: crl.x1,
+            'y1': lambda: crl.y1,
+            'x2': lambda: crl.x2,
+            'y2': lambda: crl.y2,
+            'z': lambda: crl.z,
+           },
+    'slits': {'SSA': {'dx': lambda: ssa.dx, 'dy': lambda: ssa.dy},
+              'DDA': {'x': lambda: dda.x, 'y': lambda: dda.y, 'dx': lambda: dda.dx, 'dy': lambda: dda.dy},
+              'Sg': {'x': lambda: sg2.x, 'y': lambda: sg2.y, 'dx': lambda: sg2.dx, 'dy': lambda: sg2.dy},
+             },
+    'BPM': {'XBPM': lambda: [xbpm.x, xbpm.y],
+            'FOE': {'x': lambda: em0.x_position, 'y': lambda: em0.y_position},
+            'SS': {'stage position': {'x': lambda: bpm_pos.x, 'y': lambda: bpm_pos.y},
+                   'beam position': {'x': lambda: bpm.x_mean, 'y': lambda: bpm.y_mean}},
+           },
+})
+
+def update_metadata(max_age=None):
+    """ the beamline state is read by beamline_snapshot,
+        max_age (sec): reuse a previous snapshot if it is no older than this, always read by default
+    """
     print('updating meta data ...', end='')
-    RE.md['det_pos'] = ({'saxs': {'x':saxs.x.position, 'y':saxs.y.position, 'z':saxs.z.position},
-                         'waxs1': {'x':waxs1.x.position, 'y':waxs1.y.position, 'z':waxs1.z.position},
-                         'waxs2': {'x':waxs2.x.position, 'y':waxs2.y.position, 'z':waxs2.z.position},
-                        })
-    RE.md['energy'] = ({'mono_bragg': mono.bragg.position,
-                        'energy': pseudoE.energy.position, 
-                        'gap': pseudoE.IVUgap.position
-                       })
-    RE.md['optics'] = ({'wbm_y': wbm.y.position,
-                        'wbm_pitch': wbm.pitch.position,
-                        'dcm_y2': mono.y.position,
-                        'mono_x': mono.x.position, 
-                        'hfm_x1': hfm.x1.position,
-                        'hfm_x2': hfm.x2.position,
-                        'vfm_y1': vfm.y1.position,
-                        'vfm_y2': vfm.y2.position,
-                        })
-    
-    try:
-        RE.md['CRL'] = ({'state': crl.state(),
-                         'x1': crl.x1.position,
-                         'y1': crl.y1.position,
-                         'x2': crl.x2.position,
-                         'y2': crl.y2.position,
-                         'z': crl.z.position,
-                        })
-    except: 
-        print("crl is not defined.")    
-
-    sdict = {}
-    try:
-        sdict['SSA'] = {'dx': ssa.dx.position, 'dy': ssa.dy.position}
-    except:
-        print("ssa is not defined.")
-    sdict['DDA'] = {'x': dda.x.position, 'y': dda.y.position, 'dx': dda.dx.position, 'dy': dda.dy.position }
-    sdict['Sg'] = {'x': sg2.x.position, 'y': sg2.y.position, 'dx': sg2.dx.position, 'dy': sg2.dy.position }
-    RE.md['slits'] = (sdict)
-
-    RE.md['BPM'] = ({"XBPM": xbpm.pos(),
-                     "FOE": {'x': em0.x_position.get(), 'y': em0.y_position.get()},
-                     "SS": {'stage position': {'x': bpm_pos.x.position, 'y': bpm_pos.y.position},
-                           'beam position': {'x': bpm.x_mean.get(), 'y': bpm.y_mean.get()}},
-                    })
+    for k,v in beamline_snapshot.read(max_age).items():
+        RE.md[k] = v
     print('Done.')
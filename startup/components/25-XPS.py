@@ -18,7 +18,7 @@ from collections import OrderedDict
 import uuid
 import time, getpass
 
-from XPS_Q8_drivers3 import XPS
+from XPS_Q8_drivers3 import XPS,XPSSocketPool
 from ftplib import FTP
 
 import threading
@@ -66,21 +66,35 @@ class PositioningStackMicroscope(PositioningStack):
         print("ss.rx not available")
 
 class XPSController():
-    def __init__(self, ip_addr, name):
+    ftp_login = ("Administrator", "Administrator")
+
+    def __init__(self, ip_addr, name, n_sockets=3):
         self.xps = XPS()
         self.name = name
         self.ip_addr = ip_addr
         self.sID = self.xps.TCP_ConnectToServer(ip_addr, 5001, 0.050)
         # 20 ms timeout is suggested for single-socket communication, per programming manual
+        # position/status polling goes through its own socket, motion commands through the pool,
+        # so that neither waits for the other or for the trajectory commands sent on sID
+        self.status_sID = self.xps.TCP_ConnectToServer(ip_addr, 5001, 0.050)
+        self.pool = XPSSocketPool(self.xps, ip_addr, n_sockets, 0.050)
         self.groups = {}
         self.traj = None
         self.motors = {}
         self.update()
-        self.lock = threading.Lock()
-        self.ts = time.time()
-        self.status = {}
-        self.positions = {}
         self.check_status_interval = 0.05
+        self.monitor_idle_time = 2.
+        # the monitor thread polls all groups once per check_status_interval and replaces the snapshot 
+        # as a whole, readers just take the reference; callbacks are called with every new snapshot
+        # polling stops once there is no callback and no one has read the snapshot for monitor_idle_time
+        self.snapshot = {'ts': 0, 'status': {}, 'position': {}}
+        self._callbacks = {}
+        self._cb_lock = threading.Lock()
+        self._updated = threading.Condition()
+        self._wake = threading.Event()
+        self._last_read = 0
+        self._monitor = threading.Thread(target=self.monitor, daemon=True)
+        self._monitor.start()
 
     def synch_clock(self):
         """ time format follows HardwareDateAndTimeSet("Fri Sep 8 14:43:00 2023")
@@ -115,44 +129,111 @@ class XPSController():
                 self.motors[obj]['group'] = tl[0] 
                 self.motors[obj]['index'] = self.groups[tl[0]].index(obj)  
     
+    def monitor(self):
+        while True:
+            with self._cb_lock:
+                idle = len(self._callbacks)==0 
+            if idle and time.time()-self._last_read>self.monitor_idle_time:
+                self._wake.wait()
+                self._wake.clear()
+            
+            try:
+                snap = self.poll_groups()
+            except Exception as e:
+                print(f"{self.name} monitor: error polling the controller: {e}")
+                time.sleep(1)
+                continue
+            with self._updated:
+                self.snapshot = snap
+                self._updated.notify_all()
+
+            with self._cb_lock:
+                cbs = list(self._callbacks.items())
+            for cid,cb in cbs:
+                try:
+                    done = cb(snap)
+                except Exception as e:
+                    print(f"{self.name} monitor: error in callback {cb}: {e}")
+                    done = True
+                if done:
+                    self.unsubscribe(cid)
+            
+            time.sleep(self.check_status_interval)
+    
+    def poll_groups(self):
+        """ one GroupMotionStatusGet and one GroupPositionCurrentGet per group, regardless of the number of motors
+        """
+        snap = {'status': {}, 'position': {}}
+        for grp,mots in self.groups.items():
+            if len(mots)==0:
+                continue
+            for key,func in [('status', self.xps.GroupMotionStatusGet), 
+                             ('position', self.xps.GroupPositionCurrentGet)]:
+                err,ret = func(self.status_sID, grp, len(mots))
+                vals = ret.split(',')
+                for mot in mots:
+                    idx = self.motors[mot]['index']
+                    snap[key][mot] = (err, vals[idx] if idx<len(vals) else '')
+        snap['ts'] = time.time()
+        return snap
+    
+    def subscribe(self, cb):
+        """ cb(snapshot) is called by the monitor thread after every poll, until it returns True
+        """
+        cid = uuid.uuid4().hex
+        with self._cb_lock:
+            self._callbacks[cid] = cb
+        self._wake.set()
+        return cid
+    
+    def unsubscribe(self, cid):
+        with self._cb_lock:
+            self._callbacks.pop(cid, None)
+    
+    def get_snapshot(self, max_age=None, timeout=1.):
+        """ return the latest snapshot, wait for the next poll if it is older than max_age
+        """
+        if max_age is None:
+            max_age = 2*self.check_status_interval
+        t0 = time.time()
+        self._last_read = t0
+        snap = self.snapshot
+        if t0-snap['ts']>max_age:
+            with self._updated:
+                self._wake.set()
+                self._updated.wait_for(lambda: self.snapshot['ts']>t0, timeout)
+                snap = self.snapshot
+        return snap
+    
+    def wait_for_idle(self, mots, timeout=None):
+        """ block until none of the motors in the list is moving
+            an error in checking the status is raised here, rather than left to the monitor thread
+        """
+        ev = threading.Event()
+        errors = []
+        def cb(snap):
+            try:
+                for mot in mots:
+                    err,ret = snap['status'][mot]
+                    if int(err) or ret!='0':
+                        return False
+            except Exception as e:
+                errors.append(e)
+            ev.set()
+            return True
+        cid = self.subscribe(cb)
+        if not ev.wait(timeout):
+            self.unsubscribe(cid)
+            raise TimeoutError(f"motion of {mots} did not finish within {timeout} sec.")
+        if len(errors)>0:
+            raise RuntimeError(f"unable to check the status of {mots}: {errors[0]!r}")
+    
     def get_motor_status(self, mot):
-        grp = self.motors[mot]['group']
-        ts = time.time()
-        if ts-self.ts>self.check_status_interval or mot not in self.status.keys():
-            self.get_group_status(grp)
-        self.ts = ts
-        return self.status[mot]
+        return self.get_snapshot()['status'].get(mot, ('-2', ''))
                 
-    def get_group_status(self, grp):
-        self.lock.acquire()
-        err,ret = self.xps.GroupMotionStatusGet(self.sID, grp,len(self.groups[grp]))
-        if err!='0' or len(ret)==0:
-            print(f"trouble getting group status for {grp}...: ", err,ret)
-        self.lock.release()
-        status = ret.split(',')
-        for mot in self.groups[grp]:
-            self.status[mot] = (err,status[self.motors[mot]['index']])
-        return err,ret
-        
     def get_motor_position(self, mot):
-        grp = self.motors[mot]['group']
-        ts = time.time()
-        if ts-self.ts>self.check_status_interval or mot not in self.positions.keys():
-            self.get_group_position(grp)
-        self.ts = ts
-        return self.positions[mot]
+        return self.get_snapshot()['position'].get(mot, ('-2', ''))
 
-    def get_group_position(self, grp):
-        self.lock.acquire()
-        err,ret = self.xps.GroupPositionCurrentGet(self.sID, grp,len(self.groups[grp]))
-        if err!='0' or len(ret)==0:
-            print(f"trouble getting group position for {grp} ...: ", err,ret)
-        self.lock.release()
-        pos = ret.split(',')
-        for mot in self.groups[grp]:
-            self.positions[mot] = (err,pos[self.motors[mot]['index']])
-        return err,ret
-        
     def def_motor(self, motorName, OphydName, egu="mm", direction=1): 
         if not motorName in self.motors.keys():
             raise Exception(f"{motorName} is not a valid motor.")
@@ -181,6 +262,10 @@ class XPSmotor(PositionerBase):
         self._dir = direction
         self._position = None
         self.setpoint = None
+        self._move_cid = None
+        # the move status is completed by whichever comes first: check_stop(), a failed move or stop()
+        self._move_lock = threading.Lock()
+        self._move_finished = True
         self.user_offset_dir = Signal(parent=self, name="motor dir", value=direction)
         self._limits = [0., 0.]
         
@@ -192,16 +277,46 @@ class XPSmotor(PositionerBase):
     def limits(self, var):
         self._limits = var
         
-    def wait_for_stop(self, poll_time=0.1, tol=0.001):
-        if self.debug:
-            print(f"{self.name}: waiting for stop ...")
-        pos = self.position
-        while self.moving or abs(self.position-self.set_point*self._dir)>tol:
-            time.sleep(poll_time)
-            pos = self.position
-        time.sleep(self.settle_time)
-        print(f"done moving {self.name}, pos={pos:.3f}")
-        self._done_moving(success=True, timestamp=time.time())
+    def check_stop(self, snap, tol=0.001):
+        """ called by the controller monitor with each new snapshot, until the motor arrives at the set point
+        """
+        err,ret = snap['status'][self.motorName]
+        if int(err) or ret!='0':
+            return False
+        err,ret = snap['position'][self.motorName]
+        if int(err):
+            return False
+        pos = float(ret)
+        if abs(pos-self.set_point)>tol:
+            return False
+        if not self._finish_move():
+            return True
+        self._position = pos
+        print(f"done moving {self.name}, pos={pos*self._dir:.3f}")
+        if self.settle_time>0:  # don't hold up the monitor thread
+            threading.Timer(self.settle_time, self._done_moving, 
+                            kwargs={'success': True, 'timestamp': time.time()}).start()
+        else:
+            self._done_moving(success=True, timestamp=time.time())
+        return True
+    
+    def _finish_move(self):
+        """ returns True only for the first caller after each move()
+        """
+        with self._move_lock:
+            if self._move_finished:
+                return False
+            self._move_finished = True
+            return True
+    
+    def _move(self):
+        err,ret = self.controller.pool.call(self.controller.xps.GroupMoveAbsolute, self.motorName, [self.set_point])
+        if err!='0':
+            print(f"error moving {self.name}: ", err, ret)
+            self.controller.unsubscribe(self._move_cid)
+            # check_stop() may have seen the motor arrive before the error was returned
+            if self._finish_move():
+                self._done_moving(success=False, timestamp=time.time())
     
     def move(self, position, wait=True, **kwargs): #moved_cb=None, timeout=None, 
         if self.debug:
@@ -213,9 +328,12 @@ class XPSmotor(PositionerBase):
         self.set_point = position*self._dir
         self._status = super().move(self.set_point, **kwargs)
         self._run_subs(sub_type=PositionerBase.SUB_START)
+        self._move_finished = False
         
-        err,ret = self.controller.xps.GroupMoveAbsolute(self.controller.sID, self.motorName, [self.set_point])
-        threading.Thread(target=self.wait_for_stop).start() 
+        # GroupMoveAbsolute does not return until the move is done, run it on a pooled socket
+        # the move status is completed by check_stop(), called from the controller monitor
+        self._move_cid = self.controller.subscribe(self.check_stop)
+        threading.Thread(target=self._move).start() 
         
         try:
             if wait:
@@ -294,8 +412,10 @@ class XPSmotor(PositionerBase):
         if self.debug:
             print(f"{self.name}: stop requested ...")
 
-        err,ret = self.controller.xps.GroupMoveAbort(self.controller.sID, self.motorName)
-        self._done_moving()
+        self.controller.unsubscribe(self._move_cid)
+        err,ret = self.controller.pool.call(self.controller.xps.GroupMoveAbort, self.motorName)
+        if self._finish_move():
+            self._done_moving()
         
     def read(self):
         d = OrderedDict()
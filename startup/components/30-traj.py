@@ -1,5 +1,34 @@
 print(f"Loading {__file__}...")
 
+import hashlib,io
+from concurrent.futures import ThreadPoolExecutor
+
+class ReadbackStore:
+    """ preallocated arrays for the trajectory readback, one per key, e.g. {'fast_axis': Nfast*Nslow}
+        store[key] returns the part that has been filled so far; the arrays grow if more data arrive than expected
+    """
+    def __init__(self, sizes):
+        self.data = {k: np.full(max(n, 1), np.nan) for k,n in sizes.items()}
+        self.n = {k: 0 for k in sizes.keys()}
+    
+    def append(self, key, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float)).ravel()
+        n0 = self.n[key]
+        n1 = n0+len(values)
+        if n1>len(self.data[key]):
+            buf = np.full(max(n1, 2*len(self.data[key])), np.nan)
+            buf[:n0] = self.data[key][:n0]
+            self.data[key] = buf
+        self.data[key][n0:n1] = values
+        self.n[key] = n1
+        
+    def __getitem__(self, key):
+        return self.data[key][:self.n[key]]
+    
+    def keys(self):
+        return self.data.keys()
+        
+
 class trajControl(Device):
     def __init__(self, *args, **kwargs):
         
@@ -17,6 +46,11 @@ class trajControl(Device):
         self.start_time = 0
         self._traj_status = None
         self.flying_motor = None
+        # the readback of a line is gathered in the background, while the plan moves on to the next line
+        self._readback_executor = ThreadPoolExecutor(max_workers=1)
+        self._readback = None
+        # emit one event per line in collect(), instead of a single event for the whole scan 
+        self.collect_per_line = False
         
         
     def stage(self):
@@ -27,8 +61,8 @@ class trajControl(Device):
         """ abort whatever is still going on??
         """
         #self.abort_traj()
-        while self.moving():
-            time.sleep(0.2)
+        self.wait_for_stop()
+        self.wait_readback()
         self._traj_status = None
         
     def read_configuration(self):
@@ -44,9 +78,11 @@ class trajControl(Device):
           if val is not None
         }
     
-    def setup_traj(self, fast_axis, f_start, f_end, Nfast, step_size, dt, slow_axis=None, Nslow=1):
+    def setup_traj(self, fast_axis, f_start, f_end, Nfast, step_size, dt, slow_axis=None, Nslow=1, 
+                   s_start=None, s_end=None, snake=False):
         """ Nfast triggers, Nfast-1 segments 
             f_start and f_end are absolute positions
+            snake: run all Nslow lines as a single trajectory, s_start and s_end are then required
         """
         self.define_traj(fast_axis, Nfast-1, step_size, dt)
         
@@ -80,6 +116,9 @@ class trajControl(Device):
             self.traj_par['slow_axis'] = slow_axis.name  
         else:
             self.traj_par['slow_axis'] = None
+        self.traj_par['snake'] = snake
+        if snake:
+            self.define_snake_traj(slow_axis, s_start, s_end, Nslow)
         
     def select_forward_traj(self, op=True):
         if op:
@@ -92,6 +131,10 @@ class trajControl(Device):
             return False
         return self.flying_motor.moving
     
+    def wait_for_stop(self, poll_time=0.2):
+        while self.moving():
+            time.sleep(poll_time)
+    
     def abort_traj(self):
         if self.flying_motor is not None:
             self.flying_motor.stop()
@@ -107,29 +150,65 @@ class trajControl(Device):
         
         self._traj_status = DeviceStatus(self)
       
-        th = threading.Thread(target=self.exec_traj, args=(self.traj_par['run_forward_traj'], ) )
+        th = threading.Thread(target=self.run_traj, args=(self.traj_par['run_forward_traj'], ) )
         th.start() 
         
         print("traj kicked off ...")
         return self._traj_status
         
+    def run_traj(self, forward):
+        """ run exec_traj() and make sure that the status is always completed 
+        """
+        status = self._traj_status
+        try:
+            self.exec_traj(forward)
+        except Exception as e:
+            print(f"error executing trajectory: {e}")
+            self.aborted = True
+            if not status.done:
+                status.set_exception(e)
+            return
+        if status.done:
+            pass
+        elif self.aborted:
+            status.set_exception(Exception("unable to complete the scan due to hardware issues ..."))
+        else:
+            status._finished()
+        
     def complete(self):
         """
             according to run_engine.py: Tell a flyer, 'stop collecting, whenever you are ready'.
             Return a status object tied to 'done'.
+            this returns right away, the RunEngine waits on the status 
         """
         print("completing traj ...")
         if self._traj_status is None:
             raise RuntimeError("must call kickoff() before complete()")
-        while not self._traj_status.done:
-            print(f"{time.asctime()}: waiting for the trajectory to finish ...   \r", end='')
-            time.sleep(1)
-        if self.aborted:
-            raise Exception("unable to complete the scan due to hardware issues ...")
-        print("traj completed ...")
-             
         return self._traj_status
         
+    def slow_axis_readback(self):
+        """ position of the slow axis and the time it is read, (None, None) if there is no slow axis
+            must be called by exec_traj() before returning, the plan moves the slow axis to the next line after that
+        """
+        if self.slow_axis is None:
+            return None, None
+        return self.slow_axis.position, time.time()
+        
+    def update_readback_async(self, slow_pos=None, slow_ts=None):
+        """ called by exec_traj() once the motion is done, the status can then be finished without 
+            waiting for the readback; only the readback from the controller is done in the background,
+            slow_pos/slow_ts are taken beforehand by slow_axis_readback()
+        """
+        self.wait_readback()
+        self._readback = self._readback_executor.submit(self.update_readback, slow_pos, slow_ts)
+        
+    def wait_readback(self):
+        """ wait for the readback of the previous line, e.g. before the data on the controller is reset 
+        """
+        if self._readback is not None:
+            self._readback.result()
+            self._readback = None
+        
     def collect(self):
         """
         this is the "event"???
@@ -138,33 +217,47 @@ class trajControl(Device):
         also include the detector image info
         """
         print("in traj collect ...")
-        now = time.time()
-        data = {}
-        ts = {}
-
-        data[self.traj_par['fast_axis']] = self.read_back['fast_axis']
-        ts[self.traj_par['fast_axis']] = self.read_back['timestamp']  # timestamps
+        self.wait_readback()
+        fast = self.read_back['fast_axis']
+        tfast = self.read_back['timestamp']
         if self.slow_axis is not None:
-            data[self.traj_par['slow_axis']] = self.read_back['slow_axis']
-            ts[self.traj_par['slow_axis']] = self.read_back['timestamp2']
-                
-        ret = {'time': time.time(),
-               'data': data,
-               'timestamps': ts,
-              }
+            slow = self.read_back['slow_axis']
+            tslow = self.read_back['timestamp2']
+        
+        if self.collect_per_line:
+            Nfast = self.traj_par['Nfast']
+            lines = [slice(i, i+Nfast) for i in range(0, len(fast), Nfast)]
+        else:
+            lines = [slice(None)]
+        for i,sl in enumerate(lines):
+            data = {self.traj_par['fast_axis']: fast[sl]}
+            ts = {self.traj_par['fast_axis']: tfast[sl]}  # timestamps
+            if self.slow_axis is not None:
+                data[self.traj_par['slow_axis']] = slow[i] if self.collect_per_line else slow
+                ts[self.traj_par['slow_axis']] = tslow[i] if self.collect_per_line else tslow
+            yield {'time': time.time(),
+                   'data': data,
+                   'timestamps': ts,
+                  }
         print("done collecting traj")
-        yield ret
 
     def describe_collect(self):
         '''Describe details for the flyer collect() method'''
         print("in traj describe_collect ...")
+        self.wait_readback()
         ret = {}
+        if self.collect_per_line:
+            shape1 = (self.traj_par['Nfast'],)
+        else:
+            shape1 = (len(self.read_back['fast_axis']),)
         ret[self.traj_par['fast_axis']] = {'dtype': 'number',
-                                           'shape': (len(self.read_back['fast_axis']),),
+                                           'shape': shape1,
                                            'source': 'PVT trajectory readback position'}
         if self.slow_axis is not None:
+            # read_back only has the slow axis if there is one
+            shape2 = () if self.collect_per_line else (len(self.read_back['slow_axis']),)
             ret[self.traj_par['slow_axis']] = {'dtype': 'number',
-                                               'shape': (len(self.read_back['slow_axis']),),
+                                               'shape': shape2,
                                                'source': 'motor position readback'}
                 
         return {self.name: ret}
@@ -172,6 +265,9 @@ class trajControl(Device):
     def define_traj(self, motor, N, dx, dt, Nr=2):
         raise Exception("this function is not implemented.")
 
+    def define_snake_traj(self, slow_axis, s_start, s_end, Nslow):
+        raise Exception(f"snake trajectory is not supported by {self.name}.")
+
     def exec_traj(self, forward=True, **kwargs):
         raise Exception("this function is not implemented.")
 
@@ -179,31 +275,37 @@ class trajControl(Device):
         raise Exception("this function is not implemented.")
 
     def clear_readback(self):
-        self.read_back = {}
-        self.read_back['fast_axis'] = []
-        self.read_back['timestamp'] = []
+        """ sized from the scan set up in setup_traj()
+        """
+        Npts = self.traj_par.get('Nem2', 0)
+        sizes = {'fast_axis': Npts, 'timestamp': Npts}
         if self.slow_axis is not None:
-            self.read_back['slow_axis'] = []
-            self.read_back['timestamp2'] = []
+            Nlines = Npts//self.traj_par['Nfast'] if Npts>0 else 0
+            sizes.update({'slow_axis': Nlines, 'timestamp2': Nlines})
+        self.read_back = ReadbackStore(sizes)
         
-    def update_readback(self):
-        pos = self.readback_traj()
+    def readback_timestamps(self):
         # start_time is the beginning of the execution
         # pulse is generated when the positioner enters the segment ??
         # timestamp correspond to the middle of the segment
         N = self.traj_par['no_of_segments']
         Nr = self.traj_par['no_of_rampup_points']
         dt = self.traj_par['segment_duration']
-        ts = self.start_time + (0.5 + Nr + np.arange(N+1))*dt
+        return self.start_time + (0.5 + Nr + np.arange(N+1))*dt
+        
+    def update_readback(self, slow_pos=None, slow_ts=None):
+        pos = self.readback_traj()
+        ts = self.readback_timestamps()
+        N = self.traj_par['no_of_segments']
         if len(pos)!=N+1:
             print(f"Warning: incorrect readback length {len(pos)}, expecting {N+1}")
             print(pos)
-        self.read_back['fast_axis'] += list(pos)
-        self.read_back['timestamp'] += list(ts)
+        self.read_back.append('fast_axis', pos)
+        self.read_back.append('timestamp', ts)
 
         if self.slow_axis is not None:
-            self.read_back['slow_axis'].append(self.slow_axis.position)
-            self.read_back['timestamp2'].append(time.time())
+            self.read_back.append('slow_axis', slow_pos)
+            self.read_back.append('timestamp2', slow_ts)
 
         print("traj data updated ..")
 
@@ -232,9 +334,119 @@ class XPStraj(trajControl):
         self.sID = controller.sID
         
         self.verified = False
-        uname = getpass.getuser()
-        self.traj_files = ["TrajScan_FW.trj-%s" % uname, "TrajScan_BK.trj-%s" % uname]
+        self.uname = getpass.getuser()
+        self.traj_files = ["TrajScan_FW.trj-%s" % self.uname, "TrajScan_BK.trj-%s" % self.uname]
+        # trajectories already uploaded to and verified by the controller, keyed by (motor, N, dx, dt, Nr)
+        # each entry has its own pair of files, the oldest ones are deleted from the controller
+        self.traj_lib = OrderedDict()
+        self.traj_lib_size = 20
+        self._stale_traj_files = []
+    
+    @staticmethod
+    def jerk_profile(N, dt, Nr=2):
+        """ unscaled jerk-limited profile: Nr segments to ramp up, N segments at constant velocity, Nr to ramp down
+            returns displacement and velocity for each segment, the velocity is zero at both ends
+        """
+        jj = np.zeros(Nr+N+Nr)
+        jj[0] = 1; jj[Nr-1] = -1
+        jj[-1] = 1; jj[-Nr] = -1
+        # these include the starting state of acc=vel=disp=0
+        acc = np.concatenate([[0], np.cumsum(jj*dt)])
+        vel = np.concatenate([[0], np.cumsum(acc[:-1]*dt + jj*dt*dt/2)])
+        disp = np.concatenate([[0], vel[:-1]*dt + acc[:-1]*dt*dt/2 + jj*dt*dt*dt/6])
+        return disp[1:], vel[1:]
+    
+    @classmethod
+    def pvt_profile(cls, N, dx, dt, Nr=2):
+        """ the jerk-limited profile scaled to segments of length dx at constant velocity
+            returns displacement and velocity at the end of each segment, and the ramp-up distance
+        """
+        disp,vel = cls.jerk_profile(N, dt, Nr)
+        vel = vel/vel.max()*dx/dt
+        disp = disp/disp.max()*dx
+        return disp, vel, disp[:Nr].sum()
+    
+    @staticmethod
+    def format_pvt(ot):
+        return "\n".join([", ".join([f"{v:f}" for v in row]) for row in ot]).encode()+b"\n"
     
+    def pvt_files(self, motor_name, N, dx, dt, Nr=2):
+        """ content of the FW/BK trajectory files
+            rows in a PVT trajectory file correspond ot the segments  
+            for each row/segment, the elements are
+                time, axis 1 displancement, axis 1 velocity out, axsi 2 ... 
+        """
+        disp,vel,ramp_dist = self.pvt_profile(N, dx, dt, Nr)
+        midx = self.controller.motors[motor_name]['index']
+        ret = []
+        for sign in [1, -1]:
+            ot = np.zeros((Nr+N+Nr, 1+2*self.Nmot))
+            ot[:, 0] = dt
+            ot[:, 2*midx+1] = sign*disp
+            ot[:, 2*midx+2] = sign*vel
+            ret.append(self.format_pvt(ot))
+        return ret, ramp_dist
+    
+    def upload_traj_files(self, files):
+        """ files: {file name: content}
+            also removes the files of the trajectories evicted from traj_lib
+        """
+        ftp = FTP(self.controller.ip_addr)
+        ftp.connect()
+        ftp.login(*self.controller.ftp_login)
+        ftp.cwd("Public/Trajectories")
+        for fn in self._stale_traj_files:
+            try:
+                ftp.delete(fn)
+            except Exception as e:
+                print(f"unable to delete {fn} from the controller: {e}")
+        self._stale_traj_files = []
+        for fn,content in files.items():
+            ftp.storbinary('STOR %s' % fn, io.BytesIO(content))
+        ftp.quit()
+        
+    def load_traj(self, key, contents, mname):
+        """ contents: {file tag: content}
+            upload and verify the trajectory files, unless they are already in traj_lib under the same key
+            returns the file names on the controller 
+        """
+        digest = hashlib.sha1(b"".join(contents.values())).hexdigest()
+        entry = self.traj_lib.get(key)
+        if entry is not None and entry['hash']==digest:
+            self.traj_lib.move_to_end(key)
+            return entry['files']
+
+        files = [f"TrajScan_{digest[:10]}_{tag}.trj-{self.uname}" for tag in contents.keys()]
+        self.upload_traj_files(dict(zip(files, contents.values())))
+        for fn in files:
+            err,ret = self.xps.MultipleAxesPVTVerification(self.sID, self.group, fn)
+            if err!='0':
+                print(ret)
+                raise Exception("trajectory verification failed.")
+            err,ret = self.xps.MultipleAxesPVTVerificationResultGet (self.sID, mname)
+        self.traj_lib[key] = {'files': files, 'hash': digest}
+        while len(self.traj_lib)>self.traj_lib_size:
+            _,old = self.traj_lib.popitem(last=False)
+            self._stale_traj_files += [fn for fn in old['files'] if fn not in files]
+        return files
+        
+    def wait_for_stop(self, timeout=None):
+        """ completed by the controller monitor, instead of polling the motion status here
+            in a snake scan, the slow axis is also part of the trajectory
+        """
+        if self.flying_motor is None:
+            return
+        mots = [self.flying_motor.motorName]
+        if self.traj_par.get('snake', False):
+            mots.append(self.snake_par['motor'])
+        self.controller.wait_for_idle(mots, timeout)
+        
+    def clear_traj_lib(self):
+        """ forget all cached trajectories, e.g. after the controller is rebooted or the files are removed
+        """
+        for entry in self.traj_lib.values():
+            self._stale_traj_files += entry['files']
+        self.traj_lib.clear()
         
     def define_traj(self, motor, N, dx, dt, Nr=2):
         """ the idea is to use FW/BK trjectories in a scan
@@ -253,6 +465,7 @@ class XPStraj(trajControl):
             1.0,  0,0,     0.0
             detector triggering should start from the 5th segment
             
+            the trajectory files are uploaded and verified only if the same trajectory is not in traj_lib
         """        
         self.verified = False
 
@@ -260,73 +473,72 @@ class XPStraj(trajControl):
             # motor is an Ophyd device 
             print(f"{motor.name} not in the list of motors: ", self.motors)
             raise Exception
-        self.flying_motor = self.controller.motors[self.motors[motor.name]]['ophyd']
+        mname = self.motors[motor.name]
+        self.flying_motor = self.controller.motors[mname]['ophyd']
         
-        err,ret = self.xps.PositionerMaximumVelocityAndAccelerationGet(self.sID, self.motors[motor.name])
-        mvel,macc = np.asarray(ret.split(','), dtype=float)
-        midx = self.controller.motors[self.motors[motor.name]]['index']
-        
-        jj = np.zeros(Nr+N+Nr)
-        jj[0] = 1; jj[Nr-1] = -1
-        jj[-1] = 1; jj[-Nr] = -1
-        # these include the starting state of acc=vel=disp=0
-        disp = np.zeros(Nr+N+Nr+1)
-        vel = np.zeros(Nr+N+Nr+1)
-        acc = np.zeros(Nr+N+Nr+1)
-
-        for i in range(N+2*Nr):
-            acc[i+1] = acc[i] + jj[i]*dt
-            vel[i+1] = vel[i] + acc[i]*dt + jj[i]*dt*dt/2
-            disp[i+1] = vel[i]*dt + acc[i]*dt*dt/2 + jj[i]*dt*dt*dt/6
-        vel = vel/vel.max()*dx/dt
-        disp = disp/disp.max()*dx
-        self.ramp_dist = disp[1:Nr+1].sum()
-        
-        # rows in a PVT trajectory file correspond ot the segments  
-        # for each row/segment, the elements are
-        #     time, axis 1 displancement, axis 1 velocity out, axsi 2 ... 
-        ot1 = np.zeros((Nr+N+Nr, 1+2*self.Nmot))
-        ot1[:, 0] = dt
-        ot1[:, 2*midx+1] = disp[1:] 
-        ot1[:, 2*midx+2] = vel[1:] 
-        ot2 = np.zeros((Nr+N+Nr, 1+2*self.Nmot))
-        ot2[:, 0] = dt
-        ot2[:, 2*midx+1] = -disp[1:] 
-        ot2[:, 2*midx+2] = -vel[1:] 
-        
-        np.savetxt("/tmp/"+self.traj_files[0], ot1, fmt='%f', delimiter=', ')
-        np.savetxt("/tmp/"+self.traj_files[1], ot2, fmt='%f', delimiter=', ')
-        ftp = FTP(self.controller.ip_addr)
-        ftp.connect()
-        ftp.login("Administrator", "Administrator")
-        ftp.cwd("Public/Trajectories")
-        for fn in self.traj_files:
-            file = open("/tmp/"+fn, "rb")
-            ftp.storbinary('STOR %s' % fn, file)
-            file.close()
-        ftp.quit()
+        contents,self.ramp_dist = self.pvt_files(mname, N, dx, dt, Nr)
+        self.traj_files = self.load_traj((mname, N, dx, dt, Nr), dict(zip(["FW", "BK"], contents)), mname)
         
-        for fn in self.traj_files:
-            err,ret = self.xps.MultipleAxesPVTVerification(self.sID, self.group, fn)
-            if err!='0':
-                print(ret)
-                raise Exception("trajectory verification failed.")
-            err,ret = self.xps.MultipleAxesPVTVerificationResultGet (self.sID, self.motors[motor.name])
         self.verified = True
         self.traj_par = {'run_forward_traj': True, 
                          'no_of_segments': N, 
                          'no_of_rampup_points': Nr,
                          'segment_displacement': dx,
                          'segment_duration': dt,
-                         'motor': self.motors[motor.name],
+                         'motor': mname,
                          'rampup_distance': self.ramp_dist,
                         }
 
         self.time_modified = time.time()
         
+    def define_snake_traj(self, slow_axis, s_start, s_end, Nslow):
+        """ a single trajectory that covers all Nslow lines, alternating the direction of the fast axis
+            the slow axis steps during the ramp-down/ramp-up between lines, using the same jerk-limited profile
+            define_traj() must have been called first, the first line runs in the direction of run_forward_first
+
+            the XPS produces trigger pulses throughout the trajectory, including the turnarounds, those pulses
+            are blocked by gating in the Zebra, see exec_traj() 
+        """
+        if slow_axis is None or slow_axis.name not in self.motors.keys():
+            raise Exception(f"the slow axis must be one of {list(self.motors.keys())} for a snake trajectory.")
+        self.verified = False
+        
+        fast = self.traj_par['motor']
+        slow = self.motors[slow_axis.name]
+        N = self.traj_par['no_of_segments']
+        Nr = self.traj_par['no_of_rampup_points']
+        dx = self.traj_par['segment_displacement']
+        dt = self.traj_par['segment_duration']
+        forward = self.traj_par['run_forward_first']
+        P = N+2*Nr    # number of segments per line
+        # controller positions, same as XPSmotor.move()
+        dy = 0 if Nslow==1 else (s_end-s_start)/(Nslow-1)*slow_axis._dir
+
+        disp,vel,_ = self.pvt_profile(N, dx, dt, Nr)
+        signs = (1 if forward else -1)*(-1)**np.arange(Nslow)
+        fidx = self.controller.motors[fast]['index']
+        sidx = self.controller.motors[slow]['index']
+        ot = np.zeros((Nslow*P, 1+2*self.Nmot))
+        ot[:, 0] = dt
+        ot[:, 2*fidx+1] = np.outer(signs, disp).flatten()
+        ot[:, 2*fidx+2] = np.outer(signs, vel).flatten()
+        if Nslow>1 and dy!=0:
+            sdisp,svel = self.jerk_profile(0, dt, Nr)
+            scale = dy/sdisp.sum()
+            rows = (np.arange(1, Nslow)[:,None]*P + np.arange(-Nr, Nr)).flatten()
+            ot[rows, 2*sidx+1] = np.tile(sdisp*scale, Nslow-1)
+            ot[rows, 2*sidx+2] = np.tile(svel*scale, Nslow-1)
+        
+        key = ("snake", fast, slow, N, dx, dt, Nr, Nslow, dy, forward)
+        fn, = self.load_traj(key, {"SN": self.format_pvt(ot)}, fast)
+        self.snake_par = {'file': fn, 'motor': slow, 'start_pos': s_start*slow_axis._dir, 
+                          'Nlines': Nslow, 'segments_per_line': P}
+        self.traj_par['snake'] = True
+        self.verified = True
+    
     def exec_traj(self, forward=True, clean_event_queue=False, n_retry=5):
         """
-           execuate either the foward or backward trajectory
+           execuate either the foward or backward trajectory, or the snake trajectory covering all lines
         """
         if self.verified==False:
             raise Exception("trajectory not defined/verified.")
@@ -335,28 +547,46 @@ class XPStraj(trajControl):
         Nr = self.traj_par['no_of_rampup_points']
         motor = self.traj_par['motor']
         dt = self.traj_par['segment_duration']
+        snake = self.traj_par.get('snake', False)
         
-        if forward: 
+        if snake:
+            traj_fn = self.snake_par['file']
+        elif forward: 
             traj_fn = self.traj_files[0]
         else:
             traj_fn = self.traj_files[1]
         
         print("moving into starting position ...")
+        # on a pooled socket, so that the readback of the previous line can continue on sID 
+        pool = self.controller.pool
         pos = (self.traj_par['ready_pos'][0] if forward else self.traj_par['ready_pos'][1])
-        err,ret = self.xps.GroupMoveAbsolute(self.sID, self.traj_par['motor'], [pos])
+        err,ret = pool.call(self.xps.GroupMoveAbsolute, self.traj_par['motor'], [pos])
+        gathering = [motor+".CurrentPosition"]
+        if snake:
+            err,ret = pool.call(self.xps.GroupMoveAbsolute, self.snake_par['motor'], [self.snake_par['start_pos']])
+            gathering.append(self.snake_par['motor']+".CurrentPosition")
             
         # otherwise starting the trajectory might generate an error
-        while self.moving():
-            time.sleep(0.2)
+        self.wait_for_stop()
         
         print("executing trajectory ...")
-        # first set up gathering
+        # first set up gathering, the data from the previous line must have been read 
+        self.wait_readback()
         self.xps.GatheringReset(self.sID)        
         # pulse is generated when the positioner enters the segment
-        print("starting a trajectory with triggering parameters: %d, %d, %.3f ..." % (Nr+1, N+Nr+1, dt))
-        self.xps.MultipleAxesPVTPulseOutputSet(self.sID, self.group, Nr+1, N+Nr+1, dt)
+        if snake:
+            # the first pulse, one segment before the first line, arms the Zebra and is not passed on
+            # the time gates then pass only the N+1 pulses of each line 
+            P = self.snake_par['segments_per_line']
+            Nlines = self.snake_par['Nlines']
+            p0,p1 = Nr, Nr+1+(Nlines-1)*P+N
+            zebra.gate_trigger_pulses(dt/2, (N+1)*dt, P*dt, Nlines)
+        else:
+            p0,p1 = Nr+1, N+Nr+1
+        print("starting a trajectory with triggering parameters: %d, %d, %.3f ..." % (p0, p1, dt))
+        self.xps.MultipleAxesPVTPulseOutputSet(self.sID, self.group, p0, p1, dt)
         self.xps.MultipleAxesPVTVerification(self.sID, self.group, traj_fn)
-        self.xps.GatheringConfigurationSet(self.sID, [motor+".CurrentPosition"])        
+        self.xps.GatheringConfigurationSet(self.sID, gathering)        
         self.xps.EventExtendedConfigurationTriggerSet(self.sID,
                                                       ["Always", f"{self.group}.PVT.TrajectoryPulse"],
                                                       ["0", "0"], ["0", "0"], ["0", "0"], ["0", "0"])
@@ -382,16 +612,18 @@ class XPStraj(trajControl):
             [err, ret] = self.xps.GroupMotionEnable(self.sID, self.group)
             print(f"attempted to re-enable motion group: ", end='')
             time.sleep(1)
+        if snake:
+            zebra.ungate_trigger_pulses()
         
         if not self.aborted:
             self.xps.GatheringStopAndSave(self.sID)
             self.xps.EventExtendedRemove(self.sID, eID)
-            self.update_readback()
+            if snake:  # the slow axis is in the gathered data
+                self.update_readback_async()
+            else:
+                self.update_readback_async(*self.slow_axis_readback())
             print('end of trajectory execution, ', end='')
 
-        if self._traj_status != None:
-            self._traj_status._finished()
-
         # for testing only
         #if caget('XF:16IDC-ES:XPSAux1Bi0'):
         #    self.aborted = True
@@ -402,7 +634,37 @@ class XPStraj(trajControl):
         ndata = int(ret.split(',')[0])
         err,ret = self.xps.GatheringDataMultipleLinesGet(self.sID, 0, ndata)
         
-        return [float(p) for p in ret.split('\n') if p!='']
+        # one line per data point, one column per gathered position, separated by ;
+        ncol = len([v for v in ret.split('\n', 1)[0].split(';') if v.strip()!=''])
+        data = np.fromstring(ret.replace(';', ' '), sep=' ')
+        if ncol>1:
+            return data[:len(data)//ncol*ncol].reshape(-1, ncol)
+        return data
+
+    def update_readback(self, slow_pos=None, slow_ts=None):
+        if not self.traj_par.get('snake', False):
+            return super().update_readback(slow_pos, slow_ts)
+        
+        # split the gathered data into lines, the first point was taken at the arming pulse
+        data = np.asarray(self.readback_traj())
+        N = self.traj_par['no_of_segments']
+        Nr = self.traj_par['no_of_rampup_points']
+        dt = self.traj_par['segment_duration']
+        P = self.snake_par['segments_per_line']
+        Nlines = self.snake_par['Nlines']
+        idx = 1 + np.arange(Nlines)[:,None]*P + np.arange(N+1)
+        if len(data)<=idx.max():
+            print(f"Warning: incorrect readback length {len(data)}, expecting {idx.max()+1}")
+            data = np.vstack([data.reshape(-1,2), np.full((idx.max()+1-len(data), 2), np.nan)])
+        ts = self.start_time + (0.5 + Nr + idx - 1)*dt
+        self.read_back.append('fast_axis', data[idx, 0])
+        self.read_back.append('timestamp', ts)
+
+        if self.slow_axis is not None:
+            self.read_back.append('slow_axis', np.nanmean(data[idx, 1], axis=1)*self.slow_axis._dir)
+            self.read_back.append('timestamp2', ts.mean(axis=1))
+
+        print("traj data updated ..")
     
 
 class ZEBRAtraj(trajControl):
@@ -415,6 +677,12 @@ class ZEBRAtraj(trajControl):
         super().__init__(name=controller.name+"_traj", **kwargs)
         self.controller = controller
         self.vel_scale = 2.1
+        # captured positions are read during the line once this many are available 
+        self.capture_chunk = 1000
+        self._capture_executor = ThreadPoolExecutor(max_workers=1)
+        self._capture = None
+        self.arm_time = 0
+        self._pc_time = []
 
         # need to revise Zebra IOC to get PV names for connected motors
         # self.motors provides the encoder number based on the PV name of the motor
@@ -510,28 +778,86 @@ class ZEBRAtraj(trajControl):
         motor.move(ready_pos, wait=True)
         
         print("arming Zebra PC ...")
+        self.wait_readback()
         self.controller.pc.arm.set(0).wait()  # the value doesn't seem to matter
-        while (not self.controller.pc.armed.get()):
-            time.sleep(0.1)
+        self.wait_for_signal(self.controller.pc.armed, 1)
+        # PC_TIME is counted from here
+        self.arm_time = self.controller.pc.armed.timestamp
+        self._capture = self._capture_executor.submit(self.capture_line, self.motors[motor.prefix])
             
         print(f"moving {self.flying_motor.name} ...")
         target_pos = self.traj_par['ready_pos'][1 if forward else 0]
         motor.move(target_pos, wait=True)
 
-        self.update_readback()
+        self.update_readback_async(*self.slow_axis_readback())
         print('end of trajectory execution, ', end='')
             
         # reset motor speed
         motor.velocity.set(vel0).wait()
-        
-        if self._traj_status!=None:
-            self._traj_status._finished()
             
-    def readback_traj(self):
-        print("waiting for Zebra PC to disarm ...")
-        while (self.controller.pc.armed.get()):
-            time.sleep(0.1)
+    @staticmethod
+    def wait_for_signal(sig, value, timeout=None):
+        """ wait for a monitor update instead of polling the PV
+        """
+        ev = threading.Event()
+        def cb(value, **kwargs):
+            if value==target:
+                ev.set()
+        target = value
+        cid = sig.subscribe(cb, run=True)
+        try:
+            if not ev.wait(timeout):
+                raise TimeoutError(f"{sig.name} did not reach {value} within {timeout} sec.")
+        finally:
+            sig.unsubscribe(cid)
+
+    def capture_line(self, mn):
+        """ runs while PC is armed, follows PC_NUM_DOWN and reads the captured part of PC_ENCn and PC_TIME,
+            in chunks of capture_chunk during the line and the remainder once PC is disarmed
+            returns the positions and the times relative to arming, in seconds
+        """
+        pc = self.controller.pc
+        unit = {'ms': 1e-3, 's': 1., '10s': 10.}.get(pc.tspre.get(as_string=True), 1e-3)
+        enc_pv = getattr(pc.data, f"enc{mn}").pvname
+        time_pv = pc.data.time.pvname
+        ev = threading.Event()
+        state = {'n': 0, 'armed': True}
+        def cb_num(value, **kwargs):
+            state['n'] = int(value)
+            ev.set()
+        def cb_armed(value, **kwargs):
+            state['armed'] = bool(value)
+            ev.set()
+        cid1 = pc.data.num_down.subscribe(cb_num, run=True)
+        cid2 = pc.armed.subscribe(cb_armed, run=True)
+        
+        # no CA calls in the callbacks, the data are fetched here
+        store = ReadbackStore({'pos': self.traj_par['no_of_segments']+1, 'time': self.traj_par['no_of_segments']+1})
+        n_read = 0
+        try:
+            while True:
+                ev.wait(1)
+                ev.clear()
+                n = state['n']
+                done = not state['armed'] and not pc.data_in_progress.get()
+                if n-n_read>=self.capture_chunk or (done and n>n_read):
+                    # a CA array get returns the first n elements
+                    store.append('pos', epics.caget(enc_pv, count=n)[n_read:n])
+                    store.append('time', epics.caget(time_pv, count=n)[n_read:n]*unit)
+                    n_read = n
+                if (done and n_read>=state['n']) or self.aborted:
+                    break
+        finally:
+            pc.data.num_down.unsubscribe(cid1)
+            pc.armed.unsubscribe(cid2)
+        return store['pos'], store['time']
         
+    def readback_traj(self):
         print('reading back trajectory ...')  
-        data = self.controller.pc.data.read()
-        return data[f'Zebra_pc_data_enc{self.motors[self.flying_motor.prefix]}']['value']
+        pos,self._pc_time = self._capture.result()
+        return pos
+    
+    def readback_timestamps(self):
+        """ hardware time of each capture
+        """
+        return self.arm_time + self._pc_time
@@ -32,19 +32,19 @@ pil and emXext need to be revised to work like a flyer
 def rel_raster(exp_time, fast_axis, f_start, f_end, Nfast, 
                slow_axis=None, s_start=0, s_end=0, Nslow=1, 
                time_per_step=-1, debug=False, md=None, 
-               detectors = [pil, em1ext, em2ext]
+               detectors = [pil, em1ext, em2ext], snake=False
               ):
 
     fm0 = fast_axis.position
     sm0 = slow_axis.position
     yield from raster(exp_time, fast_axis, fm0+f_start, fm0+f_end, Nfast, 
                       slow_axis=slow_axis, s_start=sm0+s_start, s_end=sm0+s_end, Nslow=Nslow, 
-                      time_per_step=time_per_step, debug=debug, md=md, detectors=detectors)
+                      time_per_step=time_per_step, debug=debug, md=md, detectors=detectors, snake=snake)
     
 def raster(exp_time, fast_axis, f_start, f_end, Nfast, 
            slow_axis=None, s_start=0, s_end=0, Nslow=1, 
            time_per_step=-1, debug=False, md=None,
-           detectors = [pil, em1ext, em2ext] 
+           detectors = [pil, em1ext, em2ext], snake=False 
           ):
     """ raster scan in fly mode using detectors with exposure time of exp_time
         detectors must be a member of pilatus_detectors_ext
@@ -56,6 +56,10 @@ def raster(exp_time, fast_axis, f_start, f_end, Nfast,
         use it within the run engine: RE(raster(...))
         update 2020aug: always use the re-defined pilatus detector group
         
+        snake=True: run all lines as a single trajectory with a single kickoff/complete, instead of 
+        moving the slow axis and starting a new trajectory for each line, for now XPStraj only, with 
+        both motors in the same group; the readback is split into lines afterwards
+        
     """
     step_size = np.fabs((f_end-f_start)/(Nfast-1))
     if time_per_step<0:
@@ -67,7 +71,10 @@ def raster(exp_time, fast_axis, f_start, f_end, Nfast,
         raise Exception(f"don't know how to run atrajectory using {fast_axis} ...")
         
     traj = fast_axis.traj
-    traj.setup_traj(fast_axis, f_start, f_end, Nfast, step_size, dt, slow_axis, Nslow)
+    if Nslow==1:
+        snake = False
+    traj.setup_traj(fast_axis, f_start, f_end, Nfast, step_size, dt, slow_axis, Nslow, 
+                    s_start=s_start, s_end=s_end, snake=snake)
     traj.clear_readback()
     
     if debug:
@@ -101,8 +108,9 @@ def raster(exp_time, fast_axis, f_start, f_end, Nfast,
             det._flying = True
         elif isinstance(det, LiXTetrAMMext):
             det.avg_time.put(exp_time)
-            det.npoints.put(Nfast)
-            det.rep = Nslow
+            # in snake mode the whole map goes into the circular buffer, split into lines in inner()
+            det.npoints.put(Nfast*Nslow if snake else Nfast)
+            det.rep = 1 if snake else Nslow
         else:
             raise Exception(f"{det} is not supported in a raster scan ...")
 
@@ -124,9 +132,12 @@ def raster(exp_time, fast_axis, f_start, f_end, Nfast,
         yield from bps.kickoff(traj, wait=False)
         for em in set([em1ext, em2ext])&set(detectors):
             yield from bps.kickoff(em, wait=False)
-        yield from bps.complete(traj, wait=False)
+        # complete() returns right away, the readback of this line then overlaps with the setup of the next
+        yield from bps.complete(traj, wait=True)
+        # the electrometers are read in parallel, wait for both before the next line
         for em in set([em1ext, em2ext])&set(detectors):
-            yield from bps.complete(em, wait=False)
+            yield from bps.complete(em, wait=False, group="em_readback")
+        yield from bps.wait("em_readback")
         print("leaving line()")
 
     @bpp.stage_decorator([traj])
@@ -137,6 +148,14 @@ def raster(exp_time, fast_axis, f_start, f_end, Nfast,
         print("in inner()")
         
         running_forward = traj.traj_par['run_forward_first']
+        if snake:
+            print("starting snake trajectory ...")
+            traj.select_forward_traj(running_forward)
+            yield from line()
+            for em in set([em1ext, em2ext])&set(detectors):
+                em.split_lines(Nslow)
+            pos_s = []
+            
         for sp in pos_s:
             print("start of the loop")
             if slow_axis is not None:
@@ -10,14 +10,18 @@
 
 import socket
 import threading
+import queue
+from contextlib import contextmanager
 
 class XPS:
     # Defines
     MAX_NB_SOCKETS = 100
+    END_OF_API = b',EndOfAPI'
 
     # Global variables
     __sockets = {}
     __usedSockets = {}
+    __locks = {}
     __nbSockets = 0
     debug = False
 
@@ -25,33 +29,40 @@ class XPS:
     def __init__ (self):
         XPS.__nbSockets = 0
         self.errorcodes = {}
-        self.lock = threading.Lock()
         for socketId in range(self.MAX_NB_SOCKETS):
             XPS.__usedSockets[socketId] = 0
 
     def sendAndReceive(self, socketId, command):
-        self.lock.acquire()
-        ret = self.__sendAndReceive(socketId, command)
-        self.lock.release()
-        return ret
+        return self.__sendAndReceive(socketId, command)
         
     # Send command and get return
+    #   each socket has its own lock, so that commands on different sockets do not wait for each other
+    #   the reply is accumulated in a bytearray, only the newly received bytes are searched for EndOfAPI
     def __sendAndReceive (self, socketId, command):
-        try:
-            XPS.__sockets[socketId].send(command.encode())
-            ret = '' 
-            while (ret.find(',EndOfAPI') == -1):
-                ret += XPS.__sockets[socketId].recv(1024).decode()
-        except socket.timeout:
-            print("xps timeout.")
-            return [-2, '']
-        except socket.error as e: # (errNb, errString):
-            print('Socket error: %s ' % e)
-            return [-2, '']
-
+        with XPS.__locks[socketId]:
+            try:
+                sock = XPS.__sockets[socketId]
+                sock.sendall(command.encode())
+                buf = bytearray()
+                idx = -1
+                while idx<0:
+                    data = sock.recv(65536)
+                    if not data:
+                        raise socket.error("connection closed by the controller")
+                    n = len(buf)
+                    buf += data
+                    idx = buf.find(self.END_OF_API, max(0, n-len(self.END_OF_API)+1))
+            except socket.timeout:
+                print("xps timeout.")
+                return [-2, '']
+            except socket.error as e: # (errNb, errString):
+                print('Socket error: %s ' % e)
+                return [-2, '']
+
+        ret = buf[:idx].decode()
         if self.debug:
             print(command, ret)
-        retlist = ret.strip(',EndOfAPI').split(',', 1)
+        retlist = ret.split(',', 1)
         if retlist[0]!='0':
             print(f"returned value for {command}: ", retlist)
         if len(retlist)==1:
@@ -71,6 +82,7 @@ class XPS:
 
         XPS.__usedSockets[socketId] = 1
         XPS.__nbSockets += 1
+        XPS.__locks[socketId] = threading.Lock()
         try:
             XPS.__sockets[socketId] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             XPS.__sockets[socketId].connect((IP, port))
@@ -4197,3 +4209,44 @@ class XPS:
         return [error, returnedString]
 
 
+
+
+class XPSSocketPool:
+    """ a set of sockets to the same controller, each command checks out a socket that is not in use
+        the XPS executes commands received on different sockets concurrently, e.g. a blocking
+        GroupMoveAbsolute on one socket does not hold up commands sent on another
+    """
+    def __init__ (self, xps, IP, nSockets=4, timeOut=0.050, port=5001):
+        self.xps = xps
+        self.sockets = []
+        self.__free = queue.Queue()
+        for i in range(nSockets):
+            socketId = xps.TCP_ConnectToServer(IP, port, timeOut)
+            if socketId<0:
+                raise Exception(f"unable to open socket #{i} to the XPS at {IP}:{port}")
+            self.sockets.append(socketId)
+            self.__free.put(socketId)
+
+    @contextmanager
+    def socket(self, timeout=None):
+        """ check out a socket for the duration of the with block
+        """
+        try:
+            socketId = self.__free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no XPS socket available")
+        try:
+            yield socketId
+        finally:
+            self.__free.put(socketId)
+
+    def call(self, func, *args):
+        """ e.g. pool.call(xps.GroupMoveAbsolute, "Group1.Pos", [1.0])
+        """
+        with self.socket() as socketId:
+            return func(socketId, *args)
+
+    def close(self):
+        for socketId in self.sockets:
+            self.xps.TCP_CloseSocket(socketId)
+        self.sockets = []
@@ -195,7 +195,7 @@ def collect_large_map(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1,
 
 
 def collect_map(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1, fast_axis="y",
-                exp_time=0.2, check_beam=True, use_XSP3=False, md=None):
+                exp_time=0.2, check_beam=True, use_XSP3=False, md=None, metadata_max_age=0):
 
     if not fast_axis in ['x', 'y']:
         raise Exception(f"unknown fast axis: {fast_axis}")
@@ -223,7 +223,7 @@ def collect_map(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1, fast_ax
     else:
         detectors = [pil,em1ext,em2ext]
 
-    update_metadata()
+    update_metadata(metadata_max_age)
     pil.use_sub_directory(sname)    
     change_sample(f"{sname}", exception=False)
     ss.x.move(x1)
@@ -259,6 +259,8 @@ def collect_projections(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1,
                         fast_axis='x', phi_list=[0., 45., 90.],
                         exp_time=0.2, check_beam=True, use_XSP3=False, md=None):
     
+    # only ss.ry changes between the maps, read the beamline state once for all of them
+    update_metadata()
     for phi in phi_list:   
         sn = f"{sname}-phi{phi:.1f}"
         ss.ry.move(phi)    
@@ -266,7 +268,8 @@ def collect_projections(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1,
         
         collect_map(sn, x1, x2, y1, y2, step_size_x=step_size_x, step_size_y=step_size_y, 
                     fast_axis=fast_axis,
-                    exp_time=exp_time, check_beam=check_beam, use_XSP3=use_XSP3, md=md)   
+                    exp_time=exp_time, check_beam=check_beam, use_XSP3=use_XSP3, md=md,
+                    metadata_max_age=np.inf)   
 
     
 def collect_projections0(sname, x1, x2, y1, y2, step_size_x=0.1, step_size_y=0.1, 
@@ -661,7 +661,7 @@ def mc_pack_h5(spreadSheet, holderName, run_id, T=None,
         holderName += ('_T%.1fC' % T)
 
     uids = list_scans(run_id=run_id, holderName=holderName, **kwargs)
-    send_to_packing_queue('|'.join(uids), "multi", froot)    
+    send_to_packing_queue('|'.join(uids), "multi", froot=froot)    
 
 def mc_measure_sample(pos, sname='test', exp=0.5, rep=1, check_sname=True, cell_form=None):
     set_exp_time(dets=[pil,em1ext,em2ext],exp=exp)
@@ -48,8 +48,8 @@ lix_report = fast_shutter_decorator()(record_pos_and_det)
 
 def generate_report(pdf_file="report.pdf"):
     RE(lix_report(motor_list,detector_list,md={'record':'cycle_2026_1'}))
-    uids = list_scans(plan_name="record_pos_and_det")
-    uida = uids[-10:]
+    doc_dispatcher.wait(5)   # make sure the run just taken is in run_catalog
+    uida = list_scans(plan_name="record_pos_and_det", limit=10)[::-1]
     ht = []
     dt = []
     for i in uida:
@@ -57,11 +57,11 @@ def generate_report(pdf_file="report.pdf"):
         ht.append(h)
         dt.append(d)
     print("data_extracted")
-    header = list(dt[0].columns)
+    header = dt[0].keys()
     data_rows = []
     for i in range(10):
         block = dt[i]
-        row = [block[col].iloc[1] if len(block[col]) > 1 else block[col].iloc[0] for col in header]
+        row = [block[col][1] if len(block[col]) > 1 else block[col][0] for col in header]
         data_rows.append(row)
     
     doc = SimpleDocTemplate(pdf_file,
@@ -97,7 +97,7 @@ def generate_report(pdf_file="report.pdf"):
     bpm_vals = []
     for i in range(10):
         block = dt[i]
-        val = block['bpm_int_mean'].iloc[1] if len(block['bpm_int_mean']) > 1 else block['bpm_int_mean'].iloc[0]
+        val = block['bpm_int_mean'][1] if len(block['bpm_int_mean']) > 1 else block['bpm_int_mean'][0]
         bpm_vals.append(val)
     
     plt.figure(figsize=(10,4))
@@ -1,15 +1,20 @@
 print(f"Loading {__file__}...")
 import json
 
-from collections import OrderedDict
 import redis
+from startup.utils.doc_dispatcher import DocumentDispatcher, ScanInfoWriter
+
+# side effects of the documents that should not hold up the RunEngine
+# the time each callback takes is in doc_dispatcher.stats, or doc_dispatcher.report()
+doc_dispatcher = DocumentDispatcher()
+doc_dispatcher.subscribe(ScanInfoWriter(redis.Redis(host=redis_host, port=redis_port, db=0)), 'start')
+if run_catalog is not None:
+    doc_dispatcher.subscribe(run_catalog)
 
 def print_scanid(name, doc):
     global last_scan_uid
     global last_scan_id
 
-    header_attrs = ['proc_path', 'sample_name', 'plan_name']
-    
     if name == 'start':
         last_scan_uid = doc['uid']
         last_scan_id = doc['scan_id']  
@@ -21,22 +26,10 @@ def print_scanid(name, doc):
                     #"sample_name": current_sample
                    }
         #pil.update_header(json.dumps(hdr_dict))
+        # this put does not wait for completion, but should go out before the detectors are triggered
         pil.update_header(f"uid={doc['uid']}")
         
-        # also update header info in Redis
-        with redis.Redis(host=redis_host, port=redis_port, db=0) as r:
-            hdrs = r.get('scan_info')
-            if hdrs==None: # no info stored yet
-                hdrs = OrderedDict({})
-            else:
-                hdrs = json.loads(hdrs, object_pairs_hook=OrderedDict)
-                
-            h = db[-1].start
-            hdrs[h['uid']] = {k: h[k] for k in header_attrs}
-            uids = list(hdrs.keys())
-            if len(uids)>3: # keep up to 3 scans
-                hdrs.popitem(last=False)
-            r.set("scan_info", json.dumps(hdrs))
+        # header info in Redis is updated by doc_dispatcher
        
 def print_scanid_stop(name, doc):
     global last_scan_uid
@@ -50,6 +43,7 @@ def print_md(name, doc):
         print('Metadata:\n', repr(doc))
 
 RE.subscribe(print_scanid, 'start')
+RE.subscribe(doc_dispatcher)
 RE.subscribe(print_scanid_stop, 'stop')
 
 # For debug purpose to see the metadata being stored
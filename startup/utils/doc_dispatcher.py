@@ -0,0 +1,146 @@
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class DocumentDispatcher:
+    """Runs side effects of RunEngine documents on a background thread.
+
+    Subscribe the dispatcher itself to the RunEngine, RE.subscribe(dispatcher). A document is
+    only queued if a callback wants it, so the RunEngine thread never waits for the callbacks.
+    The worker takes everything that is waiting at once, passes the documents to the callbacks
+    in order, then calls flush() on the callbacks that have one, e.g. to batch database writes.
+
+    Latency counters for each callback are kept in self.stats: the number of documents, the time
+    spent in the callback, and the delay from the RunEngine handing over the document to the
+    callback having processed it.
+    """
+    def __init__(self, max_queued=1000):
+        self.subscribers = []
+        self.stats = {}
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def subscribe(self, func, name="all", label=None):
+        """ func(name, doc) is called for the documents of type name ("start", "stop", ...) or all of them
+            label identifies func in self.stats, the default is the function/class name
+        """
+        if label is None:
+            label = getattr(func, "__name__", type(func).__name__)
+        with self._lock:
+            self.subscribers.append((func, name, label))
+            self.stats[label] = {"count": 0, "errors": 0, "run_time": 0., "max_run_time": 0.,
+                                 "latency": 0., "max_latency": 0.}
+        return label
+
+    def unsubscribe(self, label):
+        with self._lock:
+            self.subscribers = [s for s in self.subscribers if s[2]!=label]
+
+    def __call__(self, name, doc):
+        with self._lock:
+            subs = [s for s in self.subscribers if s[1] in ["all", name]]
+        if len(subs)==0:
+            return
+        try:
+            self._queue.put_nowait((time.time(), name, doc, subs))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            flush = {}
+            for t0, name, doc, subs in batch:
+                for func, _, label in subs:
+                    self._call(label, t0, func, name, doc)
+                    if hasattr(func, "flush"):
+                        flush.setdefault(label, (func.flush, t0))
+            for label, (func, t0) in flush.items():
+                self._call(label, t0, func)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _call(self, label, t0, func, *args):
+        ts = time.time()
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"{label} failed: {e}")
+            self.stats[label]["errors"] += 1
+        te = time.time()
+        st = self.stats[label]
+        if len(args)>0:
+            st["count"] += 1
+        st["run_time"] += te-ts
+        st["max_run_time"] = max(st["max_run_time"], te-ts)
+        st["latency"] = te-t0
+        st["max_latency"] = max(st["max_latency"], te-t0)
+
+    def wait(self, timeout=None):
+        """ wait for the documents queued so far to be processed, returns False on timeout
+        """
+        t0 = time.time()
+        while self._queue.unfinished_tasks>0:
+            if timeout is not None and time.time()-t0>timeout:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def report(self):
+        for label, st in self.stats.items():
+            n = max(st["count"], 1)
+            print(f"{label}: {st['count']} docs, {st['errors']} errors, "
+                  f"run time {st['run_time']/n*1000:.1f} ms/doc (max {st['max_run_time']*1000:.1f} ms), "
+                  f"latency {st['latency']*1000:.1f} ms (max {st['max_latency']*1000:.1f} ms)")
+        if self.dropped>0:
+            print(f"{self.dropped} documents dropped, the queue was full")
+
+
+class ScanInfoWriter:
+    """Keeps the header info of the most recent scans in the Redis key "scan_info".
+
+    The start documents are collected by __call__() and written by flush(), with one read and
+    one write per batch, using the same Redis client (and its connection pool) every time.
+    """
+    header_attrs = ['proc_path', 'sample_name', 'plan_name']
+
+    def __init__(self, client, key="scan_info", max_scans=3):
+        self.client = client
+        self.key = key
+        self.max_scans = max_scans
+        self.pending = []
+
+    def __call__(self, name, doc):
+        if name == 'start':
+            self.pending.append(doc)
+
+    def flush(self):
+        if len(self.pending)==0:
+            return
+        docs, self.pending = self.pending, []
+        try:
+            hdrs = self.client.get(self.key)
+            if hdrs is None: # no info stored yet
+                hdrs = OrderedDict({})
+            else:
+                hdrs = json.loads(hdrs, object_pairs_hook=OrderedDict)
+            for doc in docs:
+                hdrs[doc['uid']] = {k: doc.get(k) for k in self.header_attrs}
+            while len(hdrs)>self.max_scans: # keep up to max_scans scans
+                hdrs.popitem(last=False)
+            self.client.set(self.key, json.dumps(hdrs))
+        except:
+            # try again with the next batch
+            self.pending = docs + self.pending
+            raise
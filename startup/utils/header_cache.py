@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedHeader:
+    """Wraps a databroker Header and reads each document stream from the backend only once.
+
+    start/stop/descriptors/fields() are fetched on first access; except for start, they are only
+    kept once the run has finished, as more may be added while it is running. The events are
+    never kept, event_pages() streams them from the backend one page at a time; a walk through all
+    streams (stream_name=None) keeps the resource documents on the way, otherwise the first call
+    to resources() walks header.documents() for them. Anything else, e.g. events() or table(),
+    is passed on to the underlying header.
+    """
+    def __init__(self, header):
+        self._header = header
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        return getattr(self._header, name)
+
+    # dict(header) is used to save the header as attributes in hdf5_export
+    def keys(self):
+        return self._header.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        if key in ["start", "stop", "descriptors"]:
+            return getattr(self, key)
+        return self._header[key]
+
+    def _get(self, key, func):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = func()
+            return self._cache[key]
+
+    def _get_final(self, key, func):
+        # a run still in progress is read again next time
+        if self.stop is None:
+            return func()
+        return self._get(key, func)
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def start(self):
+        return self._get("start", lambda: self._header.start)
+
+    @property
+    def uid(self):
+        return self.start['uid']
+
+    @property
+    def stop(self):
+        # the stop document is only cached once the run has finished
+        with self._lock:
+            if self._cache.get("stop") is None:
+                stop = self._header.stop
+                if stop is None or 'exit_status' not in stop.keys():
+                    return stop
+                self._cache["stop"] = stop
+            return self._cache["stop"]
+
+    @property
+    def descriptors(self):
+        return self._get_final("descriptors", lambda: self._header.descriptors)
+
+    def fields(self, stream_name=None):
+        return self._get_final(("fields", stream_name), lambda: self._header.fields(stream_name))
+
+    def _read_resources(self):
+        return {doc['uid']: doc for name, doc in self._header.documents(fill=False) if name == "resource"}
+
+    def resources(self):
+        """ resource documents, keyed by uid """
+        return self._get_final("resources", self._read_resources)
+
+    def event_pages(self, stream_name='primary'):
+        """ the unfilled events of the stream, or of all streams if stream_name is None, as they come 
+            from the backend: event pages are passed on as they are, nothing is kept in memory
+        """
+        if stream_name is None:
+            descs = None
+            docs = self._header.documents(fill=False)
+        else:
+            descs = [desc['uid'] for desc in self.descriptors if desc.get('name', 'primary') == stream_name]
+            docs = self._header.documents(stream_name=stream_name, fill=False)
+        resources = {}
+        for name, doc in docs:
+            if name == "resource":
+                resources[doc['uid']] = doc
+            elif name in ["event", "event_page"] and (descs is None or doc['descriptor'] in descs):
+                yield doc
+        # all the documents have been seen, resources() does not have to read them again
+        if stream_name is None and self.stop is not None:
+            with self._lock:
+                self._cache.setdefault("resources", resources)
+
+
+class HeaderCache:
+    """LRU cache of CachedHeader, keyed by uid.
+
+    Entries are dropped when more than maxsize headers are cached, or once they are
+    older than ttl seconds.
+    """
+    def __init__(self, db, maxsize=32, ttl=600.):
+        self.db = db
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, uid):
+        """ uid, or anything else db[] accepts, e.g. -1, or a Header already at hand, e.g. from db(...)
+        """
+        header = None
+        if not isinstance(uid, str):  # resolve the uid first, and keep the header for a new entry
+            header = self.db[uid] if isinstance(uid, int) else uid
+            uid = header.start['uid']
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if uid in self._entries:
+                self._entries.move_to_end(uid)
+                return self._entries[uid][1]
+        header = CachedHeader(self.db[uid] if header is None else header)
+        with self._lock:
+            if uid in self._entries:  # another thread got here first
+                return self._entries[uid][1]
+            self._entries[uid] = (now, header)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return header
+
+    def _expire(self, now):
+        for uid in [k for k, (t, h) in self._entries.items() if now-t > self.ttl]:
+            del self._entries[uid]
+
+    def __contains__(self, uid):
+        with self._lock:
+            self._expire(time.time())
+            return uid in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, uid=None):
+        with self._lock:
+            if uid is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(uid, None)
@@ -0,0 +1,235 @@
+import json
+import threading
+from collections import defaultdict
+from collections.abc import MutableMapping
+
+
+def _wrap(value, store, key):
+    """ nested dicts/lists are replaced by versions that tell the store when they are modified
+    """
+    if isinstance(value, dict) and not isinstance(value, ObservedDict):
+        return ObservedDict(value, store, key)
+    if isinstance(value, list) and not isinstance(value, ObservedList):
+        return ObservedList(value, store, key)
+    return value
+
+
+def _mutator(base, name):
+    func = getattr(base, name)
+    def method(self, *args, **kwargs):
+        ret = func(self, *args, **kwargs)
+        self._changed()
+        return ret
+    method.__name__ = name
+    return method
+
+
+class ObservedDict(dict):
+    """A dict under one of the top-level keys of CachedRedisDict, any change marks that key as modified.
+
+    Copies (copy, deepcopy, pickle) are plain dicts, not connected to the store.
+    """
+    def __init__(self, data=(), store=None, key=None):
+        self._store = store
+        self._key = key
+        super().__init__()
+        dict.update(self, {k: _wrap(v, store, key) for k, v in dict(data).items()})
+
+    def _changed(self):
+        for k, v in dict.items(self):
+            dict.__setitem__(self, k, _wrap(v, self._store, self._key))
+        if self._store is not None:
+            self._store._mark(self._key)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class ObservedList(list):
+    """Same as ObservedDict, for lists."""
+    def __init__(self, data=(), store=None, key=None):
+        self._store = store
+        self._key = key
+        super().__init__(_wrap(v, store, key) for v in data)
+
+    def _changed(self):
+        for i, v in enumerate(list.__iter__(self)):
+            list.__setitem__(self, i, _wrap(v, self._store, self._key))
+        if self._store is not None:
+            self._store._mark(self._key)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+for name in ['__setitem__', '__delitem__', 'update', 'pop', 'popitem', 'clear', 'setdefault', '__ior__']:
+    setattr(ObservedDict, name, _mutator(dict, name))
+for name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert',
+             'pop', 'remove', 'clear', 'sort', 'reverse']:
+    setattr(ObservedList, name, _mutator(list, name))
+
+
+class CachedRedisDict(MutableMapping):
+    """Dict-like view of JSON values in Redis, one key per top-level item, same layout as RedisJSONDict.
+
+    All reads are served from a local copy, loaded once. Writes, including changes to nested
+    dicts/lists (md['pilatus']['num_images'] = ...), update the local copy right away and are
+    sent to Redis together by flush(): after flush_delay, or when flush() is called, e.g. by the
+    RunEngine at the start of each plan.
+
+    Changes made by other clients are picked up through keyspace notifications, if they are
+    enabled on the Redis server (notify-keyspace-events should include K, $ and g). Otherwise
+    call reload() to catch up. notify=None checks the server configuration first, True subscribes
+    to the notifications regardless, e.g. if the CONFIG command is not available.
+    """
+    def __init__(self, client, prefix="", flush_delay=0.5, notify=None):
+        self._client = client
+        self._prefix = prefix
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._cache = {}
+        self._dirty = set()
+        self._deleted = set()
+        self._own_writes = defaultdict(int)
+        self._timer = None
+        self._pubsub = None
+        self.notifications = False
+        self.reload()
+        if notify is None:
+            notify = self._notifications_enabled()
+        if notify:
+            self._subscribe()
+        else:
+            print("Redis keyspace notifications are not enabled, call reload() to pick up changes by other clients.")
+
+    def _notifications_enabled(self):
+        try:
+            cfg = self._client.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+        except Exception as e:
+            print(f"unable to check the Redis configuration: {e}")
+            return False
+        return 'K' in cfg and ('A' in cfg or ('$' in cfg and 'g' in cfg))
+
+    def _subscribe(self):
+        db = self._client.connection_pool.connection_kwargs.get('db', 0)
+        self._channel = f"__keyspace@{db}__:"
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{f"{self._channel}{self._prefix}*": self._on_notification})
+        self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+        self.notifications = True
+
+    def _on_notification(self, msg):
+        rkey = msg['channel']
+        if isinstance(rkey, bytes):
+            rkey = rkey.decode()
+        key = rkey[len(self._channel)+len(self._prefix):]
+        with self._lock:
+            if self._own_writes[key]>0:
+                self._own_writes[key] -= 1
+                return
+            if key in self._dirty or key in self._deleted:
+                return   # about to be overwritten by the local change
+        # not under the lock, so that the session does not wait for this round trip
+        value = self._client.get(rkey[len(self._channel):])
+        with self._lock:
+            if key in self._dirty or key in self._deleted or self._own_writes[key]>0:
+                return   # changed locally in the meantime, the local value is newer
+            if value is None:
+                self._cache.pop(key, None)
+            else:
+                self._cache[key] = _wrap(json.loads(value), self, key)
+
+    def reload(self):
+        """ re-read everything from Redis, local changes that have not been flushed yet are kept
+        """
+        rkeys = list(self._client.scan_iter(match=f"{self._prefix}*"))
+        values = self._client.mget(rkeys) if len(rkeys)>0 else []
+        with self._lock:
+            cache = {}
+            for rkey, value in zip(rkeys, values):
+                if value is None:
+                    continue
+                if isinstance(rkey, bytes):
+                    rkey = rkey.decode()
+                key = rkey[len(self._prefix):]
+                cache[key] = _wrap(json.loads(value), self, key)
+            for key in self._dirty:
+                cache[key] = self._cache[key]
+            for key in self._deleted:
+                cache.pop(key, None)
+            self._cache = cache
+
+    def _mark(self, key):
+        with self._lock:
+            self._dirty.add(key)
+            self._deleted.discard(key)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # the changes made within flush_delay of the first one go out together
+        if self._timer is None and self.flush_delay is not None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """ send all local changes to Redis, in one round trip
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if len(self._dirty)==0 and len(self._deleted)==0:
+                return
+            pipe = self._client.pipeline(transaction=False)
+            for key in self._dirty:
+                pipe.set(self._prefix+key, json.dumps(self._cache[key]))
+            for key in self._deleted:
+                pipe.delete(self._prefix+key)
+            if self.notifications:
+                # do not reload what we have just written when the notification comes back
+                for key in self._dirty:
+                    self._own_writes[key] += 1
+            dirty, deleted = self._dirty, self._deleted
+            self._dirty, self._deleted = set(), set()
+            try:
+                pipe.execute()
+            except:
+                self._dirty |= dirty
+                self._deleted |= deleted
+                for key in dirty:
+                    self._own_writes[key] = 0
+                raise
+
+    def close(self):
+        self.flush()
+        if self._pubsub is not None:
+            self._pubsub_thread.stop()
+            self._pubsub.close()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._cache[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._cache[key] = _wrap(value, self, key)
+            self._mark(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._cache[key]
+            self._dirty.discard(key)
+            self._deleted.add(key)
+            self._schedule_flush()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._cache))
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        with self._lock:
+            return f"<{self.__class__.__name__} {dict(self._cache)!r}>"
@@ -0,0 +1,65 @@
+import os
+import re
+import time
+
+# the namespace of the startup files loaded into the worker process, see init_export_worker()
+_profile = None
+
+
+def init_export_worker(db, profile_files):
+    """ runs once in each worker process of hdf5_export_parallel()
+
+        the workers are spawned rather than forked, so that they do not inherit the threads and locks
+        of the bsui session (CA, RunEngine, packing server ...); hdf5_export and what it depends on
+        are loaded from the startup files instead, the same way IPython runs them
+
+        db is the name of the databroker catalog, or the databroker object itself if it can be pickled
+    """
+    global _profile
+    if isinstance(db, str):
+        from databroker import Broker
+        db = Broker.named(db)
+    ns = {"__name__": "lix_pack_worker", "db": db, "os": os, "re": re, "time": time}
+    for path in profile_files:
+        ns["__file__"] = path
+        with open(path) as fh:
+            exec(compile(fh.read(), path, "exec"), ns)
+    _profile = ns
+
+
+def export_header(uid, fn, kwargs):
+    """ export a single header into fn, in a process set up by init_export_worker()
+    """
+    _profile["hdf5_export"]([_profile["header_cache"][uid]], fn, **kwargs)
+    return fn
+
+
+def process_stage(data_type, fn, dest_dir, sb_dict=None):
+    """ the processing part of pack_and_process(), only if the dest_dir contains exp.h5
+        returns the time spent
+    """
+    from py4xs.hdf import h5xs,h5exp
+    from lixtools.hdf import h5sol_HT
+
+    t0 = time.time()
+    # if the dest_dir contains exp.h5, read detectors/qgrid from it
+    try:
+        dt_exp = h5exp(dest_dir+'/exp.h5')
+    except:
+        return 0
+
+    print(f'processing {fn} ...')
+    if data_type=="sol":
+        dt = h5sol_HT(fn, [dt_exp.detectors, dt_exp.qgrid])
+        dt.assign_buffer(sb_dict)
+        #dt.process(filter_data=True, sc_factor="auto", debug='quiet')
+        #dt.export_d1s(path=dest_dir+"/processed/")
+    elif data_type=="multi":
+        dt = h5xs(fn, [dt_exp.detectors, dt_exp.qgrid], transField='em2_sum_all_mean_value')
+        dt.load_data(debug="quiet")
+    elif data_type=="mfscan":
+        dt = h5xs(fn, [dt_exp.detectors, dt_exp.qgrid])
+        dt.load_data(debug="quiet")
+    dt.fh5.close()
+    del dt,dt_exp
+    return time.time()-t0
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PackingJournal:
+    """Append-only record of packing job state, one JSON object per line.
+
+    Every state change is flushed to disk before it is acknowledged, so jobs that were
+    queued or running when the server went down can be picked up again on restart.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.n_records = 0
+
+    def record(self, job):
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(job) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.n_records += 1
+
+    def replay(self):
+        """Return the latest state of each job."""
+        jobs = {}
+        if not os.path.exists(self.path):
+            return jobs
+        with open(self.path) as fh:
+            for line in fh:
+                try:
+                    job = json.loads(line)
+                except json.JSONDecodeError:  # partial line from an interrupted write
+                    continue
+                jobs[job["id"]] = job
+        return jobs
+
+    def compact(self, jobs):
+        """Rewrite the journal with only the latest state of jobs."""
+        tfn = self.path + "_partial"
+        with open(tfn, "w") as fh:
+            for job in jobs.values():
+                fh.write(json.dumps(job) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tfn, self.path)
+        self.n_records = len(jobs)
+
+
+class PackingQueueServer:
+    """asyncio TCP server that queues packing requests and runs them on a bounded worker pool.
+
+    Protocol, one message per connection, terminated by newline or EOF:
+        "status::<job_id>"   -> JSON with the job record
+        "<job message>"      -> "<job_id>" once the job is journaled, or "rejected::<reason>"
+    The reply is optional, clients that close the connection after sending are fine.
+    Once max_queued jobs are waiting, new ones are rejected ("rejected::queue full") rather than
+    held in the server; the client can send them again later. A message identical to a job that is
+    still queued or running is not queued again, the reply is the id of the existing job.
+
+    The journal is written (and fsync'ed) on a separate thread, one record at a time in order, so
+    that the event loop keeps serving other clients in the meantime.
+
+    Finished jobs are kept for status queries, up to max_finished of them; the journal is compacted
+    as older ones are dropped.
+
+    handler(msg) does the work, it should raise on failure so that the job is retried.
+    validator(msg), if given, is called before the job is accepted and should raise to reject it.
+    """
+    def __init__(self, handler, host, port, journal_path, validator=None,
+                 max_workers=3, max_queued=100, max_retries=2, retry_delay=10., max_finished=1000):
+        self.handler = handler
+        self.validator = validator
+        self.host = host
+        self.port = port
+        self.journal = PackingJournal(journal_path)
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.started = threading.Event()
+        self._loop = None
+        self._stop_event = None
+
+    async def _record(self, job):
+        await self._loop.run_in_executor(self._journal_executor, self.journal.record, dict(job))
+
+    async def _update(self, job, **kwargs):
+        job.update(kwargs)
+        await self._record(job)
+        if job["status"] in ["done", "failed"]:
+            self._prune()
+            # compact once the journal has grown to twice the number of jobs that are kept
+            if self.journal.n_records > 2*len(self.jobs) + 100:
+                jobs = {k: dict(job) for k,job in self.jobs.items()}
+                await self._loop.run_in_executor(self._journal_executor, self.journal.compact, jobs)
+
+    def n_queued(self):
+        return len([job for job in self.jobs.values() if job["status"]=="queued"])
+
+    def _prune(self):
+        """ drop the oldest finished jobs beyond max_finished
+        """
+        finished = [job for job in self.jobs.values() if job["status"] in ["done", "failed"]]
+        if len(finished) > self.max_finished:
+            finished.sort(key=lambda job: job.get("finished", job["submitted"]))
+            for job in finished[:len(finished)-self.max_finished]:
+                del self.jobs[job["id"]]
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        # not bounded, the number of queued jobs is limited in submit()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._journal_executor = ThreadPoolExecutor(max_workers=1)
+
+        # re-queue whatever was left over from the previous run
+        self.jobs = self.journal.replay()
+        self._prune()
+        self.journal.compact(self.jobs)
+        pending = [job for job in self.jobs.values() if job["status"] in ["queued", "running"]]
+        pending.sort(key=lambda job: job["submitted"])
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        for job in pending:
+            print(f"{time.asctime()}: resuming job {job['id']}: {job['msg']}")
+            await self._update(job, status="queued")
+            self._queue.put_nowait(job["id"])
+
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"listening on {self.host}:{self.port} ...")
+        self.started.set()
+        async with server:
+            await self._stop_event.wait()
+        for w in workers:
+            w.cancel()
+        self._executor.shutdown(wait=False)
+        self._journal_executor.shutdown(wait=True)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            data = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            data = e.partial
+        except asyncio.LimitOverrunError:
+            data = await reader.read()
+        msg = data.decode().strip()
+        addr = writer.get_extra_info("peername")
+        print(f"{time.asctime()}: got a message from {addr}: {msg}")
+
+        job = None
+        if msg.startswith("status::"):
+            job_id = msg.split("::", 1)[1]
+            reply = json.dumps(self.jobs.get(job_id, {"id": job_id, "status": "unknown"}))
+        else:
+            reply, job = await self.submit(msg)
+
+        try:
+            writer.write((reply + "\n").encode())
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        if job is not None:
+            self._queue.put_nowait(job["id"])
+
+    async def submit(self, msg):
+        """ returns the reply to the client, and the new job to be queued, if any
+        """
+        if self.validator is not None:
+            try:
+                await self._loop.run_in_executor(None, self.validator, msg)
+            except Exception as e:
+                print(f"rejected {msg}: {e}")
+                return f"rejected::{e}", None
+        for job in self.jobs.values():
+            if job["msg"] == msg and job["status"] in ["queued", "running"]:
+                print(f"{msg} is already in the queue as job {job['id']}")
+                return job["id"], None
+        if self.n_queued() >= self.max_queued:
+            print(f"rejected {msg}: {self.max_queued} jobs are already waiting")
+            return "rejected::queue full", None
+        job = {"id": uuid.uuid4().hex, "msg": msg, "status": "queued",
+               "attempts": 0, "submitted": time.time(), "error": None}
+        self.jobs[job["id"]] = job
+        await self._record(job)
+        return job["id"], job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            await self._update(job, status="running", attempts=job["attempts"]+1, started=time.time())
+            try:
+                await self._loop.run_in_executor(self._executor, self.handler, job["msg"])
+            except Exception as e:
+                print(f"{time.asctime()}: job {job_id} failed (attempt {job['attempts']}): {e}")
+                if job["attempts"] <= self.max_retries:
+                    await self._update(job, status="queued", error=str(e))
+                    self._loop.call_later(self.retry_delay, self._requeue, job_id)
+                else:
+                    await self._update(job, status="failed", error=str(e), finished=time.time())
+            else:
+                await self._update(job, status="done", finished=time.time())
+            finally:
+                self._queue.task_done()
+
+    def _requeue(self, job_id):
+        self._queue.put_nowait(job_id)
+
+
+def send_packing_msg(host, port, msg, timeout=30.):
+    """Send one message to a PackingQueueServer and return its reply."""
+    with socket.create_connection((host, port), timeout=timeout) as s:
+        s.sendall((msg + "\n").encode())
+        s.shutdown(socket.SHUT_WR)
+        reply = b""
+        while True:
+            buf = s.recv(8192)
+            if not buf:
+                break
+            reply += buf
+    return reply.decode().strip()
+
+
+def query_packing_job(host, port, job_id, timeout=30.):
+    return json.loads(send_packing_msg(host, port, f"status::{job_id}", timeout=timeout))
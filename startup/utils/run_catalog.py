@@ -0,0 +1,158 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+def to_timestamp(t):
+    """ accepts a timestamp, or a date string such as "2025-03-01" or "2025-03-01 12:00:00"
+    """
+    if t is None or isinstance(t, (int, float)):
+        return t
+    for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            return time.mktime(time.strptime(t, fmt))
+        except ValueError:
+            pass
+    raise ValueError(f"cannot convert {t} to a timestamp")
+
+
+class RunCatalog:
+    """Index of the runs in a local SQLite file, for searching without going through databroker.
+
+    Feed it the RunEngine documents, e.g. doc_dispatcher.subscribe(run_catalog). Each start document
+    adds a row with the commonly searched fields, plus the whole document as JSON, so that other
+    metadata can be matched as well; the stop document adds the exit status. Rows are written by
+    __call__() and committed by flush(), once per batch of documents.
+
+    Runs taken before the catalog was set up can be added with backfill(). Only plain values can be
+    matched, use covers() to tell whether a search can be done here or has to go to databroker.
+
+    The default WAL journal is faster, but needs all clients on the same host; for a file on a
+    network file system, shared by several machines, use journal_mode="DELETE".
+    """
+    columns = ["uid", "scan_id", "plan_name", "sample_name", "proposal_id", "run_id", "time", "num_points"]
+
+    def __init__(self, path, journal_mode="WAL"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(f"PRAGMA journal_mode={journal_mode}")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS runs (uid TEXT PRIMARY KEY, scan_id INTEGER, "
+                               "plan_name TEXT, sample_name TEXT, proposal_id TEXT, run_id TEXT, time REAL, "
+                               "num_points INTEGER, exit_status TEXT, start TEXT)")
+            for col in ["time", "scan_id", "plan_name", "sample_name", "run_id"]:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS runs_{col} ON runs ({col})")
+
+    def __call__(self, name, doc):
+        with self._lock:
+            if name == "start":
+                self._conn.execute(f"INSERT OR REPLACE INTO runs ({','.join(self.columns)}, start) "
+                                   f"VALUES ({','.join(['?']*(len(self.columns)+1))})",
+                                   [doc.get(k) for k in self.columns] + [json.dumps(doc, default=str)])
+            elif name == "stop":
+                self._conn.execute("UPDATE runs SET exit_status=? WHERE uid=?",
+                                   (doc.get("exit_status"), doc["run_start"]))
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+
+    def backfill(self, headers):
+        """ add runs from databroker, e.g. run_catalog.backfill(db(since="2025-01-01"))
+        """
+        n = 0
+        for h in headers:
+            self("start", h.start)
+            if h.stop is not None:
+                self("stop", h.stop)
+            n += 1
+        self.flush()
+        return n
+
+    @staticmethod
+    def plain(value):
+        """ whether value can be matched by query(), unlike e.g. the Mongo operators {"$gt": ...}
+        """
+        return value is None or isinstance(value, (str, int, float, bool))
+
+    def oldest(self):
+        """ time of the earliest run in the catalog, None if it is empty
+        """
+        with self._lock:
+            return self._conn.execute("SELECT MIN(time) FROM runs").fetchone()[0]
+
+    def newest(self):
+        """ time of the latest run in the catalog, None if it is empty
+        """
+        with self._lock:
+            return self._conn.execute("SELECT MAX(time) FROM runs").fetchone()[0]
+
+    def covers(self, since=None, until=None, limit=None, offset=0, latest=None, **kwargs):
+        """ whether query(since, until, limit, offset, **kwargs) finds the same runs as 
+            databroker would, assuming that no run is missing after the first one here:
+            the values must all be plain, and either the time range does not start before the first run, 
+            or, without since, there are at least offset+limit matching runs here
+            latest: time of the most recent run in databroker, the catalog must have caught up with it
+        """
+        if not all(self.plain(v) for v in kwargs.values()):
+            return False
+        oldest = self.oldest()
+        if oldest is None:
+            return False
+        if latest is not None and self.newest()<latest:
+            return False
+        if since is not None:
+            return to_timestamp(since)>=oldest
+        if limit is None:
+            return False
+        return len(self.query(until=until, limit=1, offset=offset+limit-1, **kwargs))>0
+
+    def query(self, since=None, until=None, limit=None, offset=0, ascending=False, **kwargs):
+        """ returns the matching runs as dicts, most recent first unless ascending=True
+            kwargs are matched exactly, against the indexed columns or otherwise the start document,
+            None matches missing values; ValueError for anything but plain values (see plain())
+            since/until limit the time range, limit/offset give one page of the results at a time
+        """
+        where = []
+        args = []
+        for k, v in kwargs.items():
+            if not self.plain(v):
+                raise ValueError(f"cannot match {k}={v!r} in the run catalog, only plain values")
+            if k in self.columns:
+                col = k
+            else:
+                col = "json_extract(start, ?)"
+                args.append(f'$."{k}"')
+            if v is None:
+                where.append(f"{col} IS NULL")
+            else:
+                where.append(f"{col}=?")
+                args.append(v)
+        if since is not None:
+            where.append("time>=?")
+            args.append(to_timestamp(since))
+        if until is not None:
+            where.append("time<?")
+            args.append(to_timestamp(until))
+
+        sql = f"SELECT {','.join(self.columns)}, exit_status FROM runs"
+        if len(where)>0:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY time " + ("ASC" if ascending else "DESC")
+        if limit is not None or offset>0:
+            sql += " LIMIT ? OFFSET ?"
+            args += [-1 if limit is None else limit, offset]
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, args)]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
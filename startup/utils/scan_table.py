@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class ScanTable:
+    """Columns of one event stream from one or more runs, kept as NumPy arrays.
+
+    Only the fields asked for are read, and only the events of the stream. Scalar columns come
+    from the unfilled events, read page by page if the header provides event_pages() (CachedHeader
+    from header_cache), otherwise one event at a time. Columns
+    that refer to external data (detector images in AD_HDF5 files) hold datum ids until they
+    are first accessed; they are then filled using header.table(fields=[field], fill=True),
+    so that only that column is read from the files.
+
+    Columns are available as table[field] or table.field, like a DataFrame; "time" holds the
+    event timestamps as floats. to_dataframe() gives the pandas version.
+    """
+    def __init__(self, headers, fields=None, stream_name="primary"):
+        if not isinstance(headers, (list, tuple)):
+            headers = [headers]
+        self.headers = headers
+        self.stream_name = stream_name
+
+        data_keys = {}
+        for h in headers:
+            for desc in h.descriptors:
+                if desc.get('name', 'primary') == stream_name:
+                    data_keys.update(desc['data_keys'])
+        if fields is None:
+            fields = list(data_keys)
+        missing = [f for f in fields if f not in data_keys]
+        if len(missing)>0:
+            raise KeyError(f"{missing} not found in the {stream_name} stream.")
+        self.external = [f for f in fields if data_keys[f].get('external')]
+        self.columns = ['time'] + [f for f in fields if f!='time']
+
+        scalars = [f for f in self.columns if f not in self.external]
+        cols = {f: [] for f in scalars}
+        self._datum_ids = {f: [] for f in self.external}
+        for h in headers:
+            if hasattr(h, 'event_pages'):
+                events = h.event_pages(stream_name=stream_name)
+            else:
+                events = h.events(stream_name=stream_name, fill=False)
+            for ev in events:
+                if isinstance(ev['time'], list):   # event page
+                    n = len(ev['time'])
+                    cols['time'].extend(ev['time'])
+                    for f in scalars[1:]:
+                        cols[f].extend(ev['data'].get(f, [np.nan]*n))
+                    for f in self.external:
+                        self._datum_ids[f].extend(ev['data'].get(f, [None]*n))
+                else:
+                    cols['time'].append(ev['time'])
+                    for f in scalars[1:]:
+                        cols[f].append(ev['data'].get(f, np.nan))
+                    for f in self.external:
+                        self._datum_ids[f].append(ev['data'].get(f))
+        self._data = {f: np.asarray(v) for f, v in cols.items()}
+
+    def _fill(self, field):
+        frames = []
+        for h in self.headers:
+            frames.extend(h.table(stream_name=self.stream_name, fields=[field], fill=True)[field].values)
+        try:
+            return np.stack(frames)
+        except ValueError:   # frames of different shapes
+            ret = np.empty(len(frames), dtype=object)
+            ret[:] = frames
+            return ret
+
+    def __getitem__(self, field):
+        if field not in self.columns:
+            raise KeyError(field)
+        if field not in self._data:
+            self._data[field] = self._fill(field)
+        return self._data[field]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.__dict__.get('columns', []):
+            raise AttributeError(name)
+        return self[name]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def __len__(self):
+        return len(self._data['time'])
+
+    def keys(self):
+        return list(self.columns)
+
+    def datum_ids(self, field):
+        """ the references to the external data, without reading the data
+        """
+        return list(self._datum_ids[field])
+
+    def to_dataframe(self):
+        import pandas as pd
+        data = {f: (list(self[f]) if f in self.external else self[f]) for f in self.columns}
+        return pd.DataFrame(data, index=pd.RangeIndex(1, len(self)+1, name='seq_num'))
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {len(self)} rows, columns: {self.columns}>"
@@ -0,0 +1,306 @@
+"""
+Packing throughput benchmark
+
+Builds synthetic databroker-like headers with Pilatus/Xspress3 AD_HDF5 resources, then times
+pack_h5 from the profile (startup/39-original_suitcase.py and startup/40-hdf5.py) for each scan type.
+Every case runs in a forked process so that the peak memory reported belongs to that case only. Each
+case is run twice: once for the time and RSS, once with tracemalloc for the Python peak memory, as
+tracing slows down the allocation-heavy h5py/NumPy code. The detector frames in the packed file are
+checked against the synthetic ones.
+
+    python tests/bench_packing.py --frames 1000 --shape 619 487 --output packing_report.json
+
+The profile dependencies (h5py, databroker, py4xs, lixtools) must be installed, e.g. the pixi test env.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import types
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+
+import hashlib
+
+import numpy as np
+import h5py
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_dir)
+
+scan_types = ["scan", "flyscan", "multi", "sol", "HPLC"]
+
+
+def make_ad_hdf5(fn, kind, n_frames, shape, compression="gzip"):
+    """ write a fake AD_HDF5 file, using the same layout as the Pilatus or Xspress3 IOC
+    """
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    rng = np.random.default_rng(0)
+    t0 = time.time() - 631152000.3
+    with h5py.File(fn, "w") as f:
+        if kind == "pilatus":
+            dset = f.create_dataset("entry/data/data", shape=(n_frames, *shape), dtype=np.uint32,
+                                    chunks=(1, *shape), compression=compression)
+            for i in range(n_frames):
+                dset[i] = rng.poisson(5, size=shape)
+            ts = t0 + 0.1*np.arange(n_frames)
+            f["entry/instrument/NDAttributes/NDArrayEpicsTSSec"] = np.floor(ts)
+            f["entry/instrument/NDAttributes/NDArrayEpicsTSnSec"] = (ts - np.floor(ts))*1e9
+        else:  # xspress3
+            dset = f.create_dataset("entry/instrument/detector/data", shape=(n_frames, 1, shape[-1]),
+                                    dtype=np.uint32, chunks=(1, 1, shape[-1]), compression=compression)
+            for i in range(n_frames):
+                dset[i] = rng.poisson(5, size=(1, shape[-1]))
+            f["entry/instrument/performance/timestamp"] = t0 + 0.1*np.arange(n_frames)
+
+
+class SyntheticHeader:
+    """ stand-in for databroker.Header, with the methods used by pack_h5/hdf5_export
+    """
+    def __init__(self, db, start, stop, streams, resources):
+        """ streams: {stream_name: (data_keys, [event data dicts])}
+        """
+        self.db = db
+        self.start = start
+        self.stop = stop
+        self.descriptors = []
+        self._resources = resources
+        self._events = {}
+        for name, (data_keys, data) in streams.items():
+            desc = {"uid": uuid.uuid4().hex, "name": name, "run_start": start["uid"],
+                    "data_keys": data_keys, "time": start["time"]}
+            self.descriptors.append(desc)
+            self._events[name] = [{"uid": uuid.uuid4().hex, "descriptor": desc["uid"], "seq_num": i+1,
+                                   "time": start["time"]+i, "data": d,
+                                   "timestamps": {k: start["time"]+i for k in d.keys()}, "filled": {}}
+                                  for i, d in enumerate(data)]
+
+    @property
+    def uid(self):
+        return self.start["uid"]
+
+    def keys(self):
+        return ["start", "descriptors", "stop"]
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def fields(self, stream_name=None):
+        return {k for d in self.descriptors if stream_name in [None, d["name"]] for k in d["data_keys"]}
+
+    def documents(self, stream_name=None, fill=False):
+        yield "start", self.start
+        for res in self._resources:
+            yield "resource", res
+        for desc in self.descriptors:
+            if stream_name not in [None, desc["name"]]:
+                continue
+            yield "descriptor", desc
+            for ev in self._events[desc["name"]]:
+                yield "event", ev
+        yield "stop", self.stop
+
+    def _fill(self, datum_id):
+        """ same as the AD_HDF5 handler, read the frames of one datum from the resource file,
+            wherever pack_h5 has moved it to
+        """
+        res_uid, i = datum_id.split("/")
+        res = next(r for r in self._resources if r["uid"] == res_uid)
+        fpp = res["resource_kwargs"]["frame_per_point"]
+        for d in [res["root"], self.start["data_path"].split("%s")[0]]:
+            fn = os.path.join(d, res["resource_path"])
+            if os.path.exists(fn):
+                break
+        with h5py.File(fn, "r") as f:
+            data = f["entry/data/data"] if "data" in f["entry"].keys() else f["entry/instrument/detector/data"]
+            return data[int(i)*fpp:(int(i)+1)*fpp]
+
+    def events(self, stream_name="primary", fill=False, fields=None):
+        for ev in self._events.get(stream_name, []):
+            data = {k: v for k, v in ev["data"].items() if fields is None or k in fields}
+            if fill:
+                data = {k: (self._fill(v) if isinstance(v, str) else v) for k, v in data.items()}
+            yield dict(ev, data=data)
+
+    def table(self, stream_name="primary", fields=None, fill=False):
+        import pandas as pd
+        evs = list(self.events(stream_name, fill=fill, fields=fields))
+        return pd.DataFrame({k: [ev["data"][k] for ev in evs] for k in evs[0]["data"]},
+                            index=pd.RangeIndex(1, len(evs)+1, name="seq_num"))
+
+
+class SyntheticDB(dict):
+    def add(self, header):
+        self[header.uid] = header
+
+
+def make_run(db, root, scan_type, n_frames, shape, sample_name, compression="gzip"):
+    """ create the resources and a header that resembles a LiX scan of the given type
+        the resources are placed in {root}/ramdisk, to be relocated to {root}/data by pack_h5
+    """
+    uid = uuid.uuid4().hex
+    ramdisk = f"{root}/ramdisk"
+    start = {"uid": uid, "time": time.time(), "scan_id": len(db)+1, "plan_name": scan_type,
+             "sample_name": sample_name, "data_path": f"{root}/data/%s/",
+             "pilatus": {"ramdisk": ramdisk}}
+
+    if scan_type == "scan":     # step scan, 1 frame per point
+        n_points, fpp = n_frames, 1
+    else:                       # fly scan/HPLC/solution sample, all frames in 1 event
+        n_points, fpp = 1, n_frames
+
+    resources = []
+    datum = {}
+    for det, kind in [("pil1M", "pilatus"), ("xsp3", "xspress3")]:
+        res = {"uid": uuid.uuid4().hex, "spec": "AD_HDF5", "root": ramdisk,
+               "resource_path": f"{sample_name}_{det}_000000.h5", "resource_kwargs": {"frame_per_point": fpp},
+               "run_start": uid}
+        make_ad_hdf5(f"{ramdisk}/{res['resource_path']}", kind, n_frames, shape, compression)
+        os.makedirs(f"{root}/data", exist_ok=True)
+        resources.append(res)
+        datum[f"{det}_image"] = res["uid"]
+
+    data_keys = {"pil1M_image": {"dtype": "array", "shape": [fpp, *shape], "source": "PV:pil1M", "external": "FILESTORE:"},
+                 "xsp3_image": {"dtype": "array", "shape": [fpp, 1, shape[-1]], "source": "PV:xsp3", "external": "FILESTORE:"},
+                 "em2_sum_all_mean_value": {"dtype": "number", "shape": [], "source": "PV:em2"}}
+    data = [{"pil1M_image": f"{datum['pil1M_image']}/{i}", "xsp3_image": f"{datum['xsp3_image']}/{i}",
+             "em2_sum_all_mean_value": float(i)} for i in range(n_points)]
+    streams = {"primary": (data_keys, data)}
+    if scan_type == "HPLC":     # monitored beam intensity, 1 reading per frame
+        streams["em2_sum_all_mean_value_monitor"] = (
+            {"em2_sum_all_mean_value": {"dtype": "number", "shape": [], "source": "PV:em2"}},
+            [{"em2_sum_all_mean_value": float(i)} for i in range(n_frames)])
+
+    stop = {"uid": uuid.uuid4().hex, "run_start": uid, "time": time.time(), "exit_status": "success"}
+    header = SyntheticHeader(db, start, stop, streams, resources)
+    db.add(header)
+    return header
+
+
+def load_profile(db):
+    """ run the relevant startup files in a shared namespace, the same way IPython does for the profile
+        the worker processes spawned by pack_h5 are handed the synthetic db instead of a catalog name
+    """
+    import re
+    ns = {"__name__": "lix_profile"}
+    # no RunEngine here, the subscriptions made by the startup files are not needed
+    ns.update({"db": db, "time": time, "re": re, "RE": types.SimpleNamespace(subscribe=lambda *args: 0)})
+    for fn in ["02-vars.py", "02-utils.py", "39-original_suitcase.py", "40-hdf5.py"]:
+        path = os.path.join(repo_dir, "startup", fn)
+        ns["__file__"] = path
+        with open(path) as fh:
+            exec(compile(fh.read(), path, "exec"), ns)
+    ns["packing_worker_db"] = db
+    return ns
+
+
+def frames_digest(dset):
+    """ checksum of the frames in a dataset, read one frame at a time
+    """
+    h = hashlib.sha1()
+    for i in range(dset.shape[0]):
+        h.update(np.ascontiguousarray(dset[i]).tobytes())
+    return h.hexdigest()
+
+
+def run_case(scan_type, n_frames, shape, n_samples, compression, root, trace_memory=False):
+    db = SyntheticDB()
+    ns = load_profile(db)
+    if scan_type == "multi":    # e.g. a holder of samples, a step scan each
+        headers = [make_run(db, root, "scan", max(1, n_frames//n_samples), shape, f"sample{i}", compression)
+                   for i in range(n_samples)]
+        uids = [h.uid for h in headers]
+    elif scan_type == "sol":    # solution samples, all exposures of a sample in 1 event
+        headers = [make_run(db, root, "sol", max(1, n_frames//n_samples), shape, f"sample{i}", compression)
+                   for i in range(n_samples)]
+        uids = [h.uid for h in headers]
+    else:
+        headers = [make_run(db, root, scan_type, n_frames, shape, "sample0", compression)]
+        uids = headers[0].uid
+    nbytes = sum(os.path.getsize(f"{root}/ramdisk/{r['resource_path']}") for h in headers for r in h._resources)
+    digests = {}
+    for h in headers:
+        with h5py.File(f"{root}/ramdisk/{h._resources[0]['resource_path']}", "r") as f:
+            digests[h.start["sample_name"]] = frames_digest(f["entry/data/data"])
+
+    os.makedirs(f"{root}/out", exist_ok=True)
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    if isinstance(uids, list):
+        fn = ns["pack_h5"](uids, dest_dir=f"{root}/out", fn="holder")
+    else:
+        fn = ns["pack_h5"](uids, dest_dir=f"{root}/out")
+    dt = time.perf_counter() - t0
+    if trace_memory:
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"python_peak_MB": py_peak/1e6}
+
+    # the Pilatus frames should be the same as in the resource files
+    with h5py.File(fn, "r") as f:
+        content_ok = all(frames_digest(f[f"{sn}/primary/data/pil1M_image"]) == d for sn, d in digests.items())
+
+    return {"scan_type": scan_type, "n_frames": n_frames, "frame_shape": list(shape), "n_headers": len(headers),
+            "compression": compression, "source_bytes": nbytes, "packed_bytes": os.path.getsize(fn),
+            "content_ok": content_ok, "time_sec": dt, "MB_per_sec": nbytes/dt/1e6,
+            "maxrss_MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3,
+            "maxrss_children_MB": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1e3}
+
+
+def _case_process(conn, args):
+    try:
+        conn.send(run_case(*args))
+    except Exception as e:
+        conn.send({"scan_type": args[0], "error": repr(e)})
+    conn.close()
+
+
+def run_in_process(ctx, args, tmpdir=None):
+    with tempfile.TemporaryDirectory(dir=tmpdir) as root:
+        parent_conn, child_conn = ctx.Pipe()
+        p = ctx.Process(target=_case_process, args=(child_conn, (*args[:5], root, *args[5:])))
+        p.start()
+        ret = parent_conn.recv()
+        p.join()
+    return ret
+
+
+def run_benchmark(scan_types=scan_types, n_frames=100, shape=(195, 487), n_samples=4,
+                  compression="gzip", repeat=1, tmpdir=None):
+    ctx = multiprocessing.get_context("fork")
+    results = []
+    for scan_type in scan_types:
+        for i in range(repeat):
+            args = (scan_type, n_frames, shape, n_samples, compression)
+            ret = run_in_process(ctx, args, tmpdir)
+            # memory is measured separately, the timed run is not traced
+            ret.update(run_in_process(ctx, args+(True,), tmpdir))
+            ret["repeat"] = i
+            print(json.dumps(ret))
+            results.append(ret)
+    return {"time": time.asctime(), "host": os.uname().nodename,
+            "h5py": h5py.version.version, "hdf5": h5py.version.hdf5_version, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time and memory-profile pack_h5 on synthetic data")
+    parser.add_argument("--types", nargs="+", default=scan_types, choices=scan_types)
+    parser.add_argument("--frames", type=int, default=100, help="number of frames per run")
+    parser.add_argument("--shape", type=int, nargs=2, default=[195, 487], help="Pilatus frame shape")
+    parser.add_argument("--samples", type=int, default=4, help="number of headers for multi/sol")
+    parser.add_argument("--compression", default="gzip")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--tmpdir", default=None, help="where to create the synthetic data")
+    parser.add_argument("--output", default="packing_report.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.types, args.frames, tuple(args.shape), args.samples,
+                           None if args.compression == "none" else args.compression, args.repeat, args.tmpdir)
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"report saved to {args.output}")
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("h5py")
+pytest.importorskip("databroker")
+pytest.importorskip("py4xs")
+pytest.importorskip("lixtools")
+
+# Add path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+import h5py
+from bench_packing import run_benchmark
+
+
+def test_packing_benchmark_smoke(tmp_path):
+    report = run_benchmark(n_frames=6, shape=(16, 24), n_samples=3, tmpdir=str(tmp_path))
+    results = report["results"]
+    assert [r["scan_type"] for r in results] == ["scan", "flyscan", "multi", "sol", "HPLC"]
+    for r in results:
+        assert "error" not in r, r
+        assert r["content_ok"], r
+        assert r["time_sec"] > 0
+        assert r["python_peak_MB"] > 0
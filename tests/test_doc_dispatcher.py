@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import threading
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.doc_dispatcher import DocumentDispatcher, ScanInfoWriter
+
+
+class FakeRedis:
+    """Counts the round trips, set() can be held up to let documents pile up."""
+    def __init__(self):
+        self.data = {}
+        self.calls = {"get": 0, "set": 0}
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, key):
+        self.calls["get"] += 1
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.release.wait(5)
+        self.calls["set"] += 1
+        self.data[key] = value
+
+
+def start_doc(i):
+    return {"uid": f"uid{i}", "scan_id": i, "proc_path": "/tmp/", "sample_name": f"s{i}", "plan_name": "ct"}
+
+
+def test_slow_callback_does_not_block():
+    dispatcher = DocumentDispatcher()
+    dispatcher.subscribe(lambda name, doc: time.sleep(0.2), 'start', label="slow")
+    t0 = time.time()
+    for i in range(5):
+        dispatcher('start', start_doc(i))
+        dispatcher('event', {})
+    assert time.time()-t0 < 0.1
+    assert dispatcher.wait(5)
+    st = dispatcher.stats["slow"]
+    assert st["count"] == 5
+    assert st["max_run_time"] >= 0.2
+    assert st["max_latency"] >= st["max_run_time"]
+
+
+def test_scan_info_writes_are_batched():
+    r = FakeRedis()
+    dispatcher = DocumentDispatcher()
+    dispatcher.subscribe(ScanInfoWriter(r), 'start')
+    r.release.clear()
+    dispatcher('start', start_doc(0))
+    time.sleep(0.05)    # the first write is held up, the next documents are queued meanwhile
+    for i in range(1, 5):
+        dispatcher('start', start_doc(i))
+    r.release.set()
+    assert dispatcher.wait(5)
+
+    assert r.calls["set"] == 2
+    hdrs = json.loads(r.data["scan_info"])
+    assert list(hdrs.keys()) == ["uid2", "uid3", "uid4"]
+    assert hdrs["uid4"] == {"proc_path": "/tmp/", "sample_name": "s4", "plan_name": "ct"}
+    assert dispatcher.stats["ScanInfoWriter"]["count"] == 5
+
+
+def test_failed_write_is_retried():
+    class FlakyRedis(FakeRedis):
+        fail = True
+
+        def set(self, key, value):
+            if self.fail:
+                self.fail = False
+                raise ConnectionError("redis is down")
+            super().set(key, value)
+
+    r = FlakyRedis()
+    dispatcher = DocumentDispatcher()
+    dispatcher.subscribe(ScanInfoWriter(r), 'start')
+    dispatcher('start', start_doc(0))
+    assert dispatcher.wait(5)
+    assert dispatcher.stats["ScanInfoWriter"]["errors"] == 1
+    dispatcher('start', start_doc(1))
+    assert dispatcher.wait(5)
+    assert list(json.loads(r.data["scan_info"]).keys()) == ["uid0", "uid1"]
@@ -0,0 +1,162 @@
+import os
+import sys
+from unittest.mock import patch
+from collections import Counter
+
+import pytest
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.header_cache import HeaderCache, CachedHeader
+
+
+class MockHeader:
+    """Mock databroker header that counts backend reads."""
+    def __init__(self, uid, n_events=5, finished=True):
+        self.calls = Counter()
+        self._start = {"uid": uid, "scan_id": 1, "plan_name": "ct"}
+        self._stop = {"uid": uid+"-stop", "exit_status": "success"} if finished else None
+        self._descriptors = [{"uid": "d1", "name": "primary", "data_keys": {"pil1M_image": {}}}]
+        self._docs = [("start", self._start),
+                      ("descriptor", self._descriptors[0]),
+                      ("resource", {"uid": "r1", "spec": "AD_HDF5"})]
+        self._docs += [("event", {"descriptor": "d1", "seq_num": i+1, "time": float(i),
+                                  "data": {"pil1M_image": f"r1/{i}"}, "timestamps": {"pil1M_image": float(i)}})
+                       for i in range(n_events)]
+
+    @property
+    def start(self):
+        self.calls["start"] += 1
+        return self._start
+
+    @property
+    def stop(self):
+        self.calls["stop"] += 1
+        return self._stop
+
+    @property
+    def descriptors(self):
+        self.calls["descriptors"] += 1
+        return self._descriptors
+
+    def documents(self, stream_name=None, fill=False):
+        self.calls["documents"] += 1
+        yield from self._docs
+
+    def events(self, stream_name='primary', fill=False, fields=None):
+        self.calls["events"] += 1
+        yield from (d for n, d in self._docs if n == "event")
+
+    def table(self, **kwargs):
+        self.calls["table"] += 1
+        return {}
+
+
+class MockDB:
+    def __init__(self, **kwargs):
+        self.headers = {}
+        self.kwargs = kwargs
+
+    def __getitem__(self, uid):
+        if uid not in self.headers:
+            self.headers[uid] = MockHeader(uid, **self.kwargs)
+        return self.headers[uid]
+
+
+def test_each_document_stream_is_read_once():
+    cache = HeaderCache(MockDB())
+    for _ in range(3):
+        h = cache["uid1"]
+        assert h.start["uid"] == "uid1"
+        assert h.stop["exit_status"] == "success"
+        assert set(h.resources().keys()) == {"r1"}
+        assert h.descriptors[0]["name"] == "primary"
+        h.table(fields=["pil1M_image"], fill=True)
+
+    calls = cache.db.headers["uid1"].calls
+    assert calls["start"] == 1
+    assert calls["stop"] == 1
+    assert calls["descriptors"] == 1
+    assert calls["documents"] == 1
+    assert calls["table"] == 3
+
+
+def test_events_are_streamed():
+    header = MockHeader("uid1")
+    page = {"descriptor": "d1", "seq_num": [6, 7], "time": [5., 6.],
+            "data": {"pil1M_image": ["r1/5", "r1/6"]}, "timestamps": {"pil1M_image": [5., 6.]}}
+    header._docs.append(("event_page", page))
+    header._docs.append(("event", {"descriptor": "d2", "seq_num": 1, "time": 0., "data": {}, "timestamps": {}}))
+    h = CachedHeader(header)
+
+    for _ in range(2):
+        docs = list(h.event_pages(stream_name="primary"))
+        assert len(docs) == 6
+        assert docs[-1] is page
+    # nothing is kept, the events are read from the backend every time
+    assert header.calls["documents"] == 2
+    assert "documents" not in h._cache
+
+
+def test_resources_from_the_event_walk():
+    header = MockHeader("uid1")
+    h = CachedHeader(header)
+    assert len(list(h.event_pages(stream_name=None))) == 5
+    assert set(h.resources().keys()) == {"r1"}
+    # packing reads each header from the backend once
+    assert header.calls["documents"] == 1
+
+
+def test_header_at_hand_is_reused():
+    db = MockDB()
+    cache = HeaderCache(db)
+    h = cache[db["uid1"]]
+    assert h.uid == "uid1"
+    assert cache["uid1"] is h
+    # once for the uid, once more by the CachedHeader
+    assert db.headers["uid1"].calls["start"] == 2
+
+
+def test_unfinished_run_is_not_cached():
+    cache = HeaderCache(MockDB(finished=False))
+    h = cache["uid1"]
+    assert h.stop is None
+    h.resources()
+    h.resources()
+    h.descriptors
+    h.descriptors
+    calls = cache.db.headers["uid1"].calls
+    assert calls["stop"] > 1
+    assert calls["documents"] == 2
+    assert calls["descriptors"] == 2
+
+
+def test_lru_and_ttl_eviction():
+    cache = HeaderCache(MockDB(), maxsize=2, ttl=10)
+    with patch("startup.utils.header_cache.time.time", return_value=100.):
+        h1 = cache["uid1"]
+        cache["uid2"]
+        assert cache["uid1"] is h1   # uid1 is now the most recently used
+        cache["uid3"]
+        assert "uid2" not in cache
+        assert "uid1" in cache
+    with patch("startup.utils.header_cache.time.time", return_value=111.):
+        assert "uid1" not in cache
+        assert cache["uid1"] is not h1
+
+
+def test_header_as_dict():
+    class DictHeader(MockHeader):
+        def keys(self):
+            return ["start", "descriptors", "stop"]
+
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+    h = CachedHeader(DictHeader("uid1"))
+    d = dict(h)
+    assert d["start"]["uid"] == "uid1"
+    assert d["stop"]["exit_status"] == "success"
+    h.start
+    assert h.header.calls["start"] == 1
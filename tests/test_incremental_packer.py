@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("h5py")
+pytest.importorskip("databroker")
+pytest.importorskip("py4xs")
+pytest.importorskip("lixtools")
+
+# Add path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+import h5py
+from bench_packing import SyntheticDB, load_profile, make_run
+
+
+@pytest.mark.parametrize("flush_interval", [0, 100])
+def test_incremental_packing_copies_the_frames(tmp_path, flush_interval):
+    root = str(tmp_path)
+    db = SyntheticDB()
+    ns = load_profile(db)
+    header = make_run(db, root, "HPLC", 6, (16, 24), "sample0")
+    with h5py.File(f"{root}/ramdisk/{header._resources[0]['resource_path']}", "r") as f:
+        frames = f["entry/data/data"][...]
+        ts = (f["entry/instrument/NDAttributes/NDArrayEpicsTSSec"][...] +
+              f["entry/instrument/NDAttributes/NDArrayEpicsTSnSec"][...]*1e-9 + 631152000.3)
+
+    # flush_interval=0 switches the file into SWMR mode at the first event, the monitor stream comes after that
+    packer = ns["IncrementalPacker"](dest_dir=root, flush_interval=flush_interval, select=lambda start: True)
+    for name, doc in header.documents():
+        packer(name, doc)
+    fn = packer.wait(header.uid, timeout=30)
+    assert fn == f"{root}/sample0.h5"
+
+    with h5py.File(fn, "r") as f:
+        grp = f["sample0"]
+        np.testing.assert_array_equal(grp["primary/data/pil1M_image"][...], frames)
+        np.testing.assert_allclose(grp["primary/timestamps/pil1M_image"][...], ts)
+        assert grp["primary/data/xsp3_image"].shape == (6, 1, 24)
+        assert len(grp["em2_sum_all_mean_value_monitor/data/em2_sum_all_mean_value"]) == 6
@@ -0,0 +1,158 @@
+import os
+import sys
+import copy
+import json
+import time
+import pickle
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.md_cache import CachedRedisDict
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """Counts the round trips to the server, a pipeline counts once."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_calls = 0
+
+    def execute_command(self, *args, **kwargs):
+        self.n_calls += 1
+        return super().execute_command(*args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            self.n_calls += 1
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+def wait_until(cond, timeout=5):
+    t0 = time.time()
+    while not cond():
+        if time.time()-t0 > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def test_reads_are_local_and_writes_coalesced(server):
+    r = CountingRedis(server=server)
+    r.set("pilatus", json.dumps({"ramdisk": "/ramdisk"}))
+    md = CachedRedisDict(r, flush_delay=None, notify=False)
+    assert md["pilatus"]["ramdisk"] == "/ramdisk"
+
+    n = r.n_calls
+    for i in range(20):
+        md["pilatus"]["num_images"] = [1, i]
+        md["pilatus"]["active_detectors"] = ["pil1M"]
+        md["sample_name"] = f"s{i}"
+        dict(md)
+    md["pilatus"]["active_detectors"].append("pilW2")
+    assert r.n_calls == n
+
+    md.flush()
+    assert r.n_calls == n+1
+    assert json.loads(r.get("pilatus")) == {"ramdisk": "/ramdisk", "num_images": [1, 19],
+                                            "active_detectors": ["pil1M", "pilW2"]}
+    assert json.loads(r.get("sample_name")) == "s19"
+
+    del md["sample_name"]
+    md.flush()
+    assert r.get("sample_name") is None
+    assert "sample_name" not in md
+
+
+def test_delayed_flush(server):
+    r = fakeredis.FakeRedis(server=server)
+    md = CachedRedisDict(r, flush_delay=0.05, notify=False)
+    md["a"] = {"b": 1}
+    md["a"]["c"] = 2
+    assert r.get("a") is None
+    assert wait_until(lambda: r.get("a") is not None)
+    assert json.loads(r.get("a")) == {"b": 1, "c": 2}
+
+
+def test_copies_are_plain(server):
+    md = CachedRedisDict(fakeredis.FakeRedis(server=server), flush_delay=None, notify=False)
+    md["a"] = {"b": [1, {"c": 2}]}
+    for c in [copy.copy(md["a"]), copy.deepcopy(md["a"]), pickle.loads(pickle.dumps(md["a"]))]:
+        assert type(c) is dict
+        assert c == {"b": [1, {"c": 2}]}
+    c = copy.deepcopy(md["a"])
+    c["b"][1]["c"] = 3
+    assert md["a"]["b"][1]["c"] == 2
+
+
+def test_invalidation_by_notification(server):
+    r = fakeredis.FakeRedis(server=server)
+    md = CachedRedisDict(r, flush_delay=None, notify=True)
+    assert md.notifications
+    md["a"] = 1
+    md["b"] = {"x": 1}
+    obj = md["b"]
+    md.flush()
+
+    other = fakeredis.FakeRedis(server=server)
+    other.set("a", json.dumps(2))
+    assert wait_until(lambda: md["a"] == 2)
+    other.delete("a")
+    assert wait_until(lambda: "a" not in md)
+    # own writes do not replace the local objects
+    time.sleep(0.2)
+    assert md["b"] is obj
+    md.close()
+
+
+def test_notification_fetch_outside_lock(server):
+    r = fakeredis.FakeRedis(server=server)
+    md = CachedRedisDict(r, flush_delay=None, notify=True)
+    acquired = []
+
+    def probe():
+        if md._lock.acquire(timeout=1):
+            md._lock.release()
+            acquired.append(True)
+        else:
+            acquired.append(False)
+
+    class ProbingRedis(fakeredis.FakeRedis):
+        def get(self, *args, **kwargs):
+            # another thread must be able to take the lock while the value is fetched
+            t = threading.Thread(target=probe)
+            t.start()
+            t.join()
+            return super().get(*args, **kwargs)
+
+    md._client = ProbingRedis(server=server)
+    fakeredis.FakeRedis(server=server).set("a", json.dumps(1))
+    assert wait_until(lambda: md.get("a") == 1)
+    assert acquired == [True]
+    md.close()
+
+
+def test_reload_picks_up_changes(server):
+    r = fakeredis.FakeRedis(server=server)
+    md = CachedRedisDict(r, flush_delay=None, notify=False)
+    md["b"] = 1
+    r.set("a", json.dumps(2))
+    assert "a" not in md
+    md.reload()
+    assert md["a"] == 2
+    assert md["b"] == 1
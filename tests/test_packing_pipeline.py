@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("h5py")
+pytest.importorskip("databroker")
+pytest.importorskip("py4xs")
+pytest.importorskip("lixtools")
+
+# Add path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+import h5py
+from bench_packing import SyntheticDB, load_profile, make_run
+
+
+def test_server_jobs_go_through_the_pipeline(tmp_path):
+    root = str(tmp_path)
+    db = SyntheticDB()
+    ns = load_profile(db)
+    uids = [make_run(db, root, "scan", 2, (16, 24), f"sample{i}").uid for i in range(2)]
+    os.makedirs(f"{root}/out", exist_ok=True)
+
+    # returns once the data are packed, the processing is left to packing_pipeline
+    ns["run_packing_msg"](f"multi::{'|'.join(uids)}::{root}/out::gpfs::False")
+    pipeline = ns["packing_pipeline"]
+    job, = pipeline.jobs
+    assert job["packed"].is_set()
+    assert pipeline.wait(job, timeout=60) == "tmp.h5"
+    assert job["status"] == "done"
+    with h5py.File(f"{root}/out/tmp.h5", "r") as f:
+        assert set(f.keys()) == {"sample0", "sample1"}
+
+    ns["proc_path"] = f"{root}/out"   # set by login() in bsui
+    job = ns["send_to_packing_queue"]('|'.join(uids), "multi", froot=None)
+    assert pipeline.wait(job, timeout=60) == "tmp.h5"
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import threading
+import socket
+
+import pytest
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.packing_queue import (PackingQueueServer, PackingJournal,
+                                         send_packing_msg, query_packing_job)
+
+
+def wait_for_status(port, job_id, status, timeout=10):
+    t0 = time.time()
+    while time.time()-t0 < timeout:
+        job = query_packing_job("127.0.0.1", port, job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"job {job_id} did not reach {status}: {job}")
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    servers = []
+
+    def start(handler, **kwargs):
+        srv = PackingQueueServer(handler, "127.0.0.1", 0, str(tmp_path / "journal.jsonl"), **kwargs)
+        th = threading.Thread(target=srv.run, daemon=True)
+        th.start()
+        assert srv.started.wait(5)
+        servers.append((srv, th))
+        return srv
+
+    yield start
+    for srv, th in servers:
+        srv.stop()
+        th.join(5)
+
+
+def test_concurrent_submissions(start_server):
+    done = []
+    lock = threading.Lock()
+
+    def handler(msg):
+        time.sleep(0.05)
+        with lock:
+            done.append(msg)
+
+    srv = start_server(handler, max_workers=2, max_queued=20)
+    job_ids = {}
+
+    def client(n):
+        for i in range(5):
+            msg = f"scan::uid{n}-{i}::/tmp::gpfs::False"
+            job_ids[msg] = send_packing_msg("127.0.0.1", srv.port, msg)
+
+    clients = [threading.Thread(target=client, args=(n,)) for n in range(4)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join(10)
+
+    assert len(job_ids) == 20
+    for job_id in job_ids.values():
+        wait_for_status(srv.port, job_id, "done")
+    assert sorted(done) == sorted(job_ids.keys())
+
+
+def test_legacy_client_without_reply(start_server):
+    done = threading.Event()
+    srv = start_server(lambda msg: done.set())
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect(("127.0.0.1", srv.port))
+    s.send("scan::uid::/tmp::gpfs::False".encode('ascii'))
+    s.close()
+    assert done.wait(5)
+
+
+def test_rejected_and_retried_jobs(start_server):
+    attempts = []
+
+    def handler(msg):
+        attempts.append(msg)
+        if len(attempts) < 2:
+            raise Exception("resource not ready")
+
+    def validator(msg):
+        if "bad" in msg:
+            raise Exception("incomplete header")
+
+    srv = start_server(handler, validator=validator, max_retries=1, retry_delay=0.05)
+    assert send_packing_msg("127.0.0.1", srv.port, "scan::bad::/tmp::gpfs::False").startswith("rejected::")
+
+    job_id = send_packing_msg("127.0.0.1", srv.port, "scan::good::/tmp::gpfs::False")
+    job = wait_for_status(srv.port, job_id, "done")
+    assert job["attempts"] == 2
+    assert len(attempts) == 2
+
+
+def test_journal_resumes_pending_jobs(start_server, tmp_path):
+    journal = PackingJournal(str(tmp_path / "journal.jsonl"))
+    journal.record({"id": "a", "msg": "scan::a::/tmp::gpfs::False", "status": "running",
+                    "attempts": 1, "submitted": 1., "error": None})
+    journal.record({"id": "b", "msg": "scan::b::/tmp::gpfs::False", "status": "done",
+                    "attempts": 1, "submitted": 2., "error": None})
+    with open(journal.path, "a") as fh:
+        fh.write('{"id": "c", "msg"')  # interrupted write
+
+    done = []
+    srv = start_server(lambda msg: done.append(msg))
+    wait_for_status(srv.port, "a", "done")
+    assert done == ["scan::a::/tmp::gpfs::False"]
+    assert query_packing_job("127.0.0.1", srv.port, "c")["status"] == "unknown"
+
+    with open(journal.path) as fh:
+        states = [json.loads(line) for line in fh]
+    assert states[-1] == srv.jobs["a"]
+
+
+def test_full_queue_and_duplicates(start_server):
+    release = threading.Event()
+    srv = start_server(lambda msg: release.wait(10), max_workers=1, max_queued=1)
+
+    # 1 job running, 1 waiting in the queue, the 3rd one is turned away instead of held in the server
+    job_ids = [send_packing_msg("127.0.0.1", srv.port, "scan::uid0::/tmp::gpfs::False", timeout=2)]
+    wait_for_status(srv.port, job_ids[0], "running")
+    job_ids.append(send_packing_msg("127.0.0.1", srv.port, "scan::uid1::/tmp::gpfs::False", timeout=2))
+    assert send_packing_msg("127.0.0.1", srv.port, "scan::uid2::/tmp::gpfs::False", timeout=2) == "rejected::queue full"
+    assert len(set(job_ids)) == 2
+    # the same request again, e.g. after a client timed out, gets the id of the existing job
+    assert send_packing_msg("127.0.0.1", srv.port, "scan::uid1::/tmp::gpfs::False", timeout=2) == job_ids[1]
+
+    release.set()
+    for job_id in job_ids:
+        wait_for_status(srv.port, job_id, "done")
+    assert len(srv.jobs) == 2
+    # there is space again
+    job_id = send_packing_msg("127.0.0.1", srv.port, "scan::uid2::/tmp::gpfs::False", timeout=2)
+    wait_for_status(srv.port, job_id, "done")
+
+
+def test_finished_jobs_are_pruned(start_server, tmp_path):
+    srv = start_server(lambda msg: None, max_finished=3)
+    job_ids = []
+    for i in range(150):
+        job_ids.append(send_packing_msg("127.0.0.1", srv.port, f"scan::uid{i}::/tmp::gpfs::False"))
+        wait_for_status(srv.port, job_ids[-1], "done")
+
+    assert set(srv.jobs.keys()) == set(job_ids[-3:])
+    assert query_packing_job("127.0.0.1", srv.port, job_ids[0])["status"] == "unknown"
+    with open(tmp_path / "journal.jsonl") as fh:
+        assert len(fh.readlines()) <= 2*3 + 100
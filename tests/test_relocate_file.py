@@ -0,0 +1,55 @@
+import os
+import sys
+import errno
+
+import pytest
+
+pytest.importorskip("h5py")
+pytest.importorskip("databroker")
+pytest.importorskip("py4xs")
+pytest.importorskip("lixtools")
+
+# Add path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_packing import SyntheticDB, load_profile
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """ make renaming the source fail as it would across file systems
+    """
+    rename = os.rename
+
+    def fake_rename(src, dest):
+        if not str(src).endswith("_partial"):
+            raise OSError(errno.EXDEV, "cross-device link")
+        rename(src, dest)
+    monkeypatch.setattr(os, "rename", fake_rename)
+
+
+@pytest.mark.parametrize("checksum", [True, False])
+def test_copy_across_devices(tmp_path, cross_device, checksum):
+    ns = load_profile(SyntheticDB())
+    src = tmp_path/"ramdisk"/"a.h5"
+    dest = tmp_path/"data"/"a.h5"
+    src.parent.mkdir()
+    data = os.urandom(3<<20)
+    src.write_bytes(data)
+    ns["relocate_file"](str(src), str(dest), checksum=checksum)
+    assert dest.read_bytes() == data
+    assert not src.exists()
+    assert not os.path.exists(str(dest)+"_partial")
+
+
+def test_failed_copy_is_removed(tmp_path, cross_device):
+    ns = load_profile(SyntheticDB())
+    src = tmp_path/"a.h5"
+    dest = tmp_path/"data"/"a.h5"
+    src.write_bytes(b"0123456789")
+    ns["_file_crc32"] = lambda fn: -1
+    with pytest.raises(IOError):
+        ns["relocate_file"](str(src), str(dest))
+    assert src.exists()
+    assert not dest.exists()
+    assert not os.path.exists(str(dest)+"_partial")
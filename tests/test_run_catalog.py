@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.run_catalog import RunCatalog, to_timestamp
+
+
+def start_doc(i, t0=1.7e9, **kwargs):
+    doc = {"uid": f"uid{i}", "scan_id": i, "plan_name": "ct" if i%2 else "scan", "sample_name": f"s{i}",
+           "proposal_id": "123456", "run_id": "run1", "time": t0+i*60, "num_points": 5, "holderName": f"h{i%3}"}
+    doc.update(kwargs)
+    return doc
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    cat = RunCatalog(str(tmp_path / "runs.sqlite"))
+    for i in range(100):
+        cat("start", start_doc(i))
+        cat("stop", {"run_start": f"uid{i}", "exit_status": "success"})
+    cat.flush()
+    yield cat
+    cat.close()
+
+
+def test_query_by_column_and_metadata(catalog):
+    assert len(catalog) == 100
+    rows = catalog.query(plan_name="ct", holderName="h1")
+    assert [r["uid"] for r in rows[:3]] == ["uid97", "uid91", "uid85"]
+    assert all(r["exit_status"] == "success" for r in rows)
+    assert catalog.query(uid="uid5")[0]["sample_name"] == "s5"
+    assert catalog.query(holderName="nothing") == []
+
+
+def test_paging_and_time_range(catalog):
+    page1 = catalog.query(limit=10)
+    page2 = catalog.query(limit=10, offset=10)
+    assert [r["scan_id"] for r in page1] == list(range(99, 89, -1))
+    assert [r["scan_id"] for r in page2] == list(range(89, 79, -1))
+    rows = catalog.query(since=1.7e9+600, until=1.7e9+1200, ascending=True)
+    assert [r["scan_id"] for r in rows] == list(range(10, 20))
+
+
+def test_documents_are_visible_after_flush(tmp_path):
+    path = str(tmp_path / "runs.sqlite")
+    cat = RunCatalog(path)
+    cat("start", start_doc(0))
+    other = RunCatalog(path)
+    assert len(other) == 0
+    cat.flush()
+    assert len(other) == 1
+
+
+def test_to_timestamp():
+    assert to_timestamp(12.) == 12.
+    assert to_timestamp("2025-03-01") == time.mktime(time.strptime("2025-03-01", "%Y-%m-%d"))
+    with pytest.raises(ValueError):
+        to_timestamp("March 1st")
+
+
+def test_only_plain_values(catalog):
+    with pytest.raises(ValueError):
+        catalog.query(scan_id={"$gt": 5})
+    with pytest.raises(ValueError):
+        catalog.query(sample_name=["s1", "s2"])
+    assert catalog.query(comment=None, limit=1)[0]["uid"] == "uid99"
+    assert catalog.query(holderName=None) == []
+
+
+def test_covers(catalog, tmp_path):
+    assert catalog.oldest() == 1.7e9
+    assert catalog.covers(since=1.7e9+60, plan_name="ct")
+    # earlier runs may be missing, the Mongo operators only work in databroker
+    assert not catalog.covers(since=1.7e9-60)
+    assert not catalog.covers(plan_name="ct")
+    assert not catalog.covers(since=1.7e9+60, scan_id={"$gt": 5})
+    assert not RunCatalog(str(tmp_path / "empty.sqlite")).covers(since=0)
+
+
+def test_covers_recent_runs(catalog):
+    # without since, enough matching runs must be in the catalog, and it must be up to date
+    assert catalog.newest() == 1.7e9+99*60
+    assert catalog.covers(plan_name="ct", limit=10)
+    assert catalog.covers(plan_name="ct", limit=10, offset=40)
+    assert not catalog.covers(plan_name="ct", limit=10, offset=41)
+    assert not catalog.covers(plan_name="ct", until=1.7e9+600, limit=10)
+    assert catalog.covers(plan_name="ct", limit=10, latest=1.7e9+99*60)
+    assert not catalog.covers(plan_name="ct", limit=10, latest=1.7e9+100*60)
@@ -0,0 +1,93 @@
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pytest
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup.utils.scan_table import ScanTable
+
+
+class MockHeader:
+    """Mock databroker header with one scalar and one image column, counts the filled reads."""
+    def __init__(self, n_events=5, offset=0):
+        self.calls = Counter()
+        self.offset = offset
+        self.descriptors = [{"uid": "d1", "name": "primary",
+                             "data_keys": {"ss_x": {"dtype": "number"},
+                                           "em1_sum_all_mean_value": {"dtype": "number"},
+                                           "pil1M_image": {"dtype": "array", "external": "FILESTORE:"}}},
+                            {"uid": "d2", "name": "baseline", "data_keys": {"energy": {"dtype": "number"}}}]
+        self._events = [{"descriptor": "d1", "seq_num": i+1, "time": 100.+i,
+                         "data": {"ss_x": offset+i*0.1, "em1_sum_all_mean_value": 10.*i, "pil1M_image": f"r1/{i}"}}
+                        for i in range(n_events)]
+
+    def events(self, stream_name='primary', fill=False, fields=None):
+        self.calls["events"] += 1
+        assert not fill
+        yield from self._events
+
+    def table(self, stream_name='primary', fields=None, fill=False):
+        self.calls["table"] += 1
+        assert fields == ["pil1M_image"] and fill
+
+        class Column:
+            values = [np.full((1, 4, 3), i) for i in range(len(self._events))]
+        return {"pil1M_image": Column()}
+
+
+def test_projection_and_lazy_fill():
+    h = MockHeader()
+    d = ScanTable(h, fields=["ss_x", "pil1M_image"])
+    assert d.keys() == ["time", "ss_x", "pil1M_image"]
+    assert len(d) == 5
+    np.testing.assert_allclose(d.ss_x, [0, 0.1, 0.2, 0.3, 0.4])
+    np.testing.assert_allclose(d["time"], 100.+np.arange(5))
+    assert "em1_sum_all_mean_value" not in d
+    with pytest.raises(AttributeError):
+        d.em1_sum_all_mean_value
+    assert d.datum_ids("pil1M_image") == [f"r1/{i}" for i in range(5)]
+    assert h.calls["table"] == 0
+
+    assert d.pil1M_image.shape == (5, 1, 4, 3)
+    assert d["pil1M_image"][3].max() == 3
+    assert h.calls["table"] == 1
+
+
+def test_multiple_headers():
+    d = ScanTable([MockHeader(3), MockHeader(2, offset=1)])
+    assert d.keys() == ["time", "ss_x", "em1_sum_all_mean_value", "pil1M_image"]
+    np.testing.assert_allclose(d.ss_x, [0, 0.1, 0.2, 1, 1.1])
+    assert len(d.pil1M_image) == 5
+
+
+class PagedHeader(MockHeader):
+    """Same data, but only event pages of the requested stream, as CachedHeader.event_pages() gives them."""
+    def events(self, *args, **kwargs):
+        raise AssertionError("events() should not be used")
+
+    def event_pages(self, stream_name='primary'):
+        self.calls["event_pages"] += 1
+        assert stream_name == "primary"
+        for i in range(0, len(self._events), 2):
+            evs = self._events[i:i+2]
+            yield {"descriptor": "d1", "seq_num": [ev["seq_num"] for ev in evs],
+                   "time": [ev["time"] for ev in evs],
+                   "data": {k: [ev["data"][k] for ev in evs] for k in evs[0]["data"]}}
+
+
+def test_event_pages():
+    h = PagedHeader()
+    d = ScanTable([h, MockHeader(2, offset=1)], fields=["ss_x", "pil1M_image"])
+    assert h.calls["event_pages"] == 1
+    np.testing.assert_allclose(d.ss_x, [0, 0.1, 0.2, 0.3, 0.4, 1, 1.1])
+    np.testing.assert_allclose(d["time"], [100, 101, 102, 103, 104, 100, 101])
+    assert d.datum_ids("pil1M_image")[:5] == [f"r1/{i}" for i in range(5)]
+
+
+def test_unknown_field():
+    with pytest.raises(KeyError):
+        ScanTable(MockHeader(), fields=["energy"])
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import socket
+import threading
+
+import pytest
+
+# Add path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'startup', 'components'))
+
+from XPS_Q8_drivers3 import XPS, XPSSocketPool
+
+
+class FakeXPS:
+    """Minimal XPS TCP server: one thread per connection, commands end with ')'.
+
+    Replies are sent a few bytes at a time to exercise the response parser.
+    GroupMoveAbsolute blocks for move_time, like the real controller does.
+    """
+    def __init__(self, move_time=0.5, chunk=3):
+        self.move_time = move_time
+        self.chunk = chunk
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.position = 0.
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def reply(self, cmd):
+        if cmd.startswith("ErrorListGet"):
+            return "0,Error -1: Busy socket;Error 0: Success"
+        if cmd.startswith("GroupMoveAbsolute"):
+            time.sleep(self.move_time)
+            self.position = float(cmd.split(',')[1].rstrip(')'))
+            return "0,"
+        if cmd.startswith("GroupPositionCurrentGet"):
+            return f"0,{self.position}"
+        if cmd.startswith("GroupMotionStatusGet"):
+            return "0,0"
+        return "-7,"
+
+    def handle(self, conn):
+        buf = b""
+        with conn:
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    return
+                buf += data
+                while b")" in buf:
+                    cmd, buf = buf.split(b")", 1)
+                    ret = (self.reply(cmd.decode()+")")+",EndOfAPI").encode()
+                    for i in range(0, len(ret), self.chunk):
+                        conn.sendall(ret[i:i+self.chunk])
+                        time.sleep(0.001)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def fake_xps():
+    server = FakeXPS()
+    yield server
+    server.close()
+
+
+def test_reply_split_across_packets(fake_xps):
+    xps = XPS()
+    sID = xps.TCP_ConnectToServer("127.0.0.1", fake_xps.port, 1.)
+    assert sID >= 0
+    assert xps.errorcodes["0"] == "Success"
+    fake_xps.position = 1.5
+    err, ret = xps.GroupPositionCurrentGet(sID, "Group1", 1)
+    assert (err, ret) == ("0", "1.5")
+    xps.TCP_CloseSocket(sID)
+
+
+def test_status_not_blocked_by_move(fake_xps):
+    xps = XPS()
+    status_sID = xps.TCP_ConnectToServer("127.0.0.1", fake_xps.port, 2.)
+    pool = XPSSocketPool(xps, "127.0.0.1", 2, 2., port=fake_xps.port)
+
+    t0 = time.time()
+    th = threading.Thread(target=pool.call, args=(xps.GroupMoveAbsolute, "Group1.Pos", [2.0]))
+    th.start()
+    time.sleep(0.05)
+    err, ret = xps.GroupMotionStatusGet(status_sID, "Group1", 1)
+    assert err == "0"
+    assert time.time()-t0 < fake_xps.move_time
+
+    # the second pooled socket is free for another command
+    err, ret = pool.call(xps.GroupMotionStatusGet, "Group1", 1)
+    assert err == "0"
+    assert time.time()-t0 < fake_xps.move_time
+
+    th.join()
+    assert xps.GroupPositionCurrentGet(status_sID, "Group1", 1) == ["0", "2.0"]
+    pool.close()
+    xps.TCP_CloseSocket(status_sID)